@@ -0,0 +1,72 @@
+"""
+Cache of rendered coop fragments.
+
+Datastore coops aren't versioned, but every put() updates ``modified``, so
+the HTML for a coop's detail page or list row is cached in memcache (the
+'memcached://' CACHE_BACKEND, installed by InstallGoogleMemcache) under the
+coop's id and modification time.  Saving the coop changes the key, so the
+old fragment is simply never read again.
+
+Lookups are counted per instance; stats() returns the counts.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+FRAGMENTS = ('detail', 'row')
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def timeout():
+    return getattr(settings, 'COOP_FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+def fragment_key(name, coop):
+    return 'coops.fragment.%s.%s.%s' % (name, coop.key().id(),
+            coop.modified.isoformat())
+
+def get_fragment(name, coop):
+    """
+    Returns the cached fragment ``name`` of a coop, or None.  Fragments
+    fetched beforehand by get_fragments are used first.
+    """
+    preloaded = getattr(coop, '_fragments', {})
+    if name in preloaded:
+        html = preloaded.pop(name)
+    else:
+        html = cache.get(fragment_key(name, coop))
+    _count(html)
+    return html
+
+def get_fragments(name, coops):
+    """
+    Fetches fragment ``name`` of many coops with a single memcache call, so
+    that get_fragment finds them without going back to memcache.  Returns
+    the coops whose fragment isn't cached.
+    """
+    keys = dict([(fragment_key(name, coop), coop) for coop in coops])
+    found = cache.get_many(keys.keys())
+    for key, html in found.items():
+        coop = keys[key]
+        if not hasattr(coop, '_fragments'):
+            coop._fragments = {}
+        coop._fragments[name] = html
+    return [coop for coop in coops if fragment_key(name, coop) not in found]
+
+def set_fragment(name, coop, html):
+    cache.set(fragment_key(name, coop), html, timeout())
+
+def _count(html):
+    if html is None:
+        _stats['misses'] += 1
+    else:
+        _stats['hits'] += 1
+
+def stats():
+    """
+    Returns the fragment cache hits and misses of this instance.
+    """
+    return dict(_stats)
+
+def reset_stats():
+    _stats['hits'] = _stats['misses'] = 0
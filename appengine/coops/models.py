@@ -3,12 +3,20 @@
 # from django.contrib.auth.db import User
 # 
 # from django.core.files.storage import FileSystemStorage
-# 
-# from sorl.thumbnail.fields import ImageWithThumbnailsField
+
+import re
 
 from appengine_django.models import BaseModel
 from google.appengine.ext import db
 
+from sorl.thumbnail.datastore import ImageWithThumbnailsProperty
+
+term_re = re.compile(r'\w+', re.UNICODE)
+
+def tokenize(text):
+    """Splits text into lower case search terms."""
+    return term_re.findall((text or u'').lower())
+
 class Coop(BaseModel):
     created = db.DateTimeProperty(required = True, auto_now_add = True)
     modified = db.DateTimeProperty(required = True, auto_now = True)
@@ -19,19 +27,30 @@ class Coop(BaseModel):
     phone = db.PhoneNumberProperty(required = False)
     email = db.EmailProperty()
 
+    # Search terms from the name and address.  The datastore indexes each
+    # list item, so an equality filter per term finds matching coops without
+    # a scan.
+    terms = db.StringListProperty()
+
+    def put(self):
+        self.terms = list(set(tokenize(self.name) + tokenize(self.address)))
+        return super(Coop, self).put()
+
     # number_of_residents = db.IntegerField(blank = True, null = True)
     # average_rent = db.CharField(max_length = 50, blank = True)
     # description = db.TextField(blank = True,
     #         help_text = 'Tell us about your coop, and what makes it special.')
     # founded = db.IntegerField(blank = True, null = True,
     #         help_text = 'When was your coop started?')
-    # 
-    # picture = ImageWithThumbnailsField(blank = True, null = True,
-    #         upload_to = "uploads/coop_pictures/%Y/%m/", 
-    #         thumbnail = {'size': (100, 100)},
-    #         extra_thumbnails = {
-    #             'large': {'size': (400, 400)},
-    #         })
+
+    # The picture and its thumbnails are kept in the datastore (see
+    # THUMBNAIL_STORAGE in settings.py).
+    picture = ImageWithThumbnailsProperty(
+            upload_to = "uploads/coop_pictures/%Y/%m/",
+            thumbnail = {'size': (100, 100)},
+            extra_thumbnails = {
+                'large': {'size': (400, 400)},
+            })
 
     # organization = db.ForeignKey('Organization', 
     #         blank = True, null = True, 
@@ -0,0 +1,71 @@
+"""
+Pagination with native datastore cursors.
+
+django.core.paginator.Paginator calls count() on the query and then reads
+each page with an offset, which the datastore implements by skipping over
+every earlier result.  DatastoreCursorPaginator resumes the query from the
+cursor left by the previous page instead, so every page costs the same.
+
+The page methods keep Paginator's names so _pagination.html can render
+either kind; it checks ``paginator.uses_cursors`` to leave out the numbered
+links.  Datastore cursors only run forwards, so "previous" goes back to the
+first page.
+"""
+
+from django.core.paginator import InvalidPage
+
+
+class DatastoreCursorPaginator(object):
+    uses_cursors = True
+
+    def __init__(self, query, per_page):
+        self.query = query
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """
+        Returns the page that a cursor from a previous page points at, or
+        the first page if ``cursor`` is empty.
+        """
+        if cursor:
+            try:
+                self.query.with_cursor(str(cursor))
+            except Exception:
+                raise InvalidPage("That page cursor is not valid.")
+        object_list = self.query.fetch(self.per_page)
+        return DatastoreCursorPage(object_list, self, bool(cursor),
+                self.query.cursor())
+
+
+class DatastoreCursorPage(object):
+    def __init__(self, object_list, paginator, has_previous, next_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._next_cursor = next_cursor
+
+    def __repr__(self):
+        return '<Page of %s objects>' % len(self.object_list)
+
+    def has_next(self):
+        # A full page may be followed by an empty one; finding out for sure
+        # would cost another fetch.
+        return len(self.object_list) == self.paginator.per_page
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        """
+        The cursor of the next page.
+        """
+        return self._next_cursor
+
+    def previous_page_number(self):
+        """
+        The first page; see the module docstring.
+        """
+        return ''
@@ -2,7 +2,11 @@ from django.core.paginator import Paginator
 from django.http import HttpResponse
 from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
-from coops.models import Coop
+from coops.models import Coop, tokenize
+from coops.paginator import DatastoreCursorPaginator
+from coops.fragments import get_fragments
+from django.conf import settings
+import urllib
 from django import forms
 
 class CoopForm(forms.Form):
@@ -36,14 +40,34 @@ def coop_add(request):
     return render_to_response('coops/add.html', {'form': form})
 
 def coop_list(request):
-    # TODO: parse GET search parameters
-    coops = Coop.all().order('-modified')
-    paginator = Paginator(coops, 10)
-    page = paginator.page(request.GET.get('p', 1))
+    query = request.GET.get('q', '').strip()
+    terms = list(set(tokenize(query)))
+    if terms:
+        # Equality filters on one list property are merge-joined by the
+        # datastore and need no composite index, as long as we don't sort.
+        coops = Coop.all()
+        for term in terms:
+            coops.filter('terms =', term)
+        querystring = urllib.urlencode({'q': query.encode('utf-8')})
+    else:
+        coops = Coop.all().order('-modified')
+        querystring = ''
+    if getattr(settings, 'COOP_LIST_PAGINATION', 'cursor') == 'cursor':
+        paginator = DatastoreCursorPaginator(coops, 10)
+        page = paginator.page(request.GET.get('p'))
+        first_item_number = None
+    else:
+        paginator = Paginator(coops, 10)
+        page = paginator.page(request.GET.get('p', 1))
+        first_item_number = paginator.per_page * (page.number - 1) + 1
+    # One memcache call for every row's cached fragment.
+    page.object_list = list(page.object_list)
+    get_fragments('row', page.object_list)
     return render_to_response('coops/list.html', {
         'page': page,
-        'querystring': '',
-        'first_item_number': paginator.per_page * (page.number - 1) + 1
+        'query': query,
+        'querystring': querystring,
+        'first_item_number': first_item_number
     })
 
 def index(request):
@@ -107,5 +107,19 @@ INSTALLED_APPS = (
      # admin does not work under google apps
 )
 
+# How coop_list pages through coops: 'cursor' (datastore cursors; next and
+# first page links) or 'numbered' (links to every page; counts all coops).
+COOP_LIST_PAGINATION = 'cursor'
+
+# Rendered coop detail pages and list rows are cached in memcache for this
+# many seconds.
+CACHE_BACKEND = 'memcached://'
+COOP_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# There is no writable filesystem, so pictures and their thumbnails are kept
+# in the datastore and served from /thumbnails/ (see urls.py).
+THUMBNAIL_STORAGE = 'sorl.thumbnail.datastore.DatastoreStorage'
+THUMBNAIL_STORAGE_URL = '/thumbnails/'
+
 PBLOGS_ROOT = '/blogs/'
 PBLOGS_MEDIA_ROOT = '/dev_media/blogs/'
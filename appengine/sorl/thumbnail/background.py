@@ -0,0 +1,147 @@
+"""
+Background thumbnail generation.
+
+With THUMBNAIL_BACKGROUND set, a DjangoThumbnail which would have to be
+generated is queued here instead, and renders with a placeholder until a
+worker thread has made it.  PIL releases the interpreter lock while it
+decodes and resizes, so a few threads keep generation off the request
+without needing a separate process.
+
+A thumbnail (source, size, options, quality and format) that is already
+queued or being made isn't queued again.
+
+Output rendered with a placeholder is out of date as soon as the worker has
+made the thumbnail, so caches of rendered output shouldn't keep it; they
+can compare placeholders_shown() before and after rendering to tell.
+"""
+
+import logging
+import threading
+import Queue
+
+from sorl.thumbnail.base import Thumbnail, ThumbnailException
+from sorl.thumbnail import metadata, manifest
+
+
+log = logging.getLogger('sorl.thumbnail.background')
+
+_shown = threading.local()
+
+
+def placeholder_shown():
+    """
+    Records that a thumbnail rendered with its placeholder in this thread.
+    """
+    _shown.count = placeholders_shown() + 1
+
+
+def placeholders_shown():
+    """
+    Returns how many thumbnails have rendered with their placeholder in
+    this thread.
+    """
+    return getattr(_shown, 'count', 0)
+
+
+class ThumbnailQueue(object):
+    def __init__(self, workers):
+        self.workers = workers
+        self.jobs = Queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def _start(self):
+        # Called with the lock held.  Threads which have died are replaced.
+        self.threads = [thread for thread in self.threads
+                        if thread.isAlive()]
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, thumbnail):
+        """
+        Queues generation of a DjangoThumbnail.  Returns False if the same
+        thumbnail is already queued.
+        """
+        key = (thumbnail.source, tuple(thumbnail.requested_size),
+               tuple(thumbnail.opts), thumbnail.quality, thumbnail.format)
+        self.lock.acquire()
+        try:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            self._start()
+        finally:
+            self.lock.release()
+        self.jobs.put((key, dict(
+            source=thumbnail.source, dest=thumbnail.dest,
+            requested_size=thumbnail.requested_size, opts=thumbnail.opts,
+            quality=thumbnail.quality, convert_path=thumbnail.convert_path,
+            wvps_path=thumbnail.wvps_path, processors=thumbnail.processors,
+            format=thumbnail.format, storage=thumbnail.storage)))
+        return True
+
+    def is_pending(self, thumbnail):
+        key = (thumbnail.source, tuple(thumbnail.requested_size),
+               tuple(thumbnail.opts), thumbnail.quality, thumbnail.format)
+        return key in self.pending
+
+    def _work(self):
+        while True:
+            key, kwargs = self.jobs.get()
+            try:
+                try:
+                    generate(**kwargs)
+                except ThumbnailException:
+                    # It will be tried again the next time it is rendered.
+                    pass
+                except Exception:
+                    # Neither is anything else, but it mustn't stop the
+                    # worker from making the thumbnails queued after it.
+                    log.exception('Generating %s failed', kwargs['dest'])
+            finally:
+                self.lock.acquire()
+                try:
+                    self.pending.discard(key)
+                finally:
+                    self.lock.release()
+                self.jobs.task_done()
+
+    def join(self):
+        """
+        Waits until every queued thumbnail has been generated.
+        """
+        self.jobs.join()
+
+
+def generate(**kwargs):
+    """
+    Generates a thumbnail (Thumbnail generates as soon as it has a dest),
+    caches its metadata and records it in the manifest if that is on.
+    """
+    thumbnail = Thumbnail(**kwargs)
+    metadata.set_metadata(thumbnail.dest, thumbnail.size,
+                          thumbnail.filesize,
+                          thumbnail.storage.mtime(thumbnail.source))
+    if manifest.enabled():
+        manifest.record(thumbnail)
+    return thumbnail
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    global _queue
+    _queue_lock.acquire()
+    try:
+        if _queue is None:
+            from sorl.thumbnail.main import get_thumbnail_setting
+            _queue = ThumbnailQueue(
+                get_thumbnail_setting('BACKGROUND_WORKERS'))
+        return _queue
+    finally:
+        _queue_lock.release()
@@ -1,13 +1,13 @@
-import os
-from os.path import isfile, isdir, getmtime, dirname, splitext, getsize
-from tempfile import mkstemp
-from shutil import copyfile
-from subprocess import Popen, PIPE
+from os.path import splitext
+from cStringIO import StringIO
 
 from PIL import Image, ImageFilter
 
 from sorl.thumbnail import defaults
-from sorl.thumbnail.processors import get_valid_options, dynamic_import
+from sorl.thumbnail.documents import get_rasterizer, ConversionError
+from sorl.thumbnail.formats import OUTPUT_FORMATS, ALPHA_FORMATS
+from sorl.thumbnail.processors import dynamic_import, normalize_options
+from sorl.thumbnail.storage import local_storage
 
 
 class ThumbnailException(Exception):
@@ -17,13 +17,16 @@ class ThumbnailException(Exception):
 class Thumbnail(object):
     def __init__(self, source, requested_size, opts=None, quality=85,
                  dest=None, convert_path=defaults.CONVERT,
-                 wvps_path=defaults.WVPS, processors=None):
+                 wvps_path=defaults.WVPS, processors=None,
+                 format=defaults.FORMAT, storage=None):
         # Paths to external commands
         self.convert_path = convert_path
         self.wvps_path = wvps_path
-        # Absolute paths to files
+        # Names of the files in the storage (absolute paths, for the default
+        # local storage)
         self.source = source
         self.dest = dest
+        self.storage = storage or local_storage
 
         # Thumbnail settings
         self.requested_size = requested_size
@@ -31,21 +34,22 @@ class Thumbnail(object):
             raise TypeError('Thumbnail received invalid value for quality '
                             'argument: %s' % quality)
         self.quality = quality
+        if format not in OUTPUT_FORMATS:
+            raise TypeError('Thumbnail received an invalid format: %s'
+                            % format)
+        self.format = format
+
+        # Set when source_data isn't the source file's image as it is (see
+        # generate_batch), so the source file can't be copied instead.
+        self.source_altered = False
 
         # Processors
         if processors is None:
             processors = dynamic_import(defaults.PROCESSORS)
         self.processors = processors
 
-        # Set Thumbnail opt(ion)s
-        VALID_OPTIONS = get_valid_options(processors)
-        opts = opts or []
-        # Check that all options received are valid
-        for opt in opts:
-            if not opt in VALID_OPTIONS:
-                raise TypeError('Thumbnail received an invalid option: %s'
-                                % opt)
-        self.opts = [opt for opt in VALID_OPTIONS if opt in opts]
+        # Set Thumbnail opt(ion)s, checked and in the processors' order
+        self.opts = normalize_options(processors, opts)
 
         if self.dest is not None:
             self.generate()
@@ -63,16 +67,28 @@ class Thumbnail(object):
             # We'll assume dest is a file-like instance if it exists but isn't
             # a string.
             self._do_generate()
-        elif not isfile(self.dest) or (self.source_exists and
-            getmtime(self.source) > getmtime(self.dest)):
-
-            # Ensure the directory exists
-            directory = dirname(self.dest)
-            if not isdir(directory):
-                os.makedirs(directory)
-
+        elif self.needs_generating():
             self._do_generate()
 
+    def needs_generating(self, mtimes=None):
+        """
+        Returns True if the thumbnail file doesn't exist or is older than
+        the source file.  The modification times are looked up in one go,
+        unless they are given (see generate_batch).
+        """
+        if mtimes is None:
+            names = [self.dest]
+            if isinstance(self.source, basestring):
+                names.append(self.source)
+            mtimes = self.storage.mtimes(names)
+        dest_mtime = mtimes[self.dest]
+        if dest_mtime is None:
+            return True
+        if not isinstance(self.source, basestring):
+            return False
+        self._source_exists = mtimes[self.source] is not None
+        return self._source_exists and mtimes[self.source] > dest_mtime
+
     def _check_source_exists(self):
         """
         Ensure the source file exists. If source is not a string then it is
@@ -81,7 +97,7 @@ class Thumbnail(object):
         if not hasattr(self, '_source_exists'):
             self._source_exists = (self.source and
                                    (not isinstance(self.source, basestring) or
-                                    isfile(self.source)))
+                                    self.storage.exists(self.source)))
         return self._source_exists
     source_exists = property(_check_source_exists)
 
@@ -95,6 +111,9 @@ class Thumbnail(object):
                 # Assuming a file-like object - we won't know it's type.
                 return None
             try:
+                if not self.storage.local:
+                    # magic can only look at local files.
+                    raise ImportError
                 import magic
             except ImportError:
                 self._source_filetype = splitext(self.source)[1].lower().\
@@ -117,8 +136,11 @@ class Thumbnail(object):
     # data property is the image data of the (generated) thumbnail
     def _get_data(self):
         if not hasattr(self, '_data'):
+            dest = self.dest
             try:
-                self._data = Image.open(self.dest)
+                if isinstance(dest, basestring):
+                    dest = self.storage.open(dest)
+                self._data = Image.open(dest)
             except IOError, detail:
                 raise ThumbnailException(detail)
         return self._data
@@ -132,10 +154,11 @@ class Thumbnail(object):
             if not self.source_exists:
                 raise ThumbnailException("Source file: '%s' does not exist." %
                                          self.source)
-            if self.source_filetype == 'doc':
-                self._convert_wvps(self.source)
-            elif self.source_filetype == 'pdf':
-                self._convert_imagemagick(self.source)
+            if self.source_filetype in ('doc', 'pdf'):
+                if not self.storage.local:
+                    raise ThumbnailException("Documents can only be "
+                                             "rasterized from local files.")
+                self._rasterize()
             else:
                 self.source_data = self.source
         return self._source_data
@@ -145,38 +168,28 @@ class Thumbnail(object):
             self._source_data = image
         else:
             try:
+                if isinstance(image, basestring):
+                    image = self.storage.open(image)
                 self._source_data = Image.open(image)
             except IOError, detail:
                 raise ThumbnailException("%s: %s" % (detail, image))
+            # Remember the size before scale_and_crop gets to decode the
+            # image at a reduced scale.
+            self._source_size = self._source_data.size
     source_data = property(_get_source_data, _set_source_data)
 
-    def _convert_wvps(self, filename):
-        tmp = mkstemp('.ps')[1]
-        try:
-            p = Popen((self.wvps_path, filename, tmp), stdout=PIPE)
-            p.wait()
-        except OSError, detail:
-            os.remove(tmp)
-            raise ThumbnailException('wvPS error: %s' % detail)
-        self._convert_imagemagick(tmp)
-        os.remove(tmp)
-
-    def _convert_imagemagick(self, filename):
-        tmp = mkstemp('.png')[1]
+    def _rasterize(self):
         if 'crop' in self.opts or 'autocrop' in self.opts:
-            x,y = [d*3 for d in self.requested_size]
+            size = [d*3 for d in self.requested_size]
         else:
-            x,y = self.requested_size
+            size = self.requested_size
         try:
-            p = Popen((self.convert_path, '-size', '%sx%s' % (x,y),
-                '-antialias', '-colorspace', 'rgb', '-format', 'PNG24',
-                '%s[0]' % filename, tmp), stdout=PIPE)
-            p.wait()
-        except OSError, detail:
-            os.remove(tmp)
-            raise ThumbnailException('ImageMagick error: %s' % detail)
-        self.source_data = tmp
-        os.remove(tmp)
+            self.source_data = get_rasterizer().rasterize(self.source,
+                self.source_filetype, size, convert_path=self.convert_path,
+                wvps_path=self.wvps_path)
+        except ConversionError, detail:
+            raise ThumbnailException(detail)
+        self._source_size = self._source_data.size
 
     def _do_generate(self):
         """
@@ -192,26 +205,56 @@ class Thumbnail(object):
 
         self.data = im
 
-        if self.source_data == self.data and self.source_filetype == 'jpg':
-            copyfile(self.source, self.dest)
+        pil_format, ext, mime_type, options = OUTPUT_FORMATS[self.format]
+        if not self.source_altered and self.source_data == self.data and \
+           self.source_filetype == 'jpg' and self.format == 'jpeg' and \
+           isinstance(self.dest, basestring):
+            self.storage.copy(self.source, self.dest)
         else:
+            if pil_format not in ALPHA_FORMATS and \
+               im.mode not in ('L', 'RGB'):
+                im = im.convert(im.mode == 'LA' and 'L' or 'RGB')
             try:
-                im.save(self.dest, "JPEG", quality=self.quality, optimize=1)
+                output = self._save(im, pil_format, options)
             except IOError:
                 # Try again, without optimization (the JPEG library can't
                 # optimize an image which is larger than ImageFile.MAXBLOCK
                 # which is 64k by default)
+                options = options.copy()
+                options.pop('optimize', None)
                 try:
-                    im.save(self.dest, "JPEG", quality=self.quality)
+                    output = self._save(im, pil_format, options)
                 except IOError, detail:
                     raise ThumbnailException(detail)
+            if output is not None:
+                self.storage.save(self.dest, output)
+
+    def _save(self, im, pil_format, options):
+        """
+        Saves the thumbnail image to dest if it is a file-like object, and
+        returns the thumbnail's file data to store otherwise.
+        """
+        if not isinstance(self.dest, basestring):
+            im.save(self.dest, pil_format, quality=self.quality, **options)
+            return None
+        output = StringIO()
+        im.save(output, pil_format, quality=self.quality, **options)
+        return output.getvalue()
 
     # Some helpful methods
 
+    def _get_size(self):
+        if self.dest is None:
+            return None
+        if not hasattr(self, '_size'):
+            self._size = self.data.size
+        return self._size
+    size = property(_get_size)
+
     def _dimension(self, axis):
         if self.dest is None:
             return None
-        return self.data.size[axis]
+        return self.size[axis]
 
     def width(self):
         return self._dimension(0)
@@ -223,15 +266,21 @@ class Thumbnail(object):
         if self.dest is None:
             return None
         if not hasattr(self, '_filesize'):
-            self._filesize = getsize(self.dest)
+            self._filesize = self.storage.size(self.dest)
         return self._filesize
     filesize = property(_get_filesize)
 
+    def _get_source_size(self):
+        if not hasattr(self, '_source_size'):
+            self._source_size = self.source_data.size
+        return self._source_size
+    source_size = property(_get_source_size)
+
     def _source_dimension(self, axis):
         if self.source_filetype in ['pdf', 'doc']:
             return None
         else:
-            return self.source_data.size[axis]
+            return self.source_size[axis]
 
     def source_width(self):
         return self._source_dimension(0)
@@ -241,6 +290,111 @@ class Thumbnail(object):
 
     def _get_source_filesize(self):
         if not hasattr(self, '_source_filesize'):
-            self._source_filesize = getsize(self.source)
+            self._source_filesize = self.storage.size(self.source)
         return self._source_filesize
     source_filesize = property(_get_source_filesize)
+
+
+# Options which change more than the size of an image.  Thumbnails without
+# them can be made from a larger one of the same source.
+CASCADE_EXCLUDED_OPTIONS = ('crop', 'autocrop', 'upscale', 'detail', 'sharpen')
+
+
+def _scaled_size(size, thumbnail):
+    """
+    Returns the size scale_and_crop scales an image of ``size`` to for a
+    thumbnail, before any cropping.
+    """
+    x, y = [float(v) for v in size]
+    xr, yr = [float(v) for v in thumbnail.requested_size]
+    if 'crop' in thumbnail.opts:
+        r = max(xr/x, yr/y)
+    else:
+        r = min(xr/x, yr/y)
+    if r > 1.0 and 'upscale' not in thumbnail.opts:
+        r = 1.0
+    return (int(x*r), int(y*r))
+
+
+def generate_batch(thumbnails):
+    """
+    Generates several thumbnails of the same source, decoding the source
+    only once.
+
+    Each thumbnail must have its dest set and not have been generated, and
+    they must share a storage, which is asked for all their modification
+    times at once.
+    JPEG sources are decoded straight at the smallest scale which still
+    covers the largest thumbnail (PIL's draft mode), and thumbnails without
+    content-changing options are scaled from the next larger such thumbnail
+    rather than from the source.
+
+    Returns the thumbnails which were generated; the rest were up to date.
+    """
+    if not thumbnails:
+        return []
+    names = set()
+    for thumbnail in thumbnails:
+        for name in (thumbnail.dest, thumbnail.source):
+            if isinstance(name, basestring):
+                names.add(name)
+    mtimes = thumbnails[0].storage.mtimes(list(names))
+    todo = [thumbnail for thumbnail in thumbnails
+            if not isinstance(thumbnail.dest, basestring) or
+            thumbnail.needs_generating(mtimes)]
+    if not todo:
+        return []
+    # Largest first, so smaller thumbnails can be scaled from larger ones
+    # (and documents are rasterized big enough for all of them).
+    todo.sort(key=lambda t: -t.requested_size[0] * t.requested_size[1])
+    source = todo[0].source_data
+    source_size = source.size
+    if source.format == 'JPEG' and not \
+       [t for t in todo if 'autocrop' in t.opts]:
+        sizes = [_scaled_size(source_size, t) for t in todo]
+        source.draft(source.mode, (max([x for x, y in sizes]),
+                                   max([y for x, y in sizes])))
+    # Decode now, so that scale_and_crop doesn't reduce the shared image
+    # further for the first thumbnail.
+    source.load()
+
+    previous = None
+    for thumbnail in todo:
+        im = source
+        cascade = not [opt for opt in thumbnail.opts
+                       if opt in CASCADE_EXCLUDED_OPTIONS]
+        if cascade and previous is not None and \
+           previous.opts == thumbnail.opts:
+            x, y = _scaled_size(source_size, thumbnail)
+            px, py = previous.data.size
+            if px >= x and py >= y:
+                im = previous.data
+        thumbnail.source_data = im
+        thumbnail._source_size = source_size
+        thumbnail.source_altered = im is not source or im.size != source_size
+        thumbnail._do_generate()
+        if cascade:
+            previous = thumbnail
+    return todo
+
+
+def batch(source, specs, **kwargs):
+    """
+    Generates thumbnails of one source for a list of specs, decoding the
+    source only once (see generate_batch).
+
+    Each spec is a dictionary of Thumbnail arguments, which must include
+    ``requested_size`` and ``dest``.  Other keyword arguments are passed to
+    every Thumbnail.  Returns the Thumbnail instances, in spec order.
+    """
+    thumbnails = []
+    for spec in specs:
+        spec = spec.copy()
+        dest = spec.pop('dest')
+        options = kwargs.copy()
+        options.update(spec)
+        thumbnail = Thumbnail(source, **options)
+        thumbnail.dest = dest
+        thumbnails.append(thumbnail)
+    generate_batch(thumbnails)
+    return thumbnails
@@ -0,0 +1,395 @@
+"""
+Benchmarks for sorl.thumbnail.
+
+Run them with ``bin/thumbnail_benchmark.py [--rounds=N] [--json] [name ...]``.
+Like the coops benchmarks, every benchmark is a function in ``BENCHMARKS``
+which takes the number of rounds to run and returns a list of ``(label,
+value)`` rows to report; ``--json`` reports them (or the fuller records of
+the benchmarks in ``RECORDS``) as JSON instead.  They don't need a Django
+settings module; sources and thumbnails are written to a temporary
+directory.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+from cStringIO import StringIO
+from tempfile import mkdtemp
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PIL import Image, ImageDraw
+
+from sorl.thumbnail import defaults, processors as processors_module
+from sorl.thumbnail.base import Thumbnail, batch
+from sorl.thumbnail.processors import dynamic_import, get_valid_options, \
+     scale_and_crop
+
+
+def synthetic_image(size, mode='RGB'):
+    """
+    Returns an image with some detail in it (lines crossing on a plain
+    border), so that it compresses, resizes and autocrops like a photograph
+    rather than a flat colour.
+    """
+    im = Image.new(mode, size, 'white')
+    draw = ImageDraw.Draw(im)
+    x, y = size
+    mx, my = x / 20, y / 20
+    for i in range(mx, x - mx, 8):
+        draw.line((i, my, x - i, y - my), fill=i % 200)
+    for i in range(my, y - my, 8):
+        draw.line((mx, i, x - mx, y - i), fill=(i * 3) % 200)
+    return im
+
+
+def make_source(filename, size, mode='RGB', format='JPEG'):
+    synthetic_image(size, mode).save(filename, format)
+    return filename
+
+
+class TempDir(object):
+    def __init__(self):
+        self.path = mkdtemp()
+
+    def join(self, *names):
+        return os.path.join(self.path, *names)
+
+    def clean(self):
+        shutil.rmtree(self.path)
+
+
+BATCH_SPECS = (
+    {'requested_size': (400, 400)},
+    {'requested_size': (100, 100)},
+    {'requested_size': (100, 100), 'opts': ['crop']},
+)
+
+
+def thumbnail_batch(rounds=10):
+    """
+    Time per source to make every size in BATCH_SPECS of a 3000x2000 JPEG,
+    with a Thumbnail per size and with one batch.
+    """
+    tmp = TempDir()
+    try:
+        source = make_source(tmp.join('source.jpg'), (3000, 2000))
+
+        def specs(round):
+            specs = []
+            for i, spec in enumerate(BATCH_SPECS):
+                spec = spec.copy()
+                spec['dest'] = tmp.join('thumb_%d_%d.jpg' % (round, i))
+                specs.append(spec)
+            return specs
+
+        results = []
+        started = time.time()
+        for round in range(rounds):
+            for spec in specs(round):
+                Thumbnail(source, **spec)
+        separate = (time.time() - started) * 1000 / rounds
+        results.append(("separate Thumbnails: ms/source", separate))
+
+        started = time.time()
+        for round in range(rounds):
+            batch(source, specs(rounds + round))
+        batched = (time.time() - started) * 1000 / rounds
+        results.append(("batch: ms/source", batched))
+        results.append(("batch: speedup", separate / batched))
+    finally:
+        tmp.clean()
+    return results
+
+
+LARGE_SOURCES = (
+    ('12MP JPEG', (4000, 3000), 'JPEG', 'jpg'),
+    ('12MP PNG', (4000, 3000), 'PNG', 'png'),
+)
+
+
+def reduced_decode(rounds=5):
+    """
+    Time and peak memory per 100x100 thumbnail of large sources, decoding
+    the whole source first (as scale_and_crop used to get it) and leaving
+    scale_and_crop to decode at a reduced scale.  Memory is how far the
+    peak resident memory of a fresh process grows (see peak_rss_kb).
+    """
+    tmp = TempDir()
+    results = []
+    try:
+        for label, size, format, ext in LARGE_SOURCES:
+            source = make_source(tmp.join('source.%s' % ext), size,
+                                 format=format)
+            for path, preload in (('full decode', True),
+                                  ('reduced decode', False)):
+                started = time.time()
+                for round in range(rounds):
+                    im = Image.open(source)
+                    if preload:
+                        im.load()
+                    scale_and_crop(im, (100, 100), [])
+                results.append(("%s, %s: ms/thumbnail" % (label, path),
+                                (time.time() - started) * 1000 / rounds))
+                peak = peak_rss_kb(source, [scale_and_crop], (100, 100), [],
+                                   preload=preload)
+                if peak is not None:
+                    results.append(("%s, %s: peak MB/thumbnail" %
+                                    (label, path), peak / 1024.0))
+    finally:
+        tmp.clean()
+    return results
+
+
+CHAIN_SIZES = ((320, 240), (1600, 1200))
+CHAIN_MODES = ('RGB', 'L', 'RGBA')
+CHAIN_FORMATS = ('JPEG', 'PNG')
+CHAIN_REQUESTED_SIZE = (100, 100)
+
+
+def option_combinations(options):
+    """
+    Returns every combination of ``options`` (including none), each in the
+    order given.
+    """
+    combinations = [[]]
+    for option in options:
+        combinations += [c + [option] for c in combinations]
+    combinations.sort(key=lambda c: (len(c), [options.index(o) for o in c]))
+    return combinations
+
+
+def _default_settings():
+    # Processors like fast_autocrop read their settings through Django.
+    from django.conf import settings
+    if not settings.configured and \
+       not os.environ.get('DJANGO_SETTINGS_MODULE'):
+        settings.configure()
+
+
+def _max_rss():
+    """
+    The process's peak resident memory in kilobytes, where it can be told.
+    Linux's own figure is preferred, as its ru_maxrss starts at the peak of
+    the process which started this one.
+    """
+    try:
+        status = open('/proc/self/status')
+        try:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+        finally:
+            status.close()
+    except IOError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes there.
+        rss /= 1024
+    return rss
+
+
+def _measure_main(argv):
+    # Runs in the fresh process started by peak_rss_kb.
+    filename, names, size, opts, load = argv
+    _default_settings()
+    processors = dynamic_import(names.split(','))
+    requested_size = [int(v) for v in size.split('x')]
+    opts = [opt for opt in opts.split(',') if opt]
+    im = Image.open(filename)
+    if load == 'loaded':
+        im.load()
+    before = _max_rss()
+    if load == 'preload':
+        im.load()
+    for processor in processors:
+        im = processor(im, requested_size, opts)
+    sys.stdout.write('%d\n' % (_max_rss() - before))
+
+
+def peak_rss_kb(filename, processors, requested_size, opts, loaded=False,
+                preload=False):
+    """
+    Runs ``processors`` on the image in ``filename`` in a fresh Python
+    process, and returns how many kilobytes its peak resident memory grew
+    by while they ran (None where that can't be told).  With
+    ``loaded``, the image is decoded before measuring, as it would be when
+    an earlier processor had needed its pixels; otherwise decoding it is
+    counted too.  With ``preload``, it is decoded in full before the
+    processors are given it, rather than as they need it.
+    """
+    if _max_rss() is None:
+        return None
+    names = ','.join(['%s.%s' % (p.__module__, p.__name__)
+                      for p in processors])
+    args = [sys.executable, '-c',
+            'import sys; from sorl.thumbnail.benchmarks import '
+            '_measure_main; _measure_main(sys.argv[1:])',
+            filename, names, '%dx%d' % tuple(requested_size), ','.join(opts),
+            loaded and 'loaded' or preload and 'preload' or 'lazy']
+    env = os.environ.copy()
+    env['PYTHONPATH'] = os.pathsep.join([path for path in sys.path if path])
+    child = subprocess.Popen(args, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, env=env)
+    out, err = child.communicate()
+    if child.returncode:
+        raise RuntimeError('Measuring %s failed: %s' % (names, err))
+    return int(out)
+
+
+def processor_chains():
+    """
+    Returns the default processor chain, followed by a chain for every
+    other processor in sorl.thumbnail.processors: the default chain with
+    it in place of the processor taking the same options (fast_autocrop in
+    place of autocrop), or added to the end.
+    """
+    default = dynamic_import(defaults.PROCESSORS)
+    chains = [default]
+    for name in sorted(dir(processors_module)):
+        processor = getattr(processors_module, name)
+        if not hasattr(processor, 'valid_options') or processor in default:
+            continue
+        chain = []
+        for other in default:
+            if set(processor.valid_options) & \
+               set(getattr(other, 'valid_options', ())):
+                other = processor
+            chain.append(other)
+        if processor not in chain:
+            chain.append(processor)
+        chains.append(chain)
+    return chains
+
+
+def processor_chain_records(rounds=1, chains=None, sizes=CHAIN_SIZES,
+                            modes=CHAIN_MODES, formats=CHAIN_FORMATS,
+                            requested_size=CHAIN_REQUESTED_SIZE, memory=True):
+    """
+    Runs every processor chain (by default, those of processor_chains) on
+    synthetic sources of every size, mode and format, with every
+    combination of the chain's valid options.
+
+    Returns a list of records, one per chain, source and option
+    combination::
+
+        {'size': [1600, 1200], 'mode': 'RGB', 'format': 'JPEG',
+         'options': ['crop'], 'output_bytes': 3175,
+         'stages': [{'processor': 'colorspace', 'ms': 0.01,
+                     'peak_kb': 7508}, ...]}
+
+    ``ms`` is averaged over ``rounds``.  A stage's ``peak_kb`` is measured
+    with peak_rss_kb, each in a fresh process given the image the earlier
+    stages made, so it counts every copy the processor makes (and decoding,
+    for the stage which first needs the source's pixels).  That takes a
+    process per stage; without ``memory`` it is left out (None).
+    ``output_bytes`` is the size of the result saved as a JPEG at the
+    default quality.
+    """
+    _default_settings()
+    if chains is None:
+        chains = processor_chains()
+    tmp = TempDir()
+    records = []
+    try:
+        for size in sizes:
+            for mode in modes:
+                for format in formats:
+                    if format == 'JPEG' and mode == 'RGBA':
+                        continue
+                    source = make_source(tmp.join('source.%s' % format),
+                                         size, mode, format)
+                    for processors in chains:
+                        combinations = option_combinations(
+                            get_valid_options(processors))
+                        for opts in combinations:
+                            record = _run_chain(source, processors, opts,
+                                                requested_size, rounds)
+                            if memory:
+                                _measure_chain(record, source, processors,
+                                               opts, requested_size, tmp)
+                            record.update({'size': list(size), 'mode': mode,
+                                           'format': format})
+                            records.append(record)
+    finally:
+        tmp.clean()
+    return records
+
+
+def _run_chain(source, processors, opts, requested_size, rounds):
+    stages = [{'processor': p.__name__, 'ms': 0.0, 'peak_kb': None}
+              for p in processors]
+    for round in range(rounds):
+        im = Image.open(source)
+        for stage, processor in zip(stages, processors):
+            started = time.time()
+            im = processor(im, requested_size, opts)
+            stage['ms'] += (time.time() - started) * 1000 / rounds
+    output = StringIO()
+    if im.mode not in ('L', 'RGB'):
+        im = im.convert('RGB')
+    im.save(output, 'JPEG', quality=defaults.QUALITY)
+    return {'options': opts, 'stages': stages,
+            'output_bytes': len(output.getvalue())}
+
+
+def _measure_chain(record, source, processors, opts, requested_size, tmp):
+    im = Image.open(source)
+    for stage, processor in zip(record['stages'], processors):
+        if getattr(im, 'tile', None):
+            # Nothing has needed the source's pixels yet.
+            stage['peak_kb'] = peak_rss_kb(source, [processor],
+                                           requested_size, opts)
+        else:
+            given = tmp.join('stage.png')
+            im.save(given, 'PNG')
+            stage['peak_kb'] = peak_rss_kb(given, [processor],
+                                           requested_size, opts, loaded=True)
+        im = processor(im, requested_size, opts)
+
+
+def processor_chain(rounds=1):
+    """
+    Per-stage time and peak memory for every processor chain run of
+    processor_chain_records, and the output size of each.  Use
+    ``bin/thumbnail_benchmark.py --json`` for all of the figures.
+    """
+    default = [p.__name__ for p in dynamic_import(defaults.PROCESSORS)]
+    results = []
+    for record in processor_chain_records(rounds):
+        label = "%sx%s %s %s [%s]" % (record['size'][0], record['size'][1],
+                                      record['mode'], record['format'],
+                                      ','.join(record['options']))
+        others = [stage['processor'] for stage in record['stages']
+                  if stage['processor'] not in default]
+        if others:
+            label += " with %s" % ','.join(others)
+        for stage in record['stages']:
+            results.append(("%s %s: ms" % (label, stage['processor']),
+                            stage['ms']))
+            if stage['peak_kb'] is not None:
+                results.append(("%s %s: peak KB" % (label,
+                                                    stage['processor']),
+                                stage['peak_kb']))
+        results.append(("%s: output bytes" % label, record['output_bytes']))
+    return results
+
+
+BENCHMARKS = {
+    'processor_chain': processor_chain,
+    'reduced_decode': reduced_decode,
+    'thumbnail_batch': thumbnail_batch,
+}
+
+# Benchmarks with more detail than fits in (label, value) rows, for
+# ``bin/thumbnail_benchmark.py --json``.
+RECORDS = {
+    'processor_chain': processor_chain_records,
+}
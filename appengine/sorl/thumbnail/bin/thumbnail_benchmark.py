@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Runs the named sorl.thumbnail benchmarks (default: all).
+"""
+
+import sys
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from sorl.thumbnail.benchmarks import BENCHMARKS, RECORDS
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [--rounds=N] [--json] [benchmark ...]')
+    parser.add_option('--rounds', type='int', dest='rounds', default=None,
+                      help='How many times each benchmark repeats its '
+                           'operation.')
+    parser.add_option('--json', action='store_true', dest='json',
+                      default=False,
+                      help='Report the results as JSON.')
+    options, names = parser.parse_args(argv)
+    kwargs = {}
+    if options.rounds is not None:
+        kwargs['rounds'] = options.rounds
+    names = names or sorted(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark: %s" % name)
+    if options.json:
+        results = {}
+        for name in names:
+            if name in RECORDS:
+                results[name] = RECORDS[name](**kwargs)
+            else:
+                results[name] = [{'label': label, 'value': value} for
+                                 label, value in BENCHMARKS[name](**kwargs)]
+        print json.dumps(results, indent=2)
+        return
+    for name in names:
+        print name
+        for label, value in BENCHMARKS[name](**kwargs):
+            print "    %-45s %10.2f" % (label, value)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
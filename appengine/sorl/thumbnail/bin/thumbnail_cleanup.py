@@ -2,6 +2,11 @@
 
 """
 Tries to delete thumbnails not in use.
+
+With THUMBNAIL_MANIFEST set, the thumbnails recorded for sources which no
+longer exist are deleted, wherever they are.  Otherwise the thumbnail
+directories of the ImageFields' upload_to paths are listed, which can't
+cover date formatted paths.
 """
 
 import sys
@@ -10,13 +15,15 @@ import re
 from django.db import models
 from django.conf import settings
 from sorl.thumbnail.main import get_thumbnail_setting
+from sorl.thumbnail.utils import _delete_using_thumbs_list
+from sorl.thumbnail import manifest
 
 try:
     set
 except NameError:
     from sets import Set as set     # For Python 2.3
 
-THUMB_RE = re.compile(r'^%s(.*)_\d{1,}x\d{1,}_[-\w]*q([1-9]\d?|100)\.jpg' % 
+THUMB_RE = re.compile(r'^%s(.*)_\d{1,}x\d{1,}_[-\w]*q([1-9]\d?|100)\.(?:jpg|png|webp|avif)' % 
                       get_thumbnail_setting('PREFIX'))
 
 def get_thumbnail_path(path):
@@ -26,6 +33,8 @@ def get_thumbnail_path(path):
 
 
 def clean_up():
+    if manifest.enabled():
+        return clean_up_manifest()
     paths = set()
     for app in models.get_apps():
         app_name = app.__name__.split('.')[-2]
@@ -64,5 +73,12 @@ def clean_up():
                     os.remove(del_me)
 
 
+def clean_up_manifest():
+    total = 0
+    for thumbs in manifest.orphans().values():
+        total += _delete_using_thumbs_list(thumbs)
+    return total
+
+
 if __name__ == "__main__":
     clean_up()
@@ -0,0 +1,67 @@
+"""
+Content addressed thumbnails.
+
+With THUMBNAIL_CONTENT_ADDRESSED set, a DjangoThumbnail is named after a
+digest of its source's bytes rather than the source's name (the size,
+options, quality and format still end the name, as usual), in
+THUMBNAIL_CONTENT_DIR.  Identical sources, like a stock picture uploaded
+for many coops, then share their thumbnails instead of each having a
+copy.  The manifest (see sorl.thumbnail.manifest) records every source
+which uses a thumbnail, and a thumbnail's file is only deleted once no
+source uses it any more.
+
+A content addressed thumbnail's name changes whenever its source's content
+does, so its file never changes under the same URL, and can be served with
+far-future cache headers (DjangoThumbnail.immutable tells so).
+
+Digests are cached per source path, size and modification time, so a
+source is read once and then only needs to be stat'ed.  A source replaced
+under the same name is digested again, and gets new thumbnails, without
+anything having to drop the old digest.
+"""
+
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor, sha_constructor
+
+from sorl.thumbnail.storage import local_storage
+from sorl.thumbnail.utils import LRUCache
+
+CHUNK_SIZE = 64 * 1024
+
+_digests = LRUCache(1000)
+
+
+def source_digest(source, storage=local_storage, mtime=None):
+    """
+    Returns the hex SHA-1 digest of the contents of the file ``source`` in
+    ``storage``.  Its modification time is looked up unless it is given.
+    """
+    if mtime is None:
+        mtime = storage.mtime(source)
+    key = (source, storage.size(source), mtime)
+    digest = _digests.get(key)
+    if digest is None:
+        cache_key = 'sorl-thumbnail-digest.%s' % \
+            md5_constructor(repr(key)).hexdigest()
+        digest = cache.get(cache_key)
+        if digest is None:
+            digest = file_digest(source, storage)
+            from sorl.thumbnail.main import get_thumbnail_setting
+            cache.set(cache_key, digest,
+                      get_thumbnail_setting('METADATA_CACHE_TIMEOUT'))
+        _digests.set(key, digest)
+    return digest
+
+
+def file_digest(filename, storage=local_storage):
+    digest = sha_constructor()
+    f = storage.open(filename)
+    try:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        f.close()
+    return digest.hexdigest()
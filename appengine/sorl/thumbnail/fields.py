@@ -7,8 +7,10 @@ from django.utils.functional import curry
 from django.utils.html import escape
 from django.conf import settings
 
+from sorl.thumbnail.base import generate_batch
+from sorl.thumbnail.formats import supported
 from sorl.thumbnail.main import DjangoThumbnail
-#from sorl.thumbnail.utils import delete_thumbnails  (TODO:)
+from sorl.thumbnail.utils import delete_thumbnails
 
 
 REQUIRED_ARGS = ('size',)
@@ -19,6 +21,7 @@ ALL_ARGS = {
     'basedir': 'basedir',
     'subdir': 'subdir',
     'prefix': 'prefix',
+    'format': 'format',
 }
 TAG_HTML = '<img src="%(src)s" width="%(width)s" height="%(height)s" alt="" />'
 
@@ -55,19 +58,22 @@ class ThumbTags(ThumbsDict):
         return self.descriptor._build_thumbnail_tag(thumb)
 
 
-class ImageWithThumbnailsFieldFile(ImageFieldFile):
-    def _build_thumbnail(self, args):
+class ThumbnailsMixin(object):
+    """
+    The thumbnail attributes of an image whose ``field`` has ``thumbnail``,
+    ``extra_thumbnails`` and ``thumbnail_tag`` attributes, for
+    ImageWithThumbnailsFieldFile and for the App Engine counterpart in
+    sorl.thumbnail.datastore.
+    """
+    def _relative_source(self):
+        raise NotImplementedError
+
+    def _build_thumbnail(self, args, **kwargs):
         # Build kwargs
-        kwargs = {}
         for k, v in args.items():
             kwargs[ALL_ARGS[k]] = v
-        # Build relative source path
-        filename = getattr(self.instance, self.field.name).path
-        media_root_len = len(os.path.normpath(settings.MEDIA_ROOT))
-        filename = os.path.normpath(filename)
-        filename = filename[media_root_len:].lstrip(os.path.sep)
         # Return thumbnail
-        return DjangoThumbnail(filename, **kwargs)
+        return DjangoThumbnail(self._relative_source(), **kwargs)
 
     def _build_thumbnail_tag(self, thumb):
         opts = dict(src=escape(thumb), width=thumb.width(),
@@ -96,6 +102,42 @@ class ImageWithThumbnailsFieldFile(ImageFieldFile):
         return ThumbTags(self)
     extra_thumbnails_tag = property(_get_extra_thumbnails_tag)
 
+    def generate_thumbnails(self):
+        """
+        Generates the thumbnail and all extra thumbnails which are missing or
+        out of date, decoding the source image only once.
+        """
+        all_args = [self.field.thumbnail]
+        all_args.extend((self.field.extra_thumbnails or {}).values())
+        thumbs = [self._build_thumbnail(args, generate=False)
+                  for args in expand_formats(all_args)]
+        for thumb in generate_batch(thumbs):
+            thumb.record()
+
+
+class ImageWithThumbnailsFieldFile(ThumbnailsMixin, ImageFieldFile):
+    def _relative_source(self):
+        filename = getattr(self.instance, self.field.name).path
+        media_root_len = len(os.path.normpath(settings.MEDIA_ROOT))
+        filename = os.path.normpath(filename)
+        return filename[media_root_len:].lstrip(os.path.sep)
+
+    def delete_thumbnails(self):
+        return delete_thumbnails(self.name)
+
+    def save(self, name, content, save=True):
+        super(ImageWithThumbnailsFieldFile, self).save(name, content, save)
+        # A storage which writes over existing files leaves the thumbnails
+        # (and cached metadata) of the file it replaced out of date.
+        self.delete_thumbnails()
+        if self.field.generate_on_save:
+            self.generate_thumbnails()
+
+    def delete(self, save=True):
+        if self.name:
+            self.delete_thumbnails()
+        super(ImageWithThumbnailsFieldFile, self).delete(save)
+
 
 class ImageWithThumbnailsField(ImageField):
     """
@@ -112,11 +154,14 @@ class ImageWithThumbnailsField(ImageField):
             }
         }
     )
+
+    A ``format`` may be given too, or a list of formats to choose from by
+    the browser's Accept header (see sorl.thumbnail.formats).
     """
     attr_class = ImageWithThumbnailsFieldFile
 
     def __init__(self, thumbnail, extra_thumbnails=None,
-                 thumbnail_tag=TAG_HTML, **kwargs):
+                 thumbnail_tag=TAG_HTML, generate_on_save=True, **kwargs):
         super(ImageWithThumbnailsField, self).__init__(**kwargs)
         _verify_thumbnail_attrs(thumbnail)
         if extra_thumbnails:
@@ -126,18 +171,42 @@ class ImageWithThumbnailsField(ImageField):
         self.thumbnail = thumbnail
         self.extra_thumbnails = extra_thumbnails
         self.thumbnail_tag = thumbnail_tag
+        self.generate_on_save = generate_on_save
+
+    def pre_save(self, model_instance, add):
+        # Saving a new file generates its thumbnails (see
+        # ImageWithThumbnailsFieldFile.save); the thumbnails of the file it
+        # replaces are deleted here, as the instance no longer knows it.
+        file = getattr(model_instance, self.attname)
+        if not add and file and not file._committed and \
+           model_instance.pk is not None:
+            old_names = model_instance.__class__._default_manager.filter(
+                pk=model_instance.pk).values_list(self.attname, flat=True)
+            for old_name in old_names:
+                if old_name and old_name != file.name:
+                    delete_thumbnails(old_name)
+        return super(ImageWithThumbnailsField, self).pre_save(model_instance,
+                                                              add)
+
+def expand_formats(all_args):
+    """
+    Returns a list of thumbnail arguments with those which give a list of
+    formats repeated for each format that can be chosen, so that all of
+    them can be generated ahead of time.
+    """
+    expanded = []
+    for args in all_args:
+        formats = args.get('format')
+        if formats is None or isinstance(formats, basestring):
+            expanded.append(args)
+            continue
+        for format in formats:
+            if format == formats[-1] or supported(format):
+                format_args = args.copy()
+                format_args['format'] = format
+                expanded.append(format_args)
+    return expanded
 
-    # TODO: saving the file should generate thumbnails.
-    #def save_file(self, *args, **kwargs):
-    #    super(ImageWithThumbnailField, self).save_file(*args, **kwargs)
-    #    _get_thumbnail()
-
-    # TODO: deleting the image should delete its thumbnails too.
-    # Note that  http://code.google.com/p/sorl-thumbnail/issues/detail?id=23
-    # mentions a problem with using *args, **kwargs, so test that too.
-    #def delete_file(self, *args, **kwargs):
-    #    super(ImageWithThumbnailField, self).delete_file(*args, **kwargs)
-    #    delete_thumbnails()
 
 def _verify_thumbnail_attrs(attrs, name="'thumbnail'"):
     for arg in REQUIRED_ARGS:
@@ -0,0 +1,174 @@
+"""
+Thumbnail manifest.
+
+With THUMBNAIL_MANIFEST set (sorl.thumbnail must then be in INSTALLED_APPS,
+for its table), each thumbnail is recorded against its source when it is
+generated.  sorl.thumbnail.utils and bin/thumbnail_cleanup.py then find the
+thumbnails of a source, or of a directory, and orphaned thumbnails by
+looking them up here instead of listing directories and parsing filenames.
+That works wherever the thumbnails are: made with a basedir, subdir or
+prefix other than the settings', or beside sources in date formatted
+``upload_to`` directories.
+
+A content addressed thumbnail (THUMBNAIL_CONTENT_ADDRESSED, see
+sorl.thumbnail.content) may be used by several sources, and is recorded
+against each of them; the number of its entries is its reference count.
+Deleting a source's thumbnails releases its references, and only the files
+left without any are deleted.
+
+Thumbnails which existed before the manifest was turned on are recorded the
+next time a DjangoThumbnail is built for them without their metadata cached
+(``./manage.py thumbnail_warm`` builds them all).
+"""
+
+import os
+
+from django.conf import settings
+
+from sorl.thumbnail.spec import get_storage
+from sorl.thumbnail.utils import LRUCache
+
+# (thumbnail, source) pairs this process knows to be recorded, so that
+# rendering a thumbnail again doesn't query the manifest.
+_recorded = LRUCache(1000)
+
+
+def enabled():
+    """
+    Returns True if thumbnails are recorded in the manifest, which content
+    addressed thumbnails need.
+    """
+    from sorl.thumbnail.main import get_thumbnail_setting
+    return bool(get_thumbnail_setting('MANIFEST') or
+                get_thumbnail_setting('CONTENT_ADDRESSED'))
+
+
+def relative_name(path):
+    """
+    Returns ``path`` as the manifest stores it: a unicode path relative to
+    MEDIA_ROOT (if it is inside it).
+    """
+    if isinstance(path, str):
+        path = path.decode(settings.FILE_CHARSET)
+    path = os.path.normpath(path)
+    root = os.path.normpath(settings.MEDIA_ROOT).rstrip(os.sep) + os.sep
+    if path.startswith(root):
+        path = path[len(root):]
+    return path
+
+
+def absolute_name(name):
+    """
+    Returns a name the manifest stores as the storage names it: an absolute
+    path for the local filesystem, and unchanged otherwise.
+    """
+    if get_storage().local:
+        name = os.path.join(settings.MEDIA_ROOT, name)
+    return name.encode(settings.FILE_CHARSET)
+
+
+def record(thumbnail):
+    """
+    Records a generated thumbnail.
+    """
+    from sorl.thumbnail.models import ManifestEntry
+    name = relative_name(thumbnail.dest)
+    source = relative_name(thumbnail.source)
+    if (name, source) in _recorded:
+        return
+    x, y = thumbnail.requested_size
+    ManifestEntry.objects.get_or_create(name=name, source=source, defaults={
+        'x': x, 'y': y, 'options': '_'.join(thumbnail.opts),
+        'quality': thumbnail.quality})
+    _recorded.set((name, source), True)
+
+
+def _thumbnail_dict(entry):
+    # The same dictionaries as sorl.thumbnail.utils.all_thumbnails makes,
+    # with the source they were found for.
+    return {
+        'source': entry.source,
+        'filename': absolute_name(entry.name),
+        'x': str(entry.x),
+        'y': str(entry.y),
+        'options': entry.options and entry.options.split('_') or [],
+        'quality': str(entry.quality),
+    }
+
+
+def thumbnails_for_source(relative_source):
+    """
+    Returns the recorded thumbnails of a source, as a list of dictionaries
+    like sorl.thumbnail.utils.thumbnails_for_file.
+    """
+    from sorl.thumbnail.models import ManifestEntry
+    entries = ManifestEntry.objects.filter(
+        source=relative_name(relative_source))
+    return [_thumbnail_dict(entry) for entry in entries]
+
+
+def thumbnails_in(path, recursive=True):
+    """
+    Returns the recorded thumbnails within the directory ``path`` (and its
+    sub-directories, by default), as a dictionary like
+    sorl.thumbnail.utils.all_thumbnails but keyed by source name relative
+    to MEDIA_ROOT.
+    """
+    from sorl.thumbnail.models import ManifestEntry
+    entries = ManifestEntry.objects.all()
+    prefix = relative_name(path).rstrip(os.sep)
+    if prefix == '.':
+        prefix = ''
+    if prefix:
+        prefix += os.sep
+        entries = entries.filter(name__startswith=prefix)
+    thumbnails = {}
+    for entry in entries:
+        if not recursive and os.sep in entry.name[len(prefix):]:
+            continue
+        thumbnails.setdefault(entry.source, []).append(_thumbnail_dict(entry))
+    return thumbnails
+
+
+def orphans():
+    """
+    Returns the recorded thumbnails of the sources which no longer exist,
+    as a dictionary like thumbnails_in.
+    """
+    from sorl.thumbnail.models import ManifestEntry
+    sources = list(ManifestEntry.objects.values_list('source',
+                                                     flat=True).distinct())
+    names = [absolute_name(source) for source in sources]
+    mtimes = get_storage().mtimes(names)
+    missing = [source for source, name in zip(sources, names)
+               if mtimes[name] is None]
+    thumbnails = {}
+    for entry in ManifestEntry.objects.filter(source__in=missing):
+        thumbnails.setdefault(entry.source, []).append(_thumbnail_dict(entry))
+    return thumbnails
+
+
+def release(thumbs):
+    """
+    Removes thumbnails (dictionaries as returned by the functions above, or
+    by sorl.thumbnail.utils.all_thumbnails) from the manifest: the given
+    source's reference to each, or all references if no source is given.
+    Returns the absolute filenames of those no longer referenced at all,
+    which can be deleted.
+    """
+    from sorl.thumbnail.models import ManifestEntry
+    released = []
+    for thumb in thumbs:
+        name = relative_name(thumb['filename'])
+        entries = ManifestEntry.objects.filter(name=name)
+        if thumb.get('source'):
+            source = relative_name(thumb['source'])
+            entries.filter(source=source).delete()
+            _recorded.delete((name, source))
+        else:
+            for source in entries.values_list('source', flat=True):
+                _recorded.delete((name, source))
+            entries.delete()
+        if not ManifestEntry.objects.filter(name=name).count():
+            released.append(thumb['filename'])
+    return released
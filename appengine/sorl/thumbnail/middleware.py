@@ -0,0 +1,19 @@
+from django.utils.cache import patch_vary_headers
+
+from sorl.thumbnail import formats
+
+
+class ThumbnailFormatMiddleware(object):
+    """
+    Lets thumbnails with a list of formats be written in the first one the
+    browser accepts (see sorl.thumbnail.formats), and marks the responses
+    which contain such thumbnails as varying by the Accept header.
+    """
+    def process_request(self, request):
+        formats.set_accept(request.META.get('HTTP_ACCEPT', ''))
+
+    def process_response(self, request, response):
+        if formats.varies():
+            patch_vary_headers(response, ('Accept',))
+        formats.set_accept(None)
+        return response
@@ -1 +1,23 @@
-# Needs a models.py file so that tests are picked up.
\ No newline at end of file
+# Needs a models.py file so that tests are picked up.
+from django.db import models
+
+
+class ManifestEntry(models.Model):
+    """
+    A generated thumbnail, recorded against its source when
+    THUMBNAIL_MANIFEST is set (see sorl.thumbnail.manifest).  Both names are
+    relative to MEDIA_ROOT.  A content addressed thumbnail (see
+    sorl.thumbnail.content) has an entry for each source which uses it.
+    """
+    source = models.CharField(max_length=255, db_index=True)
+    name = models.CharField(max_length=255, db_index=True)
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    options = models.CharField(max_length=255, blank=True)
+    quality = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = (('source', 'name'),)
+
+    def __unicode__(self):
+        return self.name
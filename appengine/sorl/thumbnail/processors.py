@@ -1,13 +1,29 @@
 from PIL import Image, ImageFilter, ImageChops
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# These are called for every Thumbnail, always with the same few arguments,
+# so their results are kept.
+_imported = {}
+_valid_options = {}
+_normalized_options = {}
+
 
 def dynamic_import(names):
-    imported = []
-    for name in names:
-        modname, attrname = name.rsplit('.', 1)
-        mod = __import__(modname, {}, {}, [''])
-        imported.append(getattr(mod, attrname))
-    return imported
+    key = tuple(names)
+    imported = _imported.get(key)
+    if imported is None:
+        imported = []
+        for name in names:
+            modname, attrname = name.rsplit('.', 1)
+            mod = __import__(modname, {}, {}, [''])
+            imported.append(getattr(mod, attrname))
+        _imported[key] = imported
+    return list(imported)
 
 
 def get_valid_options(processors):
@@ -15,18 +31,45 @@ def get_valid_options(processors):
     Returns a list containing unique valid options from a list of processors
     in correct order.
     """
-    valid_options = []
-    for processor in processors:
-        if hasattr(processor, 'valid_options'):
-            valid_options.extend([opt for opt in processor.valid_options
-                                  if opt not in valid_options])
-    return valid_options
+    key = tuple(processors)
+    valid_options = _valid_options.get(key)
+    if valid_options is None:
+        valid_options = []
+        for processor in processors:
+            if hasattr(processor, 'valid_options'):
+                valid_options.extend([opt for opt in processor.valid_options
+                                      if opt not in valid_options])
+        _valid_options[key] = valid_options
+    return list(valid_options)
+
+
+def normalize_options(processors, opts):
+    """
+    Returns the options in ``opts`` in the order the processors take them,
+    raising TypeError for any which none of them takes.
+    """
+    opts = opts or []
+    key = (tuple(processors), tuple(opts))
+    normalized = _normalized_options.get(key)
+    if normalized is None:
+        valid_options = get_valid_options(processors)
+        for opt in opts:
+            if not opt in valid_options:
+                raise TypeError('Thumbnail received an invalid option: %s'
+                                % opt)
+        normalized = [opt for opt in valid_options if opt in opts]
+        _normalized_options[key] = normalized
+    return list(normalized)
 
 
 def colorspace(im, requested_size, opts):
     if 'bw' in opts and im.mode != "L":
         im = im.convert("L")
-    elif im.mode not in ("L", "RGB"):
+    elif im.mode == "P" and 'transparency' in im.info:
+        # Transparency is kept for the formats which can store it; the
+        # thumbnail is flattened when it is saved as a JPEG.
+        im = im.convert("RGBA")
+    elif im.mode not in ("L", "RGB", "LA", "RGBA"):
         im = im.convert("RGB")
     return im
 colorspace.valid_options = ('bw',)
@@ -46,6 +89,128 @@ def autocrop(im, requested_size, opts):
 autocrop.valid_options = ('autocrop',)
 
 
+# The largest side of the downsampled view fast_autocrop looks for the border
+# in before refining its edges at full size.
+AUTOCROP_VIEW_SIZE = 256
+
+
+def _luminance(color):
+    if isinstance(color, (int, long)):
+        return color
+    r, g, b = color[:3]
+    return (r * 299 + g * 587 + b * 114) / 1000
+
+
+def _content_bbox(im, background, tolerance):
+    """
+    Returns the bounding box of the pixels of a luminance image which differ
+    from ``background`` by more than ``tolerance``, or None.
+    """
+    if numpy is not None:
+        pixels = numpy.asarray(im).astype(numpy.int16)
+        content = abs(pixels - background) > tolerance
+        rows = numpy.flatnonzero(content.any(axis=1))
+        if not len(rows):
+            return None
+        columns = numpy.flatnonzero(content.any(axis=0))
+        return (int(columns[0]), int(rows[0]), int(columns[-1]) + 1,
+                int(rows[-1]) + 1)
+    diff = ImageChops.difference(im, Image.new('L', im.size, background))
+    return diff.point(lambda v: v > tolerance and 255).getbbox()
+
+
+def autocrop_bbox(im, background=(255, 255, 255), tolerance=127):
+    """
+    Returns the bounding box of what isn't ``background`` in an image: the
+    pixels whose luminance differs from the background's by more than
+    ``tolerance`` once specks are smoothed away, or None.
+
+    The border is found on a downsampled luminance view of the image, then
+    each edge is refined at full size in a strip along it, so normally no
+    full-size copy of the image is made.  NumPy is used to reduce the rows and columns
+    if it is installed.
+    """
+    background = _luminance(background)
+    x, y = im.size
+    factor = (max(x, y) + AUTOCROP_VIEW_SIZE - 1) / AUTOCROP_VIEW_SIZE
+    if factor <= 1:
+        view = im.convert('L').filter(ImageFilter.MedianFilter)
+        return _content_bbox(view, background, tolerance)
+
+    # Averaging a cell of the view dilutes a dark edge, so the view has a
+    # proportionally lower tolerance; the edges are then found exactly.
+    view = im.resize((max(x / factor, 1), max(y / factor, 1)),
+                     Image.ANTIALIAS).convert('L')
+    bbox = _content_bbox(view, background, max(tolerance / factor, 1))
+    if bbox is None:
+        return None
+    left, top, right, bottom = [v * factor for v in bbox]
+    margin = 2 * factor
+    outer = (max(left - margin, 0), max(top - margin, 0),
+             min(right + margin, x), min(bottom + margin, y))
+
+    edges = []
+    for index, box in (
+            (0, (outer[0], outer[1], min(left + margin, x), outer[3])),
+            (1, (outer[0], outer[1], outer[2], min(top + margin, y))),
+            (2, (max(right - margin, 0), outer[1], outer[2], outer[3])),
+            (3, (outer[0], max(bottom - margin, 0), outer[2], outer[3]))):
+        strip = im.crop(box).convert('L').filter(ImageFilter.MedianFilter)
+        found = _content_bbox(strip, background, tolerance)
+        if found is None:
+            # The view's lower tolerance saw something that isn't content
+            # at full size; only the whole image can tell where that is.
+            view = im.convert('L').filter(ImageFilter.MedianFilter)
+            return _content_bbox(view, background, tolerance)
+        edges.append(box[index % 2] + found[index])
+    return tuple(edges)
+
+
+def fast_autocrop(im, requested_size, opts):
+    """
+    Crops away a plain border like autocrop, but without making full-size
+    copies of the image (see autocrop_bbox).  Use it in place of autocrop
+    in THUMBNAIL_PROCESSORS; THUMBNAIL_AUTOCROP_BACKGROUND and
+    THUMBNAIL_AUTOCROP_TOLERANCE set the border colour and how far from it
+    a pixel must be to count as content.
+    """
+    if 'autocrop' in opts:
+        # A local import, so that there is no requirement of Django to use
+        # the processors.
+        from sorl.thumbnail.main import get_thumbnail_setting
+        bbox = autocrop_bbox(im,
+                             get_thumbnail_setting('AUTOCROP_BACKGROUND'),
+                             get_thumbnail_setting('AUTOCROP_TOLERANCE'))
+        if bbox:
+            im = im.crop(bbox)
+    return im
+fast_autocrop.valid_options = ('autocrop',)
+
+
+def _reduce(im, size):
+    """
+    Cheaply shrinks an image which is much larger than ``size`` towards it,
+    never below it, so that the final resample has less to do.
+
+    An image which hasn't been loaded yet (colorspace and autocrop haven't
+    needed its pixels) and supports draft mode, like a JPEG, is decoded
+    straight at the smallest scale that is at least ``size``; this changes
+    the image in place.  Otherwise, where PIL supports it, the image is
+    reduced by a whole factor which leaves at least twice ``size`` for the
+    resample.
+    """
+    if getattr(im, 'tile', None) and im.format == 'JPEG':
+        im.draft(im.mode, size)
+        return im
+    reduce = getattr(im, 'reduce', None)
+    if reduce is not None:
+        factor = int(min(float(im.size[0]) / size[0],
+                         float(im.size[1]) / size[1]) / 2)
+        if factor >= 2:
+            return reduce(factor)
+    return im
+
+
 def scale_and_crop(im, requested_size, opts):
     x, y   = [float(v) for v in im.size]
     xr, yr = [float(v) for v in requested_size]
@@ -55,7 +220,13 @@ def scale_and_crop(im, requested_size, opts):
     else:
         r = min(xr/x, yr/y)
 
-    if r < 1.0 or (r > 1.0 and 'upscale' in opts):
+    if r < 1.0:
+        # Work out the final size from the original one, so that reducing
+        # first doesn't change it.
+        size = (int(x*r), int(y*r))
+        im = _reduce(im, (max(size[0], 1), max(size[1], 1)))
+        im = im.resize(size, resample=Image.ANTIALIAS)
+    elif r > 1.0 and 'upscale' in opts:
         im = im.resize((int(x*r), int(y*r)), resample=Image.ANTIALIAS)
 
     if 'crop' in opts:
@@ -0,0 +1,5 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('sorl.thumbnail.views',
+    (r'^(?P<signature>[0-9a-f]+)/(?P<url_name>[^/]+)/(?P<path>.+)$', 'serve'),
+)
@@ -0,0 +1,159 @@
+"""
+Serving thumbnails over HTTP.
+
+With THUMBNAIL_VIEW_URL set, and routed to sorl.thumbnail.urls::
+
+    THUMBNAIL_VIEW_URL = '/thumbnails/'
+    (r'^thumbnails/', include('sorl.thumbnail.urls')),
+
+a DjangoThumbnail that isn't known to exist isn't generated while the page
+is rendered; its URL points to ``serve`` instead, which generates it when
+it is first requested.  The URL carries the thumbnail's spec and source,
+signed with SECRET_KEY so that only thumbnails pages ask for are made, and
+the source's modification time, so that it changes with the source.
+
+``serve`` streams the thumbnail in chunks, answers conditional requests
+(If-None-Match, If-Modified-Since) with 304 and single byte ranges with
+206, and lets the response be cached for THUMBNAIL_VIEW_MAX_AGE seconds, so
+a front proxy or CDN can serve most requests.
+"""
+
+import re
+import time
+
+from django.http import HttpResponse, HttpResponseNotModified, Http404
+from django.utils.encoding import smart_str
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from sorl.thumbnail.base import ThumbnailException
+from sorl.thumbnail.formats import OUTPUT_FORMATS
+from sorl.thumbnail.main import DjangoThumbnail
+from sorl.thumbnail.spec import parse_url_name, setting, sign
+
+CHUNK_SIZE = 64 * 1024
+
+range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def serve(request, signature, url_name, path):
+    """
+    Generates (if need be) and serves the thumbnail of ``path`` described by
+    ``url_name`` (see sorl.thumbnail.spec).
+    """
+    spec = parse_url_name(url_name)
+    path = smart_str(path)
+    if spec is None or not _equal(signature, sign(url_name, path)):
+        raise Http404('Invalid thumbnail URL.')
+    requested_size, opts, quality, format = spec
+    try:
+        thumb = DjangoThumbnail(path, requested_size, opts=opts,
+                                quality=quality, format=format,
+                                background=False, view=False)
+        size = thumb.filesize
+    except (ThumbnailException, TypeError, EnvironmentError), detail:
+        raise Http404('Thumbnail of %s: %s' % (path, detail))
+    storage = thumb.storage
+    mtime = storage.mtime(thumb.dest)
+    if mtime is None:
+        raise Http404('Thumbnail of %s is missing.' % path)
+    # HTTP dates are in whole seconds.
+    mtime = int(mtime)
+    etag = '"%x-%x"' % (mtime, size)
+
+    if _not_modified(request, etag, mtime, size):
+        response = HttpResponseNotModified()
+    else:
+        byte_range = _byte_range(request, etag, mtime, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if byte_range is None:
+            first, last = 0, size - 1
+        else:
+            first, last = byte_range
+        chunks = _chunks(storage.open(thumb.dest), first, last - first + 1)
+        response = HttpResponse(chunks,
+                                mimetype=OUTPUT_FORMATS[thumb.format][2])
+        if byte_range is not None:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %d-%d/%d' % (first, last,
+                                                            size)
+        response['Content-Length'] = str(last - first + 1)
+        response['Accept-Ranges'] = 'bytes'
+        response['Last-Modified'] = http_date(mtime)
+    max_age = setting('VIEW_MAX_AGE')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=%d' % max_age
+    response['Expires'] = http_date(time.time() + max_age)
+    return response
+
+
+def _equal(a, b):
+    # Compares signatures in a time which doesn't depend on where they
+    # differ.
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def _not_modified(request, etag, mtime, size):
+    """
+    Returns True if the client's copy, as told by If-None-Match or else by
+    If-Modified-Since, is up to date.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in etags or '*' in etags
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None:
+        return not was_modified_since(if_modified_since, mtime, size)
+    return False
+
+
+def _byte_range(request, etag, mtime, size):
+    """
+    Returns the (first, last) bytes of a single byte range asked for with
+    Range (and If-Range, if given, still matching), None to serve the whole
+    file, or False if the range can't be satisfied.
+    """
+    match = range_re.match(request.META.get('HTTP_RANGE', '').strip())
+    if match is None:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range not in (etag, http_date(mtime)):
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        if last:
+            last = min(int(last), size - 1)
+        else:
+            last = size - 1
+    elif last:
+        # The last bytes of the file.
+        first = max(size - int(last), 0)
+        last = size - 1
+    else:
+        return None
+    if first > last:
+        return False
+    return first, last
+
+
+def _chunks(f, first, length):
+    try:
+        f.seek(first)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
@@ -0,0 +1,142 @@
+"""
+Generates every configured thumbnail of every ImageWithThumbnailsField ahead
+of time, so that no visitor has to wait for one (after restoring media or
+changing THUMBNAIL_QUALITY, say).
+
+Sources are handed out to a pool of worker processes when the
+multiprocessing module (Python 2.6) is available, and are worked through in
+this process otherwise.  Each finished source is appended to a state file,
+which an interrupted run leaves behind so that the next run can carry on
+where it stopped; thumbnails which are already up to date are skipped
+regardless, by the same mtime check as Thumbnail.generate.
+"""
+
+import os
+
+from django.conf import settings
+from django.db import connection, models
+
+from sorl.thumbnail.base import generate_batch, ThumbnailException
+from sorl.thumbnail.fields import ImageWithThumbnailsField, ALL_ARGS, \
+     expand_formats
+from sorl.thumbnail.main import DjangoThumbnail
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+
+def thumbnail_fields():
+    """
+    Returns (model, field) pairs for every ImageWithThumbnailsField of the
+    installed applications' models.
+    """
+    fields = []
+    for app in models.get_apps():
+        for model in models.get_models(app):
+            for field in model._meta.fields:
+                if isinstance(field, ImageWithThumbnailsField):
+                    fields.append((model, field))
+    return fields
+
+
+def thumbnail_sources():
+    """
+    Returns (relative source filename, list of thumbnail arguments) pairs
+    for every file stored in an ImageWithThumbnailsField.
+    """
+    sources = {}
+    for model, field in thumbnail_fields():
+        all_args = [field.thumbnail]
+        all_args.extend((field.extra_thumbnails or {}).values())
+        names = model._default_manager.values_list(field.attname, flat=True)
+        for name in names.distinct():
+            if not name:
+                continue
+            source_args = sources.setdefault(name, [])
+            for args in all_args:
+                if args not in source_args:
+                    source_args.append(args)
+    names = sources.keys()
+    names.sort()
+    return [(name, sources[name]) for name in names]
+
+
+def warm_source(job):
+    """
+    Generates the thumbnails of one source which are missing or out of
+    date.  Returns (source, number generated, error message or None).
+    """
+    name, all_args = job
+    thumbs = []
+    try:
+        for args in expand_formats(all_args):
+            kwargs = dict([(ALL_ARGS[k], v) for k, v in args.items()])
+            thumbs.append(DjangoThumbnail(name, generate=False, **kwargs))
+        generated = generate_batch(thumbs)
+    except (ThumbnailException, TypeError, EnvironmentError), detail:
+        # A missing or unreadable source, or invalid arguments, fails this
+        # source only.
+        return name, 0, str(detail)
+    # Up to date thumbnails are recorded too, in case they were made before
+    # the metadata cache or manifest was turned on.
+    for thumb in thumbs:
+        thumb.record()
+    return name, len(generated), None
+
+
+def default_state_file():
+    return os.path.join(settings.MEDIA_ROOT, '.thumbnail_warm_state')
+
+
+def warm(processes=None, state_file=None, restart=False, progress=None):
+    """
+    Generates all configured thumbnails.  ``progress``, if given, is called
+    with (sources done, sources in all, source, number generated, error)
+    after each source.  Returns the number of thumbnails generated.
+    """
+    if state_file is None:
+        state_file = default_state_file()
+    done = set()
+    if restart:
+        if os.path.exists(state_file):
+            os.remove(state_file)
+    elif os.path.exists(state_file):
+        done = set([line.rstrip('\n').decode('utf-8')
+                    for line in open(state_file)])
+    jobs = [job for job in thumbnail_sources() if job[0] not in done]
+    total = len(jobs) + len(done)
+
+    if multiprocessing is not None and processes != 1 and len(jobs) > 1:
+        # The workers are forked from this process, and mustn't share its
+        # database connection; each opens its own.
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(warm_source, jobs)
+    else:
+        pool = None
+        results = (warm_source(job) for job in jobs)
+
+    state = open(state_file, 'a')
+    generated = failed = 0
+    try:
+        for name, count, error in results:
+            generated += count
+            if error is None:
+                state.write('%s\n' % name.encode('utf-8'))
+                state.flush()
+            else:
+                failed += 1
+            done.add(name)
+            if progress is not None:
+                progress(len(done), total, name, count, error)
+    finally:
+        state.close()
+        if pool is not None:
+            pool.terminate()
+    # Keep the state if anything failed, so that the next run only retries
+    # the failures.
+    if not failed:
+        os.remove(state_file)
+    return generated
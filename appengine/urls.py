@@ -4,6 +4,7 @@ import settings
 
 urlpatterns = patterns('',
     (r'^coops/', include('coops.urls')),
+    (r'^thumbnails/(?P<name>.*)$', 'sorl.thumbnail.datastore.serve'),
     #TODO: Change this to a better front page.
     (r'^$', 'coops.views.coop_list'),
 )
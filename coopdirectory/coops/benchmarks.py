@@ -0,0 +1,211 @@
+"""
+Benchmarks for the coops application.
+
+Run them with ``./manage.py benchmark [--rounds=N] [name ...]``.  Every
+benchmark is a function in ``BENCHMARKS`` which takes the number of rounds
+to run (each benchmark has its own default) and returns a list of
+``(label, value)`` rows to report.  They run against a freshly created test
+database with the ``test_coops`` fixture loaded.
+"""
+
+import datetime
+import random
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models
+from django.utils import simplejson
+
+from coopdirectory.coops.models import Coop, CoopUser, CoopPicture, \
+        Contactable, VersionedModel, Revision
+
+
+class QueryCounter(object):
+    """
+    Counts the statements sent to the database between start() and stop().
+
+    Every cursor the connection hands out meanwhile counts its execute()
+    and executemany() calls.  connection.queries can't be used for this:
+    it is only kept while DEBUG is on, and every request_started signal
+    (such as the test client's) empties it.
+    """
+    def start(self):
+        self.queries = 0
+        self._started = time.time()
+        # An instance attribute, so it shadows the connection's method.
+        connection.cursor = self._cursor
+
+    def stop(self):
+        self.seconds = time.time() - self._started
+        del connection.cursor
+        return self.queries
+
+    def _cursor(self):
+        return _CountingCursor(connection.__class__.cursor(connection), self)
+
+
+class _CountingCursor(object):
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def execute(self, sql, params=()):
+        self.counter.queries += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.counter.queries += 1
+        return self.cursor.executemany(sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def make_coop(name):
+    coop = Coop(name = name)
+    coop.created_by = CoopUser.objects.all()[0]
+    coop.picture = CoopPicture.objects.all()[0]
+    coop.contactable = Contactable.objects.all()[0]
+    return coop
+
+
+def _legacy_save(instance):
+    """
+    The original VersionedModel.save: a SELECT of the head plus two full-row
+    writes per edit, an INSERT and an UPDATE for a first save.
+    """
+    if instance.pk:
+        latest = instance.__class__.objects.get(pk = instance.branch.pk)
+        instance.pk = latest.pk
+        instance.revision = latest.revision + 1
+        models.Model.save(instance)
+        latest.pk = None
+        models.Model.save(latest)
+    else:
+        models.Model.save(instance)
+        instance.branch = instance
+        models.Model.save(instance)
+
+
+def revision_save(rounds=100):
+    """
+    Round trips and time per VersionedModel save, for first saves and for
+    edits, compared with the original save().
+    """
+    results = []
+    for label, save in (('legacy', _legacy_save),
+                        ('current', VersionedModel.save)):
+        counter = QueryCounter()
+        coops = [make_coop("%s %d" % (label, i)) for i in range(rounds)]
+        counter.start()
+        for coop in coops:
+            save(coop)
+        counter.stop()
+        results.append(("%s first save: queries/save" % label,
+                counter.queries / float(rounds)))
+        results.append(("%s first save: ms/save" % label,
+                counter.seconds * 1000 / rounds))
+
+        counter.start()
+        for coop in coops:
+            coop.name = coop.name + " revised"
+            save(coop)
+        counter.stop()
+        results.append(("%s edit: queries/save" % label,
+                counter.queries / float(rounds)))
+        results.append(("%s edit: ms/save" % label,
+                counter.seconds * 1000 / rounds))
+    return results
+
+
+def _payload_bytes(coop):
+    """
+    Bytes of archived revision data kept for a coop: the log entries, or
+    for inline storage the same JSON encoding of the archived rows.
+    """
+    if settings.REVISION_STORAGE == 'inline':
+        return sum([len(simplejson.dumps(r._column_values(), cls = DjangoJSONEncoder))
+                for r in Coop.objects.archived().filter(branch__pk = coop.pk)])
+    return sum([len(r.data) for r in Revision.objects.filter(branch = coop.pk)])
+
+
+def revision_history(rounds=1000):
+    """
+    Stores ``rounds`` revisions of a few synthetic coops under each revision
+    storage, then reports the archived payload and the time to rebuild a
+    random revision and the whole history.
+    """
+    storage = getattr(settings, 'REVISION_STORAGE', 'inline')
+    results = []
+    try:
+        for mode in ('inline', 'log', 'delta'):
+            settings.REVISION_STORAGE = mode
+            coops = [make_coop("%s coop %d" % (mode, i)) for i in range(3)]
+            for coop in coops:
+                coop.save()
+                for n in range(rounds):
+                    coop.name = "%s coop %d, revision %d" % (mode, coop.pk, n + 1)
+                    coop.save()
+            results.append(("%s: payload bytes/coop" % mode,
+                    sum([_payload_bytes(c) for c in coops]) / float(len(coops))))
+
+            numbers = [random.randrange(rounds) for i in range(100)]
+            started = time.time()
+            for number in numbers:
+                random.choice(coops).get_revision(number)
+            results.append(("%s: ms/get_revision" % mode,
+                    (time.time() - started) * 1000 / len(numbers)))
+
+            started = time.time()
+            for coop in coops:
+                coop.history()
+            results.append(("%s: ms/history" % mode,
+                    (time.time() - started) * 1000 / len(coops)))
+    finally:
+        settings.REVISION_STORAGE = storage
+    return results
+
+
+def as_of(rounds=1000):
+    """
+    Resolves the revision current at one moment for ``rounds`` coops with
+    five revisions each, with Coop.objects.as_of() and with a query per
+    coop.
+    """
+    coops = [make_coop("As of coop %d" % i) for i in range(rounds)]
+    for coop in coops:
+        coop.save()
+    for n in range(5):
+        if n == 2:
+            when = datetime.datetime.now()
+        for coop in coops:
+            coop.name = "As of coop %d, revision %d" % (coop.pk, n + 1)
+            coop.save()
+
+    results = []
+    counter = QueryCounter()
+    counter.start()
+    Coop.objects.as_of(when)
+    counter.stop()
+    results.append(("as_of(): queries", counter.queries))
+    results.append(("as_of(): ms", counter.seconds * 1000))
+
+    counter.start()
+    for coop in coops:
+        Coop.objects.filter(branch__pk = coop.pk, created_at__lte = when
+                ).order_by('-revision')[0]
+    counter.stop()
+    results.append(("query per coop: queries", counter.queries))
+    results.append(("query per coop: ms", counter.seconds * 1000))
+    return results
+
+
+BENCHMARKS = {
+    'as_of': as_of,
+    'revision_save': revision_save,
+    'revision_history': revision_history,
+}
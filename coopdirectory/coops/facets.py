@@ -0,0 +1,202 @@
+"""
+Faceted filtering of coops by category and by question answers.
+
+A facet value is a string key:
+
+    category:<CoopCategory id>
+    answer:<Question id>:<Answer id>
+
+CoopFacet holds the facet values of every current coop and FacetCount the
+number of coops with each value.  Both are updated incrementally from the
+difference between a coop's old and new facet values whenever it is
+reindexed, so listing every count on an unfiltered page is one query
+instead of a GROUP BY over the many-to-many tables.
+"""
+
+from django.db import connection, transaction, IntegrityError
+
+from coopdirectory.coops.models import AnsweredQuestion, CoopCategory, \
+        Question, Answer, CoopFacet, FacetCount, reindex_pending
+from coopdirectory.coops.prefetch import chunks, in_bulk, related_objects
+from coopdirectory.coops.search import Matches
+
+
+def coop_facets(coop):
+    """
+    Returns the set of facet values of a coop's current revision.
+    """
+    facets = set()
+    for category in related_objects(coop, 'categories'):
+        facets.add('category:%s' % category.pk)
+    for answered in AnsweredQuestion.objects.heads().filter(coop = coop.pk):
+        for answer in related_objects(answered, 'answers'):
+            facets.add('answer:%s:%s' % (answered.question_id, answer.pk))
+    return facets
+
+
+def _adjust_counts(cursor, facets, delta):
+    table = connection.ops.quote_name(FacetCount._meta.db_table)
+    for facet in facets:
+        cursor.execute("UPDATE %s SET count = count + %%s WHERE facet = %%s"
+                % table, [delta, facet])
+        if cursor.rowcount == 0:
+            try:
+                cursor.execute("INSERT INTO %s (facet, count) VALUES (%%s, %%s)"
+                        % table, [facet, max(delta, 0)])
+            except IntegrityError:
+                # Another coop's reindex inserted the row since our update.
+                cursor.execute("UPDATE %s SET count = count + %%s "
+                        "WHERE facet = %%s" % table, [delta, facet])
+
+
+def _set_facets(coop_id, old, new):
+    table = connection.ops.quote_name(CoopFacet._meta.db_table)
+    removed = list(old - new)
+    added = list(new - old)
+    cursor = connection.cursor()
+    if removed:
+        cursor.execute("DELETE FROM %s WHERE coop_id = %%s AND facet IN (%s)"
+                % (table, ", ".join(["%s"] * len(removed))), [coop_id] + removed)
+        _adjust_counts(cursor, removed, -1)
+    if added:
+        cursor.executemany("INSERT INTO %s (facet, coop_id) VALUES (%%s, %%s)"
+                % table, [(facet, coop_id) for facet in added])
+        _adjust_counts(cursor, added, 1)
+    transaction.set_dirty()
+
+
+def _stored_facets(coop_id):
+    return set(CoopFacet.objects.filter(coop = coop_id).values_list('facet',
+            flat = True))
+
+
+def index_coop(coop):
+    """
+    Brings the facet values and counts of one coop up to date.
+    """
+    _set_facets(coop.pk, _stored_facets(coop.pk), coop_facets(coop))
+index_coop = transaction.commit_on_success(index_coop)
+
+
+def unindex_coop(coop):
+    """
+    Removes a coop from the facet counts, e.g. before deleting it.
+    """
+    _set_facets(coop.pk, _stored_facets(coop.pk), set())
+unindex_coop = transaction.commit_on_success(unindex_coop)
+
+
+def rebuild_facets(coops):
+    """
+    Recomputes all facet values and counts for the given coops.
+    """
+    CoopFacet.objects.all().delete()
+    FacetCount.objects.all().delete()
+    for coop in coops:
+        index_coop(coop)
+
+
+def selected_facets(query_dict):
+    """
+    The facet values chosen by the "category" and "answer" request
+    parameters, e.g. ?category=1&answer=1:2
+    """
+    selected = ['category:%s' % v for v in query_dict.getlist('category')]
+    selected += ['answer:%s' % v for v in query_dict.getlist('answer')]
+    return selected
+
+
+def filter_coops(facets):
+    """
+    Returns the coops which have every one of the facet values, as
+    coops.search.Matches in id order.
+    """
+    reindex_pending()
+    facets = list(set(facets))
+    return Matches("SELECT coop_id FROM %s WHERE facet IN (%s) "
+            "GROUP BY coop_id HAVING COUNT(*) = %%s" % (
+                connection.ops.quote_name(CoopFacet._meta.db_table),
+                ", ".join(["%s"] * len(facets))),
+            facets + [len(facets)], "coop_id")
+
+
+def facet_counts(coop_ids=None):
+    """
+    Returns a dictionary of facet value -> number of coops.  Without
+    ``coop_ids`` these are the precomputed counts over all coops; otherwise
+    they are counted over just those coops, given as a list of ids or as
+    the Matches of a search or filter.
+    """
+    reindex_pending()
+    if coop_ids is None:
+        return dict(FacetCount.objects.filter(count__gt = 0).values_list(
+                'facet', 'count'))
+    if isinstance(coop_ids, Matches):
+        cursor = connection.cursor()
+        cursor.execute("SELECT facet, COUNT(*) FROM %s WHERE coop_id IN (%s) "
+                "GROUP BY facet" % (
+                    connection.ops.quote_name(CoopFacet._meta.db_table),
+                    coop_ids.sql), coop_ids.params)
+        return dict(cursor.fetchall())
+    counts = {}
+    for chunk in chunks(coop_ids):
+        for facet in CoopFacet.objects.filter(coop__in = chunk).values_list(
+                'facet', flat = True):
+            counts[facet] = counts.get(facet, 0) + 1
+    return counts
+
+
+def facet_groups(counts, selected, querystring):
+    """
+    Lays the facet counts out for templates: a list of groups, one for
+    categories and one per question, each with a label and a list of
+    values.  Every value has a label, a count, whether it is selected and
+    the querystring that toggles it.  Selected values are always there,
+    even with no coops, so that they can be toggled off again.
+    """
+    categories = {}
+    answers = {}
+    for facet in set(counts) | set(selected):
+        parts = facet.split(':')
+        try:
+            if parts[0] == 'category':
+                categories[facet] = int(parts[1])
+            elif parts[0] == 'answer':
+                answers[facet] = (int(parts[1]), int(parts[2]))
+        except (IndexError, ValueError):
+            # A malformed request parameter.
+            continue
+    category_objects = in_bulk(CoopCategory.objects.all(), categories.values())
+    question_objects = in_bulk(Question.objects.select_related('prompt'),
+            [q for q, a in answers.values()])
+    answer_objects = in_bulk(Answer.objects.all(),
+            [a for q, a in answers.values()])
+
+    def value(facet, label):
+        if facet in selected:
+            toggled = [f for f in selected if f != facet]
+        else:
+            toggled = selected + [facet]
+        return {
+            'label': label,
+            'count': counts.get(facet, 0),
+            'selected': facet in selected,
+            'querystring': querystring(toggled),
+        }
+
+    groups = []
+    values = [value(f, category_objects[c].category)
+            for f, c in categories.items() if c in category_objects]
+    if values:
+        values.sort(key = lambda v: v['label'])
+        groups.append({'label': u"Categories", 'values': values})
+    by_question = {}
+    for f, (q, a) in answers.items():
+        if q in question_objects and a in answer_objects:
+            by_question.setdefault(q, []).append(
+                    value(f, answer_objects[a].answer))
+    for q, values in by_question.items():
+        values.sort(key = lambda v: v['label'])
+        groups.append({'label': question_objects[q].prompt.prompt,
+                'values': values})
+    return groups
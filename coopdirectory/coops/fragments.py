@@ -0,0 +1,117 @@
+"""
+Cache of rendered coop fragments.
+
+A coop's revision only changes when it is edited, so the HTML for a coop's
+detail page or list row is cached under its branch and revision, in whatever
+CACHE_BACKEND is configured.  Saving a new revision changes the key, so the
+old fragment is simply never read again.  Answered questions, categories and
+contact details aren't part of the coop's revision, so changing them (or the
+text of a category, question or answer) deletes the fragments of the coop's
+current revision explicitly (see invalidate_coop).
+
+Coop pictures are shown in whichever format the browser accepts (see
+sorl.thumbnail.formats), so a fragment whose thumbnails were negotiated is
+cached once per set of accepted image formats, all under the one key, and
+using it makes the response vary by Accept.  Any other fragment is cached
+once for every browser.
+
+Lookups are counted per process; stats() returns the counts.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from sorl.thumbnail import formats
+
+FRAGMENTS = ('detail', 'row')
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+def timeout():
+    return getattr(settings, 'COOP_FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+def fragment_key(name, coop):
+    return 'coops.fragment.%s.%s.%s' % (name, coop.branch_id, coop.revision)
+
+# The variant of a fragment which doesn't depend on the Accept header.
+ANY = '*'
+
+def _variant():
+    return '.'.join(formats.accepted_formats())
+
+def _choose(variants):
+    if ANY in variants:
+        return variants[ANY]
+    html = variants.get(_variant())
+    if html is not None:
+        formats.negotiated()
+    return html
+
+def get_fragment(name, coop):
+    """
+    Returns the cached fragment ``name`` of a coop revision, or None.
+    Fragments fetched beforehand by get_fragments are used first.
+    """
+    preloaded = getattr(coop, '_fragments', {})
+    if name in preloaded:
+        variants = preloaded.pop(name)
+    else:
+        variants = cache.get(fragment_key(name, coop))
+    html = _choose(variants or {})
+    _count(html)
+    return html
+
+def get_fragments(name, coops):
+    """
+    Fetches fragment ``name`` of many coops with a single cache request, so
+    that get_fragment finds them without going back to the cache.  Returns
+    the coops whose fragment isn't cached.
+    """
+    variant = _variant()
+    keys = dict([(fragment_key(name, coop), coop) for coop in coops])
+    found = cache.get_many(keys.keys())
+    for key, variants in found.items():
+        coop = keys[key]
+        if not hasattr(coop, '_fragments'):
+            coop._fragments = {}
+        coop._fragments[name] = variants
+    def cached(coop):
+        variants = found.get(fragment_key(name, coop), {})
+        return ANY in variants or variant in variants
+    return [coop for coop in coops if not cached(coop)]
+
+def set_fragment(name, coop, html, negotiated=False):
+    """
+    Caches fragment ``name`` of a coop revision.  ``negotiated`` tells
+    whether rendering it depended on the Accept header.
+    """
+    key = fragment_key(name, coop)
+    if not negotiated:
+        cache.set(key, {ANY: html}, timeout())
+        return
+    variants = cache.get(key) or {}
+    variants[_variant()] = html
+    cache.set(key, variants, timeout())
+
+def invalidate_coop(coop):
+    """
+    Deletes the cached fragments of a coop's current revision.
+    """
+    for name in FRAGMENTS:
+        cache.delete(fragment_key(name, coop))
+
+def _count(html):
+    if html is None:
+        _stats['misses'] += 1
+    else:
+        _stats['hits'] += 1
+
+def stats():
+    """
+    Returns the fragment cache hits and misses of this process.
+    """
+    return dict(_stats)
+
+def reset_stats():
+    _stats['hits'] = _stats['misses'] = 0
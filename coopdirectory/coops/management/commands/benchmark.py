@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+
+from coopdirectory.coops.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--rounds', type='int', dest='rounds', default=None,
+            help='How many times each benchmark repeats its operation.'),
+    )
+    help = 'Runs the named coops benchmarks (default: all) on a test database.'
+    args = '[benchmark ...]'
+
+    requires_model_validation = True
+
+    def handle(self, *names, **options):
+        verbosity = int(options.get('verbosity', 1))
+        kwargs = {}
+        if options.get('rounds') is not None:
+            kwargs['rounds'] = options['rounds']
+        names = names or sorted(BENCHMARKS.keys())
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError("Unknown benchmark: %s" % name)
+
+        old_name = settings.DATABASE_NAME
+        connection.creation.create_test_db(verbosity, autoclobber=True)
+        try:
+            call_command('loaddata', 'test_coops', verbosity=verbosity)
+            for name in names:
+                print name
+                for label, value in BENCHMARKS[name](**kwargs):
+                    print "    %-45s %10.2f" % (label, value)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity)
@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+
+from coopdirectory.coops.models import Coop
+from coopdirectory.coops.search import rebuild_index
+from coopdirectory.coops.facets import rebuild_facets
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the coop search index and facet counts from the current coops.'
+
+    def handle_noargs(self, **options):
+        count = rebuild_index()
+        rebuild_facets(Coop.objects.heads())
+        if int(options.get('verbosity', 1)) > 0:
+            print "Indexed %d coops." % count
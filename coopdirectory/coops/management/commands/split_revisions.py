@@ -0,0 +1,43 @@
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection, transaction
+
+from coopdirectory.coops.models import Coop, AnsweredQuestion, Revision, \
+        uses_revision_log
+
+
+def split_revisions(model):
+    """
+    Moves the archived revisions of ``model`` out of its table and into the
+    revision log.  Returns how many revisions were moved.
+    """
+    ids = []
+    for archived in model.objects.archived().order_by('pk'):
+        Revision.objects.log(model, archived._column_values())
+        ids.append(archived.pk)
+    # Delete with plain SQL so nothing cascades: nothing should refer to an
+    # archived revision, only to its branch.
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (
+                qn(model._meta.db_table), qn(model._meta.pk.column),
+                ", ".join(["%s"] * len(chunk))), chunk)
+    transaction.set_dirty()
+    return len(ids)
+split_revisions = transaction.commit_on_success(split_revisions)
+
+
+class Command(NoArgsCommand):
+    help = 'Moves archived Coop and AnsweredQuestion revisions into the revision log.'
+
+    def handle_noargs(self, **options):
+        if not uses_revision_log():
+            raise CommandError("Set REVISION_STORAGE to 'log' or 'delta' in "
+                    "your settings before splitting revisions out.")
+        verbosity = int(options.get('verbosity', 1))
+        for model in (Coop, AnsweredQuestion):
+            moved = split_revisions(model)
+            if verbosity > 0:
+                print "%s: moved %d archived revisions to the log." % (
+                        model._meta.object_name, moved)
@@ -1,7 +1,18 @@
-from django.db import models
+from django.db import models, connection, transaction, DatabaseError
+from django.db.models import signals
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import request_started, request_finished
+from django.utils import simplejson
+
+from sorl.thumbnail.fields import ImageWithThumbnailsField
+from coopdirectory.coops.prefetch import chunks, in_bulk, \
+        prefetch_foreign_key, prefetch_m2m, prefetch_reverse, related_objects
 
 import datetime
+import threading
 
 #
 # Coop Users
@@ -37,6 +48,122 @@ class CoopUser(models.Model):
 # Each revision stores the date when it was created, as well as the CoopUser
 # that created the revision.  The CoopUser field must be manually filled by
 # the saving view, or it will default to the original creator.
+#
+# An edit costs two statements (UPDATE of the head, INSERT of the archived
+# revision) in one transaction; see coops.benchmarks.revision_save.
+#
+# Where archived revisions live depends on the REVISION_STORAGE setting:
+#
+#    'inline' (the default): in the model's own table, next to the heads.
+#    'log': in the append-only Revision table, keyed by (branch, revision),
+#           so the model's table only holds heads.  Existing data is moved
+#           over with "./manage.py split_revisions".
+#    'delta': like 'log', but each revision only stores the fields which
+#           differ from the revision after it, with a full snapshot every
+#           REVISION_SNAPSHOT_INTERVAL revisions (default 25) so rebuilding
+#           any one revision reads a bounded number of rows.  Each log row
+#           records whether it is a snapshot, and revisions are rebuilt from
+#           the nearest stored one, so the interval can be changed at any
+#           time.
+#
+# Either way, use the manager's heads() for current rows, and history() on
+# an instance for its archived revisions:
+#    >>> Coop.objects.heads()
+#    >>> Coop.objects.get(pk = 3).history()
+#    >>> Coop.objects.get(pk = 3).get_revision(5)
+# and the manager's as_of() for the revisions current at a given time:
+#    >>> Coop.objects.as_of(datetime.datetime(2008, 9, 1))
+
+def revision_storage():
+    return getattr(settings, 'REVISION_STORAGE', 'inline')
+
+def uses_revision_log():
+    return revision_storage() in ('log', 'delta')
+
+def snapshot_interval():
+    return getattr(settings, 'REVISION_SNAPSHOT_INTERVAL', 25)
+
+class VersionedManager(models.Manager):
+    def _heads_where(self, op):
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        return ["%s.%s %s %s.%s" % (qn(opts.db_table), qn(opts.pk.column), op,
+                qn(opts.db_table), qn(opts.get_field('branch').column))]
+
+    def heads(self):
+        """
+        Only the current revision of every branch.
+        """
+        if uses_revision_log():
+            return self.get_query_set()
+        return self.get_query_set().extra(where = self._heads_where('='))
+
+    def archived(self):
+        """
+        Archived revisions still stored in the model's own table.
+        """
+        return self.get_query_set().extra(where = self._heads_where('<>'))
+
+    def histories(self, branch_ids):
+        """
+        Every revision of the given branches, heads included, as a dict of
+        lists keyed by branch id, oldest first.  Creators (with their users)
+        and many-to-many values are loaded up front, so the number of
+        queries does not grow with the number of branches or revisions.
+        """
+        branch_ids = list(branch_ids)
+        if uses_revision_log():
+            heads = in_bulk(self.get_query_set(), branch_ids).values()
+            revisions = Revision.objects.histories(self.model, heads)
+        else:
+            revisions = []
+            for chunk in chunks(branch_ids):
+                revisions.extend(self.filter(branch__in = chunk))
+        prefetch_foreign_key(revisions, 'created_by',
+                CoopUser.objects.select_related('user'))
+        for f in self.model._meta.many_to_many:
+            if f.rel.through is None:
+                prefetch_m2m(revisions, f.name)
+        histories = dict([(branch_id, []) for branch_id in branch_ids])
+        for revision in revisions:
+            histories[revision.branch_id].append(revision)
+        for history in histories.values():
+            history.sort(key = lambda r: r.revision)
+        return histories
+
+    def as_of(self, when):
+        """
+        The revision of every branch that was current at datetime ``when``,
+        as a list.  Branches created after ``when`` are left out.
+
+        In 'inline' storage this is a single query, which uses the index on
+        (branch, created_at) from sql/<model>.sql to find each branch's
+        latest revision no newer than ``when``.
+        """
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        names = {
+            'table': qn(opts.db_table),
+            'branch': qn(opts.get_field('branch').column),
+            'revision': qn(opts.get_field('revision').column),
+            'created_at': qn(opts.get_field('created_at').column),
+        }
+        if not uses_revision_log():
+            return list(self.get_query_set().extra(where = [
+                    "%(table)s.%(created_at)s <= %%s" % names,
+                    "%(table)s.%(revision)s = (SELECT MAX(v.%(revision)s)"
+                    " FROM %(table)s v WHERE v.%(branch)s = %(table)s.%(branch)s"
+                    " AND v.%(created_at)s <= %%s)" % names],
+                params = [connection.ops.value_to_db_datetime(when)] * 2))
+        revisions = []
+        newer = []
+        for head in self.get_query_set():
+            if head.created_at <= when:
+                revisions.append(head)
+            else:
+                newer.append(head)
+        return revisions + Revision.objects.as_of(self.model, newer, when)
+
 class VersionedModel(models.Model):
     # We only need "created" fields; each revision is an "update", see
     # revision 1 for the "original" creator and date.
@@ -49,31 +176,127 @@ class VersionedModel(models.Model):
             related_name='%(class)s_branch', help_text="handled automatically, don't change")
     revision = models.IntegerField(default = 0, blank = True, help_text="handled automatically, don't change")
 
-    # Ensure safety of revisions by using "@transaction.commit_on_success"
-    # decorator in views that call save.
+    objects = VersionedManager()
+
+    def __init__(self, *args, **kwargs):
+        super(VersionedModel, self).__init__(*args, **kwargs)
+        self._remember_head()
+
+    # The values last read from or written to the head row.  save() archives
+    # these directly instead of reading the head back from the database.
+    def _remember_head(self):
+        if self.pk is not None and self.pk == self.branch_id:
+            self._stored_head = self._column_values()
+        else:
+            self._stored_head = None
+
+    def _column_values(self):
+        return dict([(f.attname, getattr(self, f.attname))
+                for f in self._meta.fields if not f.primary_key])
+
+    # Saving a revision is done in one transaction and never reads the head
+    # row back: the head row is updated in place (guarded on the revision we
+    # loaded) and the previous values are inserted as an archived revision.
+    # A first save is an INSERT followed by a one-column UPDATE of "branch".
     def save(self, *args, **kwargs):
-        # if this is an update (aka this model's been saved before):
         if self.pk:
-            # get a new copy of the latest from database, without unsaved modifications
-            latest = self.__class__.objects.get(pk = self.branch.pk)
-
-            # update the new version
-            self.pk = latest.pk # must set explicitly in case we aren't editing latest
-            self.revision = latest.revision + 1
-            self.created_at = datetime.datetime.now()
-            super(VersionedModel, self).save(*args, **kwargs)
-            
-            # force insert by blanking pk
-            latest.pk = None
-            # Save old version next -- must be saved after new version is done,
-            # or will raise IntegrityError
-            super(VersionedModel, latest).save(*args, **kwargs)
+            signals.pre_save.send(sender=self.__class__, instance=self, raw=False)
+            self._save_revision()
+            signals.post_save.send(sender=self.__class__, instance=self,
+                    created=False, raw=False)
+        else:
+            self._save_first_revision(*args, **kwargs)
+        self._remember_head()
+    save.alters_data = True
+
+    def _save_first_revision(self, *args, **kwargs):
+        kwargs['force_insert'] = True
+        super(VersionedModel, self).save(*args, **kwargs)
+        qn = connection.ops.quote_name
+        branch = self._meta.get_field('branch')
+        cursor = connection.cursor()
+        cursor.execute("UPDATE %s SET %s = %%s WHERE %s = %%s" % (
+                qn(self._meta.db_table), qn(branch.column),
+                qn(self._meta.pk.column)), [self.pk, self.pk])
+        transaction.set_dirty()
+        self.branch = self
+    _save_first_revision = transaction.commit_on_success(_save_first_revision)
+
+    def _save_revision(self):
+        cursor = connection.cursor()
+        head = None
+        if self.pk == self.branch_id:
+            head = self._stored_head
+        if head is None or not self._update_head(cursor, head):
+            # We are editing an old revision, or someone else saved a
+            # revision since we loaded this one; archive the real head.
+            head = self.__class__._default_manager.get(
+                    pk = self.branch_id)._stored_head
+            if not self._update_head(cursor, head):
+                raise DatabaseError("Head of %s branch %s changed during save."
+                        % (self._meta.object_name, self.branch_id))
+        if revision_storage() == 'delta':
+            Revision.objects.log(self.__class__, head, self._column_values())
+        elif revision_storage() == 'log':
+            Revision.objects.log(self.__class__, head)
         else:
-            # First we must establish an instance.
-            super(VersionedModel, self).save(*args, **kwargs)
-            # Next, we can set the branch to self.
-            self.branch = self
-            super(VersionedModel, self).save(*args, **kwargs)
+            self._insert_archived(cursor, head)
+        transaction.set_dirty()
+    _save_revision = transaction.commit_on_success(_save_revision)
+
+    def _update_head(self, cursor, head):
+        """
+        Writes this instance over the head row as the next revision.  Returns
+        False if the head row is no longer at the revision ``head`` records.
+        """
+        qn = connection.ops.quote_name
+        self.pk = self.branch_id # must set explicitly in case we aren't editing latest
+        self.revision = head['revision'] + 1
+        self.created_at = datetime.datetime.now()
+        fields = [f for f in self._meta.fields if not f.primary_key]
+        cursor.execute("UPDATE %s SET %s WHERE %s = %%s AND %s = %%s" % (
+                qn(self._meta.db_table),
+                ", ".join(["%s = %%s" % qn(f.column) for f in fields]),
+                qn(self._meta.pk.column),
+                qn(self._meta.get_field('revision').column)),
+            [f.get_db_prep_save(f.pre_save(self, False)) for f in fields] +
+            [self.pk, head['revision']])
+        return cursor.rowcount == 1
+
+    def _insert_archived(self, cursor, head):
+        """
+        Inserts the values in ``head`` as an archived revision, which gets a
+        new primary key.
+        """
+        qn = connection.ops.quote_name
+        fields = [f for f in self._meta.fields if not f.primary_key]
+        cursor.execute("INSERT INTO %s (%s) VALUES (%s)" % (
+                qn(self._meta.db_table),
+                ", ".join([qn(f.column) for f in fields]),
+                ", ".join(["%s"] * len(fields))),
+            [f.get_db_prep_save(head[f.attname]) for f in fields])
+
+    def history(self):
+        """
+        Returns the archived revisions of this branch, oldest first.  With a
+        revision log these are rebuilt from the log and have no primary key.
+        """
+        if uses_revision_log():
+            return Revision.objects.history(self.__class__, self.branch_id)
+        return list(self.__class__._default_manager.filter(
+                branch__pk = self.branch_id).exclude(pk = self.branch_id))
+
+    def get_revision(self, number):
+        """
+        Returns revision ``number`` of this branch.
+        """
+        manager = self.__class__._default_manager
+        if uses_revision_log():
+            head = manager.get(pk = self.branch_id)
+            if head.revision == number:
+                return head
+            return Revision.objects.rebuild(self.__class__, self.branch_id, number)
+        return manager.get(branch__pk = self.branch_id, revision = number)
 
     class Meta:
         abstract = True
@@ -81,6 +304,184 @@ class VersionedModel(models.Model):
         ordering = ['revision']
         unique_together = ['branch', 'revision']
 
+class RevisionManager(models.Manager):
+    def _for_branch(self, model, branch_id):
+        return self.filter(content_type = ContentType.objects.get_for_model(model),
+                branch = branch_id)
+
+    def log(self, model, values, successor=None):
+        """
+        Appends an archived revision of ``model`` given its column values.
+
+        If the values of the ``successor`` revision are given, only the
+        fields that differ from it are stored, except on every
+        REVISION_SNAPSHOT_INTERVAL'th revision which is stored in full.
+        """
+        data = values
+        snapshot = (successor is None or
+                values['revision'] % snapshot_interval() == 0)
+        if not snapshot:
+            data = dict([(k, v) for k, v in values.items()
+                    if successor.get(k) != v])
+        entry = self.model(
+                content_type = ContentType.objects.get_for_model(model),
+                branch = values['branch_id'],
+                revision = values['revision'],
+                created_by_id = values['created_by_id'],
+                created_at = values['created_at'],
+                snapshot = snapshot,
+                data = simplejson.dumps(data, cls = DjangoJSONEncoder))
+        entry.save(force_insert = True)
+        return entry
+
+    def history(self, model, branch_id):
+        entries = list(self._for_branch(model, branch_id).order_by('-revision'))
+        return _rebuild(model, branch_id, entries)
+
+    def histories(self, model, heads):
+        """
+        The given heads followed by all of their archived revisions, read
+        from the log in one query per CHUNK_SIZE branches.
+        """
+        content_type = ContentType.objects.get_for_model(model)
+        entries = {}
+        for chunk in chunks([head.pk for head in heads]):
+            for entry in self.filter(content_type = content_type,
+                    branch__in = chunk).order_by('-revision'):
+                entries.setdefault(entry.branch, []).append(entry)
+        revisions = list(heads)
+        for head in heads:
+            revisions.extend(_rebuild(model, head.pk,
+                    entries.get(head.pk, []), head))
+        return revisions
+
+    def rebuild(self, model, branch_id, number):
+        """
+        Rebuilds revision ``number`` of a branch.  Reads the log entries from
+        ``number`` up to the nearest snapshot after it, or up to the head if
+        no snapshot follows.
+        """
+        entries = self._for_branch(model, branch_id).filter(
+                revision__gte = number)
+        snapshots = entries.filter(snapshot = True).order_by('revision')
+        snapshots = list(snapshots.values_list('revision', flat = True)[:1])
+        if snapshots:
+            entries = entries.filter(revision__lte = snapshots[0])
+        entries = list(entries.order_by('-revision'))
+        if not entries or entries[-1].revision != number:
+            raise model.DoesNotExist("%s branch %s has no archived revision %s."
+                    % (model._meta.object_name, branch_id, number))
+        return _rebuild(model, branch_id, _from_snapshot(entries))[0]
+
+    def as_of(self, model, heads, when):
+        """
+        Rebuilds the revisions of the given heads' branches that were current
+        at ``when``, in one query per CHUNK_SIZE branches.  Branches that
+        didn't exist yet are left out.
+        """
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        current = ("(SELECT MAX(r.revision) FROM %(table)s r"
+                " WHERE r.content_type_id = %(table)s.content_type_id"
+                " AND r.branch = %(table)s.branch AND r.created_at <= %%s)"
+                % {'table': table})
+        # Entries from the current one up to the nearest snapshot at or
+        # after it: those with no snapshot between the current one and them.
+        no_snapshot_between = ("NOT EXISTS (SELECT 1 FROM %(table)s s"
+                " WHERE s.content_type_id = %(table)s.content_type_id"
+                " AND s.branch = %(table)s.branch AND s.snapshot = %%s"
+                " AND s.revision >= %(current)s"
+                " AND s.revision < %(table)s.revision)"
+                % {'table': table, 'current': current})
+        when = connection.ops.value_to_db_datetime(when)
+        content_type = ContentType.objects.get_for_model(model)
+        heads = dict([(head.pk, head) for head in heads])
+        entries = {}
+        for chunk in chunks(heads.keys()):
+            for entry in self.filter(content_type = content_type,
+                    branch__in = chunk).extra(
+                        where = ["%s.revision >= %s" % (table, current),
+                                 no_snapshot_between],
+                        params = [when, True, when]
+                    ).order_by('-revision'):
+                entries.setdefault(entry.branch, []).append(entry)
+        revisions = []
+        for branch_id, branch_entries in entries.items():
+            revisions.append(_rebuild(model, branch_id,
+                    _from_snapshot(branch_entries), heads[branch_id])[0])
+        return revisions
+
+def _from_snapshot(entries):
+    """
+    Drops the log entries (newest first) above the oldest snapshot; the
+    rest rebuild without needing the head.
+    """
+    for i in range(len(entries) - 1, -1, -1):
+        if entries[i].snapshot:
+            return entries[i:]
+    return entries
+
+def _rebuild(model, branch_id, entries, head=None):
+    """
+    Turns log entries, newest first, into instances, oldest first.  Deltas
+    are applied on top of the revision after them, which is the head for the
+    newest entry unless it is a snapshot.
+    """
+    revisions = []
+    values = None
+    for entry in entries:
+        if entry.snapshot:
+            values = entry.values(model)
+        else:
+            if values is None:
+                if head is None:
+                    head = model._default_manager.get(pk = branch_id)
+                values = head._column_values()
+            values = dict(values)
+            values.update(entry.values(model))
+        revisions.append(model(**values))
+    revisions.reverse()
+    return revisions
+
+# An archived revision of a VersionedModel in 'log' or 'delta' storage.  The
+# column values of the revision are kept as JSON in "data": all of them for
+# a snapshot, otherwise only those which differ from the next revision.
+# Rows are only ever appended.
+class Revision(models.Model):
+    content_type = models.ForeignKey(ContentType)
+    branch = models.PositiveIntegerField()
+    revision = models.IntegerField()
+    created_by = models.ForeignKey('CoopUser')
+    created_at = models.DateTimeField()
+    snapshot = models.BooleanField(default = True)
+    data = models.TextField()
+
+    objects = RevisionManager()
+
+    def values(self, model):
+        """
+        The stored column values of ``model``, keyed by attribute name.
+        """
+        data = simplejson.loads(self.data)
+        values = {}
+        for f in model._meta.fields:
+            if f.attname in data:
+                values[str(f.attname)] = f.to_python(data[f.attname])
+        return values
+
+    def instance(self, model):
+        """
+        Rebuilds a snapshot as an unsaved ``model`` instance.
+        """
+        return model(**self.values(model))
+
+    def __unicode__(self):
+        return u"<%s %s r%s>" % (self.content_type, self.branch, self.revision)
+
+    class Meta:
+        ordering = ['revision']
+        unique_together = ['content_type', 'branch', 'revision']
+
 #
 # Customizable Questions
 #
@@ -142,8 +543,12 @@ class AnsweredQuestion(VersionedModel):
     # The order this response appears in a coop's description
     order = models.IntegerField()
     coop = models.ForeignKey('Coop')
+
+    def answer_list(self):
+        return related_objects(self, 'answers')
+
     def __unicode__(self):
-        return u"<%s: %s>" % (self.question, self.answers.all()[0])
+        return u"<%s: %s>" % (self.question, self.answer_list()[0])
 
 # An organizing strategy for questions.
 class QuestionCategory(models.Model):
@@ -159,8 +564,8 @@ class QuestionCategory(models.Model):
 
 class Contactable(models.Model): 
     def __unicode__(self):
-        parts_1 = [u"%s" % a for a in self.email_set.all()]
-        parts_2 = [u"%s" % a for a in self.phonenumber_set.all()]
+        parts_1 = [u"%s" % a for a in related_objects(self, 'email_set')]
+        parts_2 = [u"%s" % a for a in related_objects(self, 'phonenumber_set')]
         return u", ".join(parts_1 + parts_2) or u"none provided"
 
 # A label for a contact method, e.g. "Main", "Work", "Home", etc.
@@ -196,7 +601,7 @@ class PhoneNumber(ContactMethod):
     phone_number = models.CharField(max_length=20)
 
     def __unicode__(self):
-        return u"%s: %s" % [self.label, self.phone_number]
+        return u"%s: %s" % (self.label, self.phone_number)
 
 #
 # Coops
@@ -208,6 +613,36 @@ class PhoneNumber(ContactMethod):
 # XXX TODO: We need to specify some way of ordering and organizing
 # the answer sets.  As of now, it's just an unordered set.
 
+class CoopManager(VersionedManager):
+    def for_list(self):
+        """
+        Current coops, with their pictures and contactables joined in.  Use
+        with prefetch_for_list() on each page.
+        """
+        return self.heads().select_related('picture', 'contactable')
+
+    def prefetch_for_list(self, coops):
+        """
+        Loads the related objects a list of coops can be rendered with (the
+        contactables' emails and phone numbers, categories, and current
+        answered questions with their answers) in a fixed number of
+        queries, so that showing them doesn't take queries per row.
+        """
+        contactables = [c.contactable for c in coops]
+        prefetch_reverse(contactables, 'email_set',
+                Email.objects.select_related('label'))
+        prefetch_reverse(contactables, 'phonenumber_set',
+                PhoneNumber.objects.select_related('label'))
+        prefetch_m2m(coops, 'categories')
+        prefetch_reverse(coops, 'answeredquestion_set',
+                AnsweredQuestion.objects.heads().select_related(
+                    'question__prompt').order_by('order'))
+        answered = []
+        for coop in coops:
+            answered.extend(coop.answered_question_list())
+        prefetch_m2m(answered, 'answers')
+        return coops
+
 class Coop(VersionedModel):
     # Required manual-entry fields
     name = models.CharField(max_length=200)
@@ -219,6 +654,16 @@ class Coop(VersionedModel):
     # Optional manual-entry fields
     categories = models.ManyToManyField('CoopCategory', null=True)
 
+    objects = CoopManager()
+
+    def category_list(self):
+        return related_objects(self, 'categories')
+
+    def answered_question_list(self):
+        return related_objects(self, 'answeredquestion_set',
+                AnsweredQuestion.objects.heads().filter(coop = self.pk
+                    ).order_by('order'))
+
     @models.permalink
     def get_absolute_url(self):
         return ('show_coop', [str(self.id)])
@@ -226,6 +671,33 @@ class Coop(VersionedModel):
     def __unicode__(self):
         return self.name
 
+# The search index: one row per distinct term of each current coop.  See
+# coops/search.py.
+class SearchTerm(models.Model):
+    term = models.CharField(max_length = 50, db_index = True)
+    coop = models.ForeignKey(Coop)
+    weight = models.IntegerField()
+
+    class Meta:
+        unique_together = ['term', 'coop']
+
+# Facets: one row per facet value (see coops/facets.py) of each current
+# coop, and the number of coops with each facet value.  Both are kept up
+# to date along with the search index.
+class CoopFacet(models.Model):
+    facet = models.CharField(max_length = 50, db_index = True)
+    coop = models.ForeignKey(Coop)
+
+    class Meta:
+        unique_together = ['facet', 'coop']
+
+class FacetCount(models.Model):
+    facet = models.CharField(max_length = 50, unique = True)
+    count = models.IntegerField(default = 0)
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.facet, self.count)
+
 class CoopCategory(models.Model):
     category = models.CharField(max_length = 200)
     def __unicode__(self):
@@ -246,6 +718,146 @@ class CoopRelationship(models.Model):
 
 class CoopPicture(models.Model):
     stock = models.BooleanField(default = False)
-    picture = models.ImageField(upload_to = "uploads/coop_pictures/%Y/%m/")
+    picture = ImageWithThumbnailsField(
+            upload_to = "uploads/coop_pictures/%Y/%m/",
+            thumbnail = {'size': (100, 100), 'format': ('webp', 'jpeg')},
+            extra_thumbnails = {
+                'large': {'size': (400, 400), 'format': ('webp', 'jpeg')},
+            })
     def __unicode__(self):
         return u"%s" % self.picture
+
+#
+# Keep the search index, facet counts and cached fragments current as
+# revisions are saved.  Saving a coop, or an answered question, only marks
+# the coop as stale: changes to many-to-many values are saved after the
+# instance itself, and an admin save touches the coop once per inline, so
+# the stale coops are reindexed once each when the request starts or
+# finishes, and before the index is read (see reindex_pending).
+#
+
+def reindex_coop(coop):
+    """
+    Updates the search index and facets of a coop, given its current
+    revision, and drops its rendered fragments.
+    """
+    from coopdirectory.coops import search, facets, fragments
+    search.index_coop(coop)
+    facets.index_coop(coop)
+    fragments.invalidate_coop(coop)
+
+_stale = threading.local()
+
+def _stale_ids():
+    if not hasattr(_stale, 'ids'):
+        _stale.ids = set()
+    return _stale.ids
+
+def schedule_reindex(coop_id):
+    """
+    Marks a coop (by branch id) as needing reindex_coop.
+    """
+    _stale_ids().add(coop_id)
+
+def reindex_pending(**kwargs):
+    """
+    Reindexes the coops marked by schedule_reindex in this thread.  Coops
+    deleted since are skipped.
+    """
+    ids = _stale_ids()
+    if not ids:
+        return
+    pending = list(ids)
+    ids.clear()
+    for coop in Coop.objects.heads().filter(pk__in = pending):
+        reindex_coop(coop)
+
+# Fixture loading saves raw rows in no particular order; rebuild the index
+# afterwards instead.
+def _index_coop(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_reindex(instance.branch_id or instance.pk)
+
+def _index_answered_question(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_reindex(instance.coop_id)
+
+def _unindex_answered_question(sender, instance, **kwargs):
+    schedule_reindex(instance.coop_id)
+
+# Categories, questions and answers are shown in (and partly indexed from)
+# every coop which uses them.
+def _coops_using(sender, instance):
+    if sender is CoopCategory:
+        return Coop.objects.heads().filter(
+                categories = instance).values_list('pk', flat = True)
+    answered = AnsweredQuestion.objects.heads()
+    if sender is Answer:
+        answered = answered.filter(answers = instance)
+    elif sender is Question:
+        answered = answered.filter(question = instance)
+    else:
+        answered = answered.filter(question__prompt = instance)
+    return answered.values_list('coop', flat = True)
+
+# Deleting a category or answer also deletes the coops' links to it, so
+# they are looked up before it goes.
+def _reindex_coops_using(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for coop_id in _coops_using(sender, instance):
+        schedule_reindex(coop_id)
+
+# Contact details are shared by every coop with the contactable.
+def _invalidate_contactable(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from coopdirectory.coops import fragments
+    for coop in Coop.objects.heads().filter(
+            contactable = instance.contactable_id):
+        fragments.invalidate_coop(coop)
+
+def _invalidate_picture(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from coopdirectory.coops import fragments
+    for coop in Coop.objects.heads().filter(picture = instance.pk):
+        fragments.invalidate_coop(coop)
+
+def _unindex_coop(sender, instance, **kwargs):
+    from coopdirectory.coops import facets
+    facets.unindex_coop(instance)
+
+# The stale coops are kept in this module, so if it is imported a second
+# time under another name (as the tests do, as "coops.models") the copy
+# mustn't connect handlers of its own.  A dispatch_uid names a handler for
+# each sender separately.
+signals.post_save.connect(_index_coop, sender = Coop,
+        dispatch_uid = 'coops.index_coop')
+signals.post_save.connect(_index_answered_question, sender = AnsweredQuestion,
+        dispatch_uid = 'coops.index_answered_question')
+signals.pre_delete.connect(_unindex_coop, sender = Coop)
+signals.post_delete.connect(_unindex_answered_question,
+        sender = AnsweredQuestion, dispatch_uid = 'coops.unindex_answered_question')
+signals.post_save.connect(_reindex_coops_using, sender = CoopCategory,
+        dispatch_uid = 'coops.reindex_coops_using')
+signals.post_save.connect(_reindex_coops_using, sender = Question,
+        dispatch_uid = 'coops.reindex_coops_using')
+signals.post_save.connect(_reindex_coops_using, sender = Prompt,
+        dispatch_uid = 'coops.reindex_coops_using')
+signals.post_save.connect(_reindex_coops_using, sender = Answer,
+        dispatch_uid = 'coops.reindex_coops_using')
+signals.pre_delete.connect(_reindex_coops_using, sender = CoopCategory,
+        dispatch_uid = 'coops.reindex_coops_using')
+signals.pre_delete.connect(_reindex_coops_using, sender = Answer,
+        dispatch_uid = 'coops.reindex_coops_using')
+request_started.connect(reindex_pending, dispatch_uid = 'coops.reindex_started')
+request_finished.connect(reindex_pending,
+        dispatch_uid = 'coops.reindex_finished')
+signals.post_save.connect(_invalidate_contactable, sender = Email)
+signals.post_delete.connect(_invalidate_contactable, sender = Email)
+signals.post_save.connect(_invalidate_contactable, sender = PhoneNumber)
+signals.post_delete.connect(_invalidate_contactable, sender = PhoneNumber)
+signals.post_save.connect(_invalidate_picture, sender = CoopPicture)
@@ -0,0 +1,101 @@
+"""
+Keyset ("cursor") pagination.
+
+django.core.paginator.Paginator counts the whole result set and then reads
+each page with OFFSET, so deep pages get slower the deeper they are.
+CursorPaginator instead pages through a queryset by primary key, newest
+first: each page is one indexed range query for a page's worth of rows
+(plus one, to tell whether there is a next page), and never counts.
+
+Pages are addressed by opaque cursor strings rather than numbers.  The page
+methods keep Paginator's names so _pagination.html can render either kind;
+it checks ``paginator.uses_cursors`` to leave out the numbered links.
+"""
+
+import base64
+
+from django.core.paginator import InvalidPage
+
+
+class CursorPaginator(object):
+    uses_cursors = True
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        """
+        Returns the page a cursor from a previous page points at, or the
+        first page if ``cursor`` is empty.
+        """
+        direction, key = decode_cursor(cursor)
+        if direction is None:
+            rows = list(self.queryset.order_by('-pk')[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, has_previous=False,
+                    has_next=len(rows) > self.per_page)
+        if direction == 'next':
+            rows = list(self.queryset.filter(pk__lt = key).order_by('-pk')[
+                    :self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, has_previous=True,
+                    has_next=len(rows) > self.per_page)
+        rows = list(self.queryset.filter(pk__gt = key).order_by('pk')[
+                :self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return CursorPage(rows, self, has_previous=has_previous,
+                has_next=True)
+
+
+class CursorPage(object):
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous and bool(object_list)
+        self._has_next = has_next and bool(object_list)
+
+    def __repr__(self):
+        return '<Page of %s objects>' % len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        """
+        The cursor of the next page.
+        """
+        return encode_cursor('next', self.object_list[-1].pk)
+
+    def previous_page_number(self):
+        """
+        The cursor of the previous page.
+        """
+        return encode_cursor('previous', self.object_list[0].pk)
+
+
+def encode_cursor(direction, key):
+    return base64.urlsafe_b64encode('%s:%s' % (direction, key))
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (direction, primary key) a cursor stands for, or
+    (None, None) for an empty cursor.
+    """
+    if not cursor:
+        return None, None
+    try:
+        direction, key = base64.urlsafe_b64decode(str(cursor)).split(':', 1)
+        key = int(key)
+    except (TypeError, ValueError):
+        raise InvalidPage("That page cursor is not valid.")
+    if direction not in ('next', 'previous'):
+        raise InvalidPage("That page cursor is not valid.")
+    return direction, key
@@ -0,0 +1,119 @@
+"""
+Helpers for loading the related objects of many instances at once, so that
+list pages and reports run a fixed number of queries instead of a few per
+row.
+
+Prefetched many-to-many values are kept on each instance and read back with
+related_objects(), which falls back to a query for instances that were not
+prefetched.
+"""
+
+from django.db import connection
+
+# Keep IN (...) lists well under SQLite's limit of 999 parameters.
+CHUNK_SIZE = 500
+
+
+def chunks(ids, size=CHUNK_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def in_bulk(queryset, ids):
+    """
+    Like QuerySet.in_bulk, but safe for any number of ids.
+    """
+    objects = {}
+    for chunk in chunks(ids):
+        objects.update(queryset.in_bulk(chunk))
+    return objects
+
+
+def prefetch_foreign_key(instances, name, queryset=None):
+    """
+    Fills in the ``name`` ForeignKey of every instance from one query over
+    ``queryset``, which defaults to all objects of the related model.  Objects
+    ``queryset`` leaves out (say, because its select_related() joins to a
+    missing row) are loaded with a second query over the related model.
+    """
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(name)
+    default = field.rel.to._default_manager.all()
+    if queryset is None:
+        queryset = default
+    ids = set([getattr(i, field.attname) for i in instances])
+    ids.discard(None)
+    related = in_bulk(queryset, ids)
+    missing = ids.difference(related)
+    if missing and queryset is not default:
+        related.update(in_bulk(default, missing))
+    for instance in instances:
+        value = getattr(instance, field.attname)
+        if value in related:
+            setattr(instance, name, related[value])
+
+
+def prefetch_m2m(instances, name):
+    """
+    Loads the ``name`` many-to-many field of every instance with one query
+    over the join table and one over the related model.
+    """
+    if not instances:
+        return
+    field = instances[0]._meta.get_field(name)
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    pairs = []
+    for chunk in chunks([i.pk for i in instances if i.pk is not None]):
+        cursor.execute("SELECT %s, %s FROM %s WHERE %s IN (%s)" % (
+                qn(field.m2m_column_name()), qn(field.m2m_reverse_name()),
+                qn(field.m2m_db_table()), qn(field.m2m_column_name()),
+                ", ".join(["%s"] * len(chunk))), chunk)
+        pairs.extend(cursor.fetchall())
+    related = in_bulk(field.rel.to._default_manager.all(),
+            set([target for owner, target in pairs]))
+    by_owner = {}
+    for owner, target in pairs:
+        by_owner.setdefault(owner, []).append(related[target])
+    for instance in instances:
+        prefetched = instance.__dict__.setdefault('_prefetched_objects', {})
+        prefetched[name] = by_owner.get(instance.pk, [])
+
+
+def prefetch_reverse(instances, name, queryset=None):
+    """
+    Loads the reverse ForeignKey set ``name`` (e.g. "email_set") of every
+    instance with one query over ``queryset``, which defaults to all
+    objects of the related model.
+    """
+    if not instances:
+        return
+    related = getattr(instances[0].__class__, name).related
+    if queryset is None:
+        queryset = related.model._default_manager.all()
+    by_owner = {}
+    for chunk in chunks(set([i.pk for i in instances if i.pk is not None])):
+        lookup = {'%s__in' % related.field.name: chunk}
+        for obj in queryset.filter(**lookup):
+            by_owner.setdefault(getattr(obj, related.field.attname), []).append(obj)
+    for instance in instances:
+        prefetched = instance.__dict__.setdefault('_prefetched_objects', {})
+        prefetched[name] = by_owner.get(instance.pk, [])
+
+
+def related_objects(instance, name, queryset=None):
+    """
+    Returns the list of related objects ``name`` of ``instance``, from the
+    prefetched values if there are any, otherwise from ``queryset`` or the
+    related manager.
+    """
+    prefetched = getattr(instance, '_prefetched_objects', {})
+    if name in prefetched:
+        return prefetched[name]
+    if instance.pk is None:
+        return []
+    if queryset is None:
+        queryset = getattr(instance, name).all()
+    return list(queryset)
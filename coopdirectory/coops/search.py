@@ -0,0 +1,158 @@
+"""
+Full text search over coops.
+
+Every current coop has a row in the SearchTerm table for each distinct term
+in its name, its categories and the answers to its answered questions,
+weighted by where the term came from.  A search looks its terms up through
+the index on SearchTerm.term and ranks the coops that have all of them by
+their summed weights, so it never scans the coops themselves.  Matches are
+counted and read a page at a time in SQL, so a broad search doesn't load
+every matching id either.
+
+The index is kept up to date one coop at a time as revisions are saved
+(see reindex_pending at the bottom of models.py); rebuild it from scratch
+with "./manage.py rebuild_search_index".
+"""
+
+import re
+
+from django.db import connection, transaction
+
+from coopdirectory.coops.models import Coop, AnsweredQuestion, SearchTerm, \
+        reindex_pending
+from coopdirectory.coops.prefetch import related_objects
+
+term_re = re.compile(r'\w+', re.UNICODE)
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'for', 'in', 'is', 'it', 'of', 'on', 'or',
+    'the', 'to', 'we', 'with',
+])
+
+NAME_WEIGHT = 3
+CATEGORY_WEIGHT = 2
+ANSWER_WEIGHT = 1
+
+
+def tokenize(text):
+    """
+    Splits text into lower case search terms.
+    """
+    return [t for t in term_re.findall(text.lower())
+            if t not in STOP_WORDS]
+
+
+def coop_terms(coop):
+    """
+    Returns a dictionary of term -> weight for a coop's current revision.
+    """
+    weights = {}
+    def add(text, weight):
+        for term in tokenize(text):
+            term = term[:SearchTerm._meta.get_field('term').max_length]
+            weights[term] = weights.get(term, 0) + weight
+    add(coop.name, NAME_WEIGHT)
+    for category in related_objects(coop, 'categories'):
+        add(category.category, CATEGORY_WEIGHT)
+    for answered in AnsweredQuestion.objects.heads().filter(coop = coop.pk):
+        for answer in related_objects(answered, 'answers'):
+            add(answer.answer, ANSWER_WEIGHT)
+    return weights
+
+
+def index_coop(coop):
+    """
+    Replaces the search terms of one coop, given its current revision.
+    """
+    qn = connection.ops.quote_name
+    table = qn(SearchTerm._meta.db_table)
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE coop_id = %%s" % table,
+            [coop.pk])
+    rows = [(term, coop.pk, weight)
+            for term, weight in coop_terms(coop).items()]
+    if rows:
+        cursor.executemany("INSERT INTO %s (term, coop_id, weight) "
+                "VALUES (%%s, %%s, %%s)" % table, rows)
+    transaction.set_dirty()
+index_coop = transaction.commit_on_success(index_coop)
+
+
+def rebuild_index():
+    """
+    Indexes every current coop from scratch.  Returns how many were indexed.
+    """
+    SearchTerm.objects.all().delete()
+    count = 0
+    for coop in Coop.objects.heads():
+        index_coop(coop)
+        count += 1
+    return count
+
+
+class Matches(object):
+    """
+    The ids of the coops matched by a search or a facet filter (see
+    coops.facets.filter_coops), in ``order_by`` order.  ``sql`` selects
+    them as a coop_id column.
+
+    Nothing is read until it is counted, sliced or iterated over, and a
+    slice reads only its own ids (with LIMIT and OFFSET), so Paginator
+    pages through a Matches in two small queries.  It can also be used as
+    a subquery, as facet_counts does.
+    """
+    def __init__(self, sql, params, order_by):
+        self.sql = sql
+        self.params = list(params)
+        self.order_by = order_by
+        self._count = None
+
+    def _ids(self, limit_sql='', limit_params=()):
+        cursor = connection.cursor()
+        cursor.execute("%s ORDER BY %s%s" % (self.sql, self.order_by,
+                limit_sql), self.params + list(limit_params))
+        return [row[0] for row in cursor.fetchall()]
+
+    def count(self):
+        if self._count is None:
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*) FROM (%s) matches" % self.sql,
+                    self.params)
+            self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self._ids())
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice):
+            return self[k:k + 1][0]
+        start = k.start or 0
+        if k.stop is None:
+            return self._ids()[start:]
+        return self._ids(" LIMIT %s OFFSET %s", [max(k.stop - start, 0),
+                start])
+
+
+def search(query, within=None):
+    """
+    Returns the current coops matching every term in the query, best match
+    first, as Matches.  With ``within`` (another Matches), only the coops
+    which are also in it.
+    """
+    reindex_pending()
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return []
+    qn = connection.ops.quote_name
+    sql = "SELECT coop_id FROM %s WHERE term IN (%s)" % (
+            qn(SearchTerm._meta.db_table), ", ".join(["%s"] * len(terms)))
+    params = terms
+    if within is not None:
+        sql += " AND coop_id IN (%s)" % within.sql
+        params = params + within.params
+    sql += " GROUP BY coop_id HAVING COUNT(*) = %s"
+    return Matches(sql, params + [len(terms)], "SUM(weight) DESC, coop_id")
@@ -0,0 +1 @@
+CREATE INDEX coops_answeredquestion_branch_created_at ON coops_answeredquestion (branch_id, created_at);
@@ -0,0 +1 @@
+CREATE INDEX coops_coop_branch_created_at ON coops_coop (branch_id, created_at);
@@ -0,0 +1 @@
+CREATE INDEX coops_revision_branch_created_at ON coops_revision (content_type_id, branch, created_at);
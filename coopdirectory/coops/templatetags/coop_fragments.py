@@ -0,0 +1,52 @@
+from django.template import Library, Node, Variable, TemplateSyntaxError
+from sorl.thumbnail import background, formats
+from coopdirectory.coops.fragments import FRAGMENTS, get_fragment, \
+        set_fragment
+
+register = Library()
+
+
+class CoopFragmentNode(Node):
+    def __init__(self, nodelist, name, coop_var):
+        self.nodelist = nodelist
+        self.name = name
+        self.coop_var = Variable(coop_var)
+
+    def render(self, context):
+        coop = self.coop_var.resolve(context)
+        html = get_fragment(self.name, coop)
+        if html is None:
+            negotiations = formats.negotiations()
+            placeholders = background.placeholders_shown()
+            html = self.nodelist.render(context)
+            # Thumbnails still being generated show a placeholder, which
+            # mustn't outlive them.
+            if background.placeholders_shown() == placeholders:
+                set_fragment(self.name, coop, html,
+                             formats.negotiations() > negotiations)
+        return html
+
+
+def coopfragment(parser, token):
+    """
+    Caches the enclosed template fragment for one revision of a coop::
+
+        {% coopfragment row coop %}
+            {{ coop.name }}
+        {% endcoopfragment %}
+
+    The fragment name must be one of coops.fragments.FRAGMENTS so that
+    editing the coop invalidates it.
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise TemplateSyntaxError("%r tag requires a fragment name and a "
+                                  "coop" % bits[0])
+    if bits[1] not in FRAGMENTS:
+        raise TemplateSyntaxError("%r tag's fragment name must be one of %s"
+                                  % (bits[0], ', '.join(FRAGMENTS)))
+    nodelist = parser.parse(('endcoopfragment',))
+    parser.delete_first_token()
+    return CoopFragmentNode(nodelist, bits[1], bits[2])
+
+register.tag(coopfragment)
@@ -1,8 +1,23 @@
 from django.test import TestCase
-from coops.models import Coop, CoopUser, CoopPicture, Contactable, AnsweredQuestion
+from django.utils.html import escape
+from coops.models import Coop, CoopUser, CoopPicture, Contactable, \
+        AnsweredQuestion, Answer, CoopCategory
 
 from django.db import IntegrityError
 
+def count_queries(func, *args, **kwargs):
+    """
+    Returns how many queries calling func(*args, **kwargs) sends.
+    """
+    from coops.benchmarks import QueryCounter
+    counter = QueryCounter()
+    counter.start()
+    try:
+        func(*args, **kwargs)
+    finally:
+        counter.stop()
+    return counter.queries
+
 class CoopRevisionTest(TestCase):
     fixtures = ['test_coops.json']
 
@@ -63,3 +78,678 @@ class CoopRevisionTest(TestCase):
         fork.name = "Testy Coop fork from old rev."
         fork.save()
         self.assertEqual(fork.revision, latest.revision + 1)
+
+    def testRevisionSaveStatements(self):
+        """
+        An edit should write the new head and the archived revision without
+        reading the head back first.
+        """
+        from coops.benchmarks import QueryCounter, make_coop
+        c = make_coop("Counted Coop")
+        c.save()
+
+        counter = QueryCounter()
+        counter.start()
+        c.name = "Counted Coop Revised"
+        c.save()
+        self.assertEquals(counter.stop(), 2)
+        self.assertEquals(Coop.objects.filter(branch__id = c.id).count(), 2)
+        self.assertEquals(Coop.objects.get(pk = c.id).name, "Counted Coop Revised")
+
+class RevisionLogTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def setUp(self):
+        from django.conf import settings
+        self._storage = getattr(settings, 'REVISION_STORAGE', 'inline')
+        settings.REVISION_STORAGE = 'log'
+
+    def tearDown(self):
+        from django.conf import settings
+        settings.REVISION_STORAGE = self._storage
+
+    def testLogStorage(self):
+        """
+        In 'log' storage the model table holds only heads, and archived
+        revisions come back out of the log.
+        """
+        from coops.benchmarks import make_coop
+        c = make_coop("Logged Coop")
+        c.save()
+        c.name = "Logged Coop Revised"
+        c.save()
+        c.name = "Logged Coop Revised Again"
+        c.save()
+
+        self.assertEquals(Coop.objects.filter(branch__id = c.id).count(), 1)
+        self.assertEquals(Coop.objects.heads().get(pk = c.id).revision, 2)
+        history = c.history()
+        self.assertEquals([h.revision for h in history], [0, 1])
+        self.assertEquals([h.name for h in history],
+                ["Logged Coop", "Logged Coop Revised"])
+        self.assertEquals(history[0].branch_id, c.id)
+        self.assertEquals(history[0].pk, None)
+
+    def testSplitRevisions(self):
+        """
+        split_revisions moves inline history into the log.
+        """
+        from django.conf import settings
+        from coops.benchmarks import make_coop
+        from coops.management.commands.split_revisions import split_revisions
+        settings.REVISION_STORAGE = 'inline'
+        c = make_coop("Split Coop")
+        c.save()
+        c.name = "Split Coop Revised"
+        c.save()
+        self.assertEquals(Coop.objects.filter(branch__id = c.id).count(), 2)
+        self.assertEquals(Coop.objects.heads().filter(branch__id = c.id).count(), 1)
+
+        settings.REVISION_STORAGE = 'log'
+        self.assertEquals(split_revisions(Coop), 1)
+        self.assertEquals(Coop.objects.filter(branch__id = c.id).count(), 1)
+        self.assertEquals([h.name for h in c.history()], ["Split Coop"])
+
+    def testDeltaStorage(self):
+        """
+        'delta' storage keeps snapshots only every REVISION_SNAPSHOT_INTERVAL
+        revisions, and still rebuilds every revision.
+        """
+        import datetime, time
+        from django.conf import settings
+        from coops.benchmarks import make_coop
+        from coops.models import Revision
+        settings.REVISION_STORAGE = 'delta'
+        interval = getattr(settings, 'REVISION_SNAPSHOT_INTERVAL', 25)
+        settings.REVISION_SNAPSHOT_INTERVAL = 5
+        # The name only changes every fourth revision, so most deltas leave
+        # it out and only rebuild right from the right base.
+        def name(i):
+            return "Delta Coop %d" % (i // 4)
+        try:
+            c = make_coop(name(0))
+            c.save()
+            times = []
+            for i in range(1, 13):
+                time.sleep(0.01)
+                times.append(datetime.datetime.now())
+                time.sleep(0.01)
+                c.name = name(i)
+                c.save()
+            snapshots = Revision.objects.filter(branch = c.id, snapshot = True)
+            self.assertEquals([r.revision for r in snapshots], [0, 5, 10])
+            for i in range(13):
+                self.assertEquals(c.get_revision(i).name, name(i))
+                self.assertEquals(c.get_revision(i).revision, i)
+            self.assertEquals([h.name for h in c.history()],
+                    [name(i) for i in range(12)])
+
+            # Revisions are rebuilt from the snapshots actually stored, not
+            # from where the current interval would put them.
+            for changed in (2, 50):
+                settings.REVISION_SNAPSHOT_INTERVAL = changed
+                for i in range(13):
+                    self.assertEquals(c.get_revision(i).name, name(i))
+                for i, when in enumerate(times):
+                    revisions = [r for r in Coop.objects.as_of(when)
+                            if r.branch_id == c.id]
+                    self.assertEquals([r.name for r in revisions], [name(i)])
+        finally:
+            settings.REVISION_SNAPSHOT_INTERVAL = interval
+
+class BulkHistoryTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def makeCoops(self, count, revisions):
+        from coops.benchmarks import make_coop
+        from coops.models import CoopCategory
+        coops = []
+        for i in range(count):
+            c = make_coop("Bulk Coop %d" % i)
+            c.save()
+            c.categories.add(CoopCategory.objects.all()[0])
+            for n in range(revisions):
+                c.name = "Bulk Coop %d revision %d" % (i, n + 1)
+                c.save()
+            coops.append(c)
+        return coops
+
+    def countHistoryQueries(self, coops):
+        from coops.benchmarks import QueryCounter
+        counter = QueryCounter()
+        counter.start()
+        histories = Coop.objects.histories([c.id for c in coops])
+        for history in histories.values():
+            for revision in history:
+                revision.created_by.user_id
+                revision.category_list()
+        return counter.stop(), histories
+
+    def testHistories(self):
+        """
+        histories() returns every revision grouped by branch, in a number of
+        queries which doesn't depend on how many coops are asked for.
+        """
+        few, histories = self.countHistoryQueries(self.makeCoops(2, 2))
+        for history in histories.values():
+            self.assertEquals([r.revision for r in history], [0, 1, 2])
+            self.assertEquals(len(history[-1].category_list()), 1)
+        many, histories = self.countHistoryQueries(self.makeCoops(6, 3))
+        self.assertEquals(few, many)
+        self.assertEquals(len(histories), 6)
+
+    def testPrefetchFallback(self):
+        """
+        Objects the prefetch queryset leaves out are still filled in, with
+        one more query rather than one per instance.
+        """
+        from coops.benchmarks import QueryCounter
+        from coops.prefetch import prefetch_foreign_key
+        ids = [c.id for c in self.makeCoops(3, 0)]
+        coops = list(Coop.objects.filter(pk__in = ids))
+        counter = QueryCounter()
+        counter.start()
+        prefetch_foreign_key(coops, 'created_by',
+                CoopUser.objects.filter(user__username = 'nobody'))
+        for c in coops:
+            c.created_by
+        self.assertEquals(counter.stop(), 2)
+
+class AsOfTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def checkAsOf(self):
+        import datetime, time
+        from coops.benchmarks import make_coop
+        early = make_coop("Early Coop")
+        early.save()
+        time.sleep(0.01)
+        before = datetime.datetime.now()
+        time.sleep(0.01)
+        late = make_coop("Late Coop")
+        late.save()
+        early.name = "Early Coop Revised"
+        early.save()
+        time.sleep(0.01)
+        after = datetime.datetime.now()
+
+        names = [c.name for c in Coop.objects.as_of(before)]
+        self.assertEquals(names, ["Early Coop"])
+        names = [c.name for c in Coop.objects.as_of(after)]
+        names.sort()
+        self.assertEquals(names, ["Early Coop Revised", "Late Coop"])
+
+    def testAsOf(self):
+        """
+        as_of() returns the revision of each branch current at a time.
+        """
+        self.checkAsOf()
+
+    def testAsOfDelta(self):
+        """
+        as_of() gives the same answers from the revision log.
+        """
+        from django.conf import settings
+        storage = getattr(settings, 'REVISION_STORAGE', 'inline')
+        settings.REVISION_STORAGE = 'delta'
+        try:
+            self.checkAsOf()
+        finally:
+            settings.REVISION_STORAGE = storage
+
+class SearchTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def testSearch(self):
+        """
+        The search index follows new revisions and ranks name matches above
+        category matches.
+        """
+        from coops.benchmarks import make_coop
+        from coops.models import CoopCategory
+        from coops.search import search, index_coop
+        named = make_coop("Housing Collective")
+        named.save()
+        tagged = make_coop("Elm Street")
+        tagged.save()
+        tagged.categories.add(CoopCategory.objects.get(category = "Housing Coop"))
+        index_coop(tagged)
+
+        self.assertEquals(list(search("housing")), [named.id, tagged.id])
+        self.assertEquals(list(search("housing elm")), [tagged.id])
+        self.assertEquals(list(search("the")), [])
+
+        named.name = "Oak Collective"
+        named.save()
+        self.assertEquals(list(search("housing")), [tagged.id])
+        self.assertEquals(list(search("oak")), [named.id])
+
+    def testSearchPages(self):
+        """
+        Matches are counted and read a page at a time in SQL, within a
+        facet filter if there is one.
+        """
+        from coops.benchmarks import make_coop, QueryCounter
+        from coops.models import CoopCategory, reindex_pending
+        from coops.search import search
+        from coops.facets import filter_coops, facet_counts
+        category = CoopCategory.objects.all()[0]
+        coops = []
+        for i in range(12):
+            c = make_coop("Paged Coop %d" % i)
+            c.save()
+            if i % 2:
+                c.categories.add(category)
+            coops.append(c)
+        reindex_pending()
+
+        ids = [c.id for c in coops]
+        matches = search("paged")
+        self.assertEquals(matches.count(), 12)
+        counter = QueryCounter()
+        counter.start()
+        page = matches[10:20]
+        self.assertEquals(counter.stop(), 1)
+        self.assertEquals(page, ids[10:])
+        self.assertEquals(matches[3], ids[3])
+
+        facet = 'category:%s' % category.pk
+        within = search("paged", within = filter_coops([facet]))
+        self.assertEquals(list(within), ids[1::2])
+        self.assertEquals(facet_counts(within)[facet], 6)
+
+        response = self.client.get('/coops/', {'q': 'paged', 'p': 2})
+        self.assertEquals([c.id for c in response.context[0]['page'
+                ].object_list], ids[10:])
+
+    def testDeferredReindex(self):
+        """
+        Saving only marks a coop as stale; it is reindexed once, when the
+        next request starts or finishes or the index is read.
+        """
+        from coops.benchmarks import make_coop
+        from coops.models import SearchTerm
+        c = make_coop("Deferred Coop")
+        c.save()
+        c.name = "Deferred Coop Renamed"
+        c.save()
+        self.assertEquals(SearchTerm.objects.filter(coop = c.id).count(), 0)
+        self.client.get('/coops/')
+        self.assertEquals(
+                SearchTerm.objects.filter(coop = c.id, term = "renamed").count(), 1)
+
+    def testSearchView(self):
+        """
+        coop_list pages through search results and carries the query along.
+        """
+        from coops.benchmarks import make_coop
+        for i in range(12):
+            make_coop("Searchable Coop %d" % i).save()
+        # The list template extends and includes others, so there is one
+        # context per template; the first is the view's.
+        response = self.client.get('/coops/', {'q': 'searchable'})
+        context = response.context[0]
+        self.assertEquals(len(context['page'].object_list), 10)
+        self.assertEquals(context['querystring'], 'q=searchable')
+        response = self.client.get('/coops/', {'q': 'searchable', 'p': 2})
+        self.assertEquals(len(response.context[0]['page'].object_list), 2)
+
+class FacetTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def testFacetCounts(self):
+        """
+        Facet counts follow category and answer changes, and filtering by
+        facets finds the coops with all of them.
+        """
+        from coops.benchmarks import make_coop
+        from coops.models import CoopCategory, Question, Answer, reindex_coop
+        from coops.facets import facet_counts, filter_coops
+        category = CoopCategory.objects.all()[0]
+        question = Question.objects.get(pk = 1)
+        answer = Answer.objects.get(pk = 2)
+
+        coops = []
+        for i in range(3):
+            c = make_coop("Faceted Coop %d" % i)
+            c.save()
+            c.categories.add(category)
+            reindex_coop(c)
+            coops.append(c)
+        aq = AnsweredQuestion(question = question, order = 1, coop = coops[0],
+                created_by = coops[0].created_by)
+        aq.save()
+        aq.answers.add(answer)
+        reindex_coop(coops[0])
+
+        category_facet = 'category:%s' % category.pk
+        answer_facet = 'answer:%s:%s' % (question.pk, answer.pk)
+        counts = facet_counts()
+        self.assertEquals(counts[category_facet], 3)
+        self.assertEquals(counts[answer_facet], 1)
+        self.assertEquals(list(filter_coops([category_facet, answer_facet])),
+                [coops[0].id])
+        self.assertEquals(facet_counts([coops[1].id])[category_facet], 1)
+
+        coops[1].categories.remove(category)
+        reindex_coop(coops[1])
+        self.assertEquals(facet_counts()[category_facet], 2)
+        coops[2].delete()
+        self.assertEquals(facet_counts()[category_facet], 1)
+
+        response = self.client.get('/coops/', {'answer': '%s:%s' % (
+                question.pk, answer.pk)})
+        context = response.context[0]
+        self.assertEquals([c.id for c in context['page'].object_list],
+                [coops[0].id])
+        self.assertEquals(context['querystring'], 'answer=%s%%3A%s' % (
+                question.pk, answer.pk))
+
+        # A selected value is still listed when nothing matches, so that
+        # it can be toggled off.
+        response = self.client.get('/coops/', {'q': 'nothing',
+                'category': category.pk})
+        context = response.context[0]
+        self.assertEquals(list(context['page'].object_list), [])
+        values = [v for group in context['facets'] for v in group['values']]
+        self.assertEquals([(v['label'], v['count'], v['selected'],
+                v['querystring']) for v in values],
+                [(category.category, 0, True, 'q=nothing')])
+
+    def testConcurrentCountInsert(self):
+        """
+        A facet count row inserted by someone else between our update and
+        our insert is updated instead.
+        """
+        from django.db import connection
+        from coops.models import FacetCount
+        from coops.facets import _adjust_counts
+
+        class RacingCursor(object):
+            # Misses the row on the first update, as if it didn't exist yet.
+            def __init__(self, cursor):
+                self.cursor = cursor
+                self.raced = False
+            def execute(self, sql, params):
+                if sql.startswith("UPDATE") and not self.raced:
+                    self.raced = True
+                    self.rowcount = 0
+                    return
+                self.cursor.execute(sql, params)
+                self.rowcount = self.cursor.rowcount
+
+        FacetCount(facet = 'category:99', count = 4).save()
+        _adjust_counts(RacingCursor(connection.cursor()), ['category:99'], 1)
+        self.assertEquals(FacetCount.objects.get(facet = 'category:99').count, 5)
+
+class CursorPaginatorTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def testPaging(self):
+        """
+        Walk forwards and backwards through the coops, one query per page.
+        """
+        from coops.benchmarks import make_coop, QueryCounter
+        from coops.paginator import CursorPaginator
+        from django.core.paginator import InvalidPage
+        coops = []
+        for i in range(25):
+            c = make_coop("Paged Coop %d" % i)
+            c.save()
+            coops.append(c)
+        coops.reverse()
+        paginator = CursorPaginator(Coop.objects.heads(), 10)
+
+        counter = QueryCounter()
+        counter.start()
+        first = paginator.page()
+        self.assertEquals(counter.stop(), 1)
+        self.assertEquals(first.object_list, coops[:10])
+        self.failIf(first.has_previous())
+        second = paginator.page(first.next_page_number())
+        self.assertEquals(second.object_list, coops[10:20])
+        third = paginator.page(second.next_page_number())
+        self.assertEquals(third.object_list, coops[20:])
+        self.failIf(third.has_next())
+        back = paginator.page(third.previous_page_number())
+        self.assertEquals(back.object_list, coops[10:20])
+        back = paginator.page(back.previous_page_number())
+        self.assertEquals(back.object_list, coops[:10])
+        self.failIf(back.has_previous())
+
+        self.assertRaises(InvalidPage, paginator.page, "not a cursor")
+
+    def testStalePageLink(self):
+        """
+        A page number the list can't use sends the visitor to its first page.
+        """
+        response = self.client.get('/coops/', {'p': '2'})
+        self.assertRedirects(response, '/coops/')
+        response = self.client.get('/coops/', {'q': 'nothing', 'p': '7'})
+        self.assertRedirects(response, '/coops/?q=nothing')
+
+class CoopListQueriesTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def addCoops(self, count):
+        from coops.benchmarks import make_coop
+        from coops.models import CoopCategory, Question, Answer, \
+                PhoneNumber, PhoneNumberLabel
+        # The coops are marked stale in the module the signals came from.
+        from coopdirectory.coops.models import reindex_pending
+        contactable = Contactable.objects.all()[0]
+        if not contactable.phonenumber_set.count():
+            PhoneNumber(contactable = contactable, phone_number = "555-0100",
+                    label = PhoneNumberLabel.objects.all()[0]).save()
+        for i in range(count):
+            c = make_coop("Listed Coop %d" % i)
+            c.save()
+            c.categories.add(CoopCategory.objects.all()[0])
+            aq = AnsweredQuestion(question = Question.objects.get(pk = 1),
+                    order = 1, coop = c, created_by = c.created_by)
+            aq.save()
+            aq.answers.add(Answer.objects.get(pk = 1))
+        # Index them now rather than in the first request counted.
+        reindex_pending()
+
+    def assertConstantQueries(self, path, data=None):
+        """
+        Asserts that rendering ``path`` takes as many queries with a full
+        page of coops as with a couple of them.
+        """
+        self.addCoops(2)
+        few = count_queries(self.client.get, path, data or {})
+        self.addCoops(10)
+        many = count_queries(self.client.get, path, data or {})
+        self.assertEquals(few, many)
+
+    def testCoopListQueries(self):
+        """
+        coop_list runs a fixed number of queries however many rows it shows.
+        """
+        self.assertConstantQueries('/coops/')
+
+    def testCoopSearchQueries(self):
+        self.assertConstantQueries('/coops/', {'q': 'listed'})
+
+class FragmentCacheTest(TestCase):
+    fixtures = ['test_coops.json']
+
+    def setUp(self):
+        # Coop ids are reused from test to test, so fragments cached by
+        # earlier tests would be found under the same keys.
+        from django.core.cache import get_cache
+        from coopdirectory.coops import fragments
+        self._cache = fragments.cache
+        fragments.cache = get_cache('locmem://')
+
+    def tearDown(self):
+        from coopdirectory.coops import fragments
+        fragments.cache = self._cache
+
+    def testDetailFragment(self):
+        """
+        A coop's detail page is rendered once per revision.
+        """
+        from coopdirectory.coops import fragments
+        from coops.benchmarks import make_coop
+        c = make_coop("Cached Coop")
+        c.save()
+        path = '/coops/%d' % c.branch_id
+        fragments.reset_stats()
+        self.assertContains(self.client.get(path), "Cached Coop")
+        self.assertContains(self.client.get(path), "Cached Coop")
+        self.assertEquals(fragments.stats(), {'hits': 1, 'misses': 1})
+
+        # A new revision is a new fragment.
+        c.name = "Recached Coop"
+        c.save()
+        self.assertContains(self.client.get(path), "Recached Coop")
+        self.assertEquals(fragments.stats(), {'hits': 1, 'misses': 2})
+
+    def testFragmentPerAcceptedFormat(self):
+        """
+        Pages with pictures in negotiated formats are cached per set of
+        formats the browser accepts.
+        """
+        from coopdirectory.coops import fragments
+        from coops.benchmarks import make_coop
+        c = make_coop("Negotiated Coop")
+        c.save()
+        path = '/coops/%d' % c.branch_id
+        fragments.reset_stats()
+        self.client.get(path)
+        response = self.client.get(path, HTTP_ACCEPT='image/png,*/*')
+        self.assertEquals(fragments.stats(), {'hits': 0, 'misses': 2})
+        self.assertTrue('Accept' in response['Vary'])
+        self.client.get(path)
+        response = self.client.get(path, HTTP_ACCEPT='image/png,*/*')
+        self.assertEquals(fragments.stats(), {'hits': 2, 'misses': 2})
+        self.assertTrue('Accept' in response['Vary'])
+
+    def testFragmentWithoutNegotiation(self):
+        """
+        A fragment whose rendering didn't depend on the Accept header is
+        cached once for every browser and doesn't make the response vary.
+        """
+        from django.template import Template, Context
+        from sorl.thumbnail import formats
+        from coopdirectory.coops import fragments
+        from coops.benchmarks import make_coop
+        c = make_coop("Plain Coop")
+        c.save()
+        template = Template("{% load coop_fragments %}"
+                "{% coopfragment row coop %}{{ coop.name }}{% endcoopfragment %}")
+        fragments.reset_stats()
+        try:
+            for accept in ('', 'image/png,*/*'):
+                formats.set_accept(accept)
+                self.assertEquals(template.render(Context({'coop': c})),
+                        "Plain Coop")
+                self.failIf(formats.varies())
+        finally:
+            formats.set_accept(None)
+        self.assertEquals(fragments.stats(), {'hits': 1, 'misses': 1})
+
+    def testPlaceholderNotCached(self):
+        """
+        A fragment showing the placeholder of a thumbnail still being
+        generated isn't cached.
+        """
+        from django.template import Template, Context
+        from sorl.thumbnail.background import placeholder_shown
+        from coopdirectory.coops import fragments
+        from coops.benchmarks import make_coop
+        c = make_coop("Pending Coop")
+        c.save()
+        class PendingPicture(object):
+            def __unicode__(self):
+                placeholder_shown()
+                return u"/placeholder.gif"
+        template = Template("{% load coop_fragments %}"
+                "{% coopfragment row coop %}{{ picture }}{% endcoopfragment %}")
+        fragments.reset_stats()
+        for i in range(2):
+            self.assertEquals(template.render(Context({'coop': c,
+                    'picture': PendingPicture()})), "/placeholder.gif")
+        self.assertEquals(fragments.stats(), {'hits': 0, 'misses': 2})
+
+    def testRowFragmentInvalidation(self):
+        """
+        Changing an answered question drops the coop's cached list row.
+        """
+        from coopdirectory.coops import fragments
+        from coops.benchmarks import make_coop
+        from coops.models import Question, Answer
+        c = make_coop("Rowed Coop")
+        c.save()
+        self.client.get('/coops/', {'q': 'rowed'})
+        fragments.reset_stats()
+        self.client.get('/coops/', {'q': 'rowed'})
+        self.assertEquals(fragments.stats(), {'hits': 1, 'misses': 0})
+
+        aq = AnsweredQuestion(question = Question.objects.get(pk = 1),
+                order = 1, coop = c, created_by = c.created_by)
+        aq.save()
+        aq.answers.add(Answer.objects.get(pk = 1))
+        response = self.client.get('/coops/', {'q': 'rowed'})
+        self.assertEquals(fragments.stats(), {'hits': 1, 'misses': 1})
+        self.assertContains(response, escape(Answer.objects.get(pk = 1)))
+
+    def cachedRow(self, name):
+        """
+        Saves a coop answering question 1 with answer 1, in category 1, and
+        caches its list row.
+        """
+        from coops.benchmarks import make_coop
+        from coops.models import Question
+        c = make_coop(name)
+        c.save()
+        aq = AnsweredQuestion(question = Question.objects.get(pk = 1),
+                order = 1, coop = c, created_by = c.created_by)
+        aq.save()
+        aq.answers.add(Answer.objects.get(pk = 1))
+        c.categories.add(CoopCategory.objects.get(pk = 1))
+        self.client.get('/coops/', {'q': name})
+        return c, aq
+
+    def assertRowRerendered(self, name):
+        """
+        Asserts that the list row of the coop ``name`` is no longer cached,
+        and returns the page.
+        """
+        from coopdirectory.coops import fragments
+        fragments.reset_stats()
+        response = self.client.get('/coops/', {'q': name})
+        self.assertEquals(fragments.stats(), {'hits': 0, 'misses': 1})
+        return response
+
+    def testAnsweredQuestionDeleteInvalidation(self):
+        c, aq = self.cachedRow("Unanswering Coop")
+        aq.delete()
+        self.assertNotContains(self.assertRowRerendered("Unanswering Coop"),
+                escape(aq.question.prompt))
+
+    def testAnswerEditInvalidation(self):
+        c, aq = self.cachedRow("Reanswered Coop")
+        answer = Answer.objects.get(pk = 1)
+        answer.answer = "Fewer than five"
+        answer.save()
+        self.assertContains(self.assertRowRerendered("Reanswered Coop"),
+                "Fewer than five")
+
+    def testQuestionEditInvalidation(self):
+        c, aq = self.cachedRow("Reasked Coop")
+        prompt = aq.question.prompt
+        prompt.prompt = "How many people live with you?"
+        prompt.save()
+        self.assertContains(self.assertRowRerendered("Reasked Coop"),
+                "How many people live with you?")
+
+    def testCategoryEditInvalidation(self):
+        c, aq = self.cachedRow("Recategorized Coop")
+        category = CoopCategory.objects.get(pk = 1)
+        category.category = "Housing Cooperative"
+        category.save()
+        self.assertContains(self.assertRowRerendered("Recategorized Coop"),
+                "Housing Cooperative")
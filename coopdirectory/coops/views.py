@@ -1,19 +1,79 @@
-from django.core.paginator import Paginator
+import urllib
+
+from django.conf import settings
+from django.core.paginator import Paginator, InvalidPage
+from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from coopdirectory.coops.models import Coop
+from coopdirectory.coops.paginator import CursorPaginator
+from coopdirectory.coops.prefetch import in_bulk
+from coopdirectory.coops.search import search
+from coopdirectory.coops.facets import selected_facets, filter_coops, \
+        facet_counts, facet_groups
+from coopdirectory.coops.fragments import get_fragments
 
 def coop_detail(request, id):
     coop = get_object_or_404(Coop, pk = id)
     return render_to_response('coops/detail.html', {'coop': coop})
 
+def _querystring(query, facets):
+    params = []
+    if query:
+        params.append(('q', query.encode('utf-8')))
+    for facet in facets:
+        kind, value = facet.split(':', 1)
+        params.append((kind, value))
+    return urllib.urlencode(params)
+
 def coop_list(request):
-    # TODO: parse GET search parameters
-    coops = Coop.objects.all()
-    paginator = Paginator(coops, 10)
-    page = paginator.page(request.GET.get('p', 1))
+    query = request.GET.get('q', '').strip()
+    selected = selected_facets(request.GET)
+
+    # Ids of the matching coops (read a page at a time), or None for every
+    # coop.
+    ids = None
+    if selected:
+        ids = filter_coops(selected)
+    if query:
+        ids = search(query, within = ids)
+
+    # A page number or cursor from another kind of pagination (e.g. an old
+    # ?p=2 link) doesn't address any page; start again from the first.
+    try:
+        if ids is not None:
+            paginator = Paginator(ids, 10)
+            page = paginator.page(request.GET.get('p', 1))
+            # Only fetch the coops on this page, keeping the ranking.
+            coops = in_bulk(Coop.objects.for_list(), page.object_list)
+            page.object_list = [coops[id] for id in page.object_list
+                    if id in coops]
+        elif getattr(settings, 'COOP_LIST_PAGINATION', 'cursor') == 'cursor':
+            # Everything, newest first, without counting or OFFSET.
+            paginator = CursorPaginator(Coop.objects.for_list(), 10)
+            page = paginator.page(request.GET.get('p'))
+        else:
+            paginator = Paginator(Coop.objects.for_list().order_by('-pk'), 10)
+            page = paginator.page(request.GET.get('p', 1))
+    except InvalidPage:
+        querystring = _querystring(query, selected)
+        return HttpResponseRedirect(request.path +
+                (querystring and '?' + querystring))
+    # Rows already rendered for their current revision don't need their
+    # related objects.
+    page.object_list = list(page.object_list)
+    Coop.objects.prefetch_for_list(get_fragments('row', page.object_list))
+
+    first_item_number = None
+    if not getattr(paginator, 'uses_cursors', False):
+        first_item_number = paginator.per_page * (page.number - 1) + 1
+
+    facets = facet_groups(facet_counts(ids), selected,
+            lambda facets: _querystring(query, facets))
     return render_to_response('coops/list.html', {
             'page': page, 
-            'querystring': '', 
-            'first_item_number': paginator.per_page * (page.number - 1) + 1
+            'query': query,
+            'facets': facets,
+            'querystring': _querystring(query, selected), 
+            'first_item_number': first_item_number
     })
 
@@ -66,6 +66,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.middleware.doc.XViewMiddleware',
+    'sorl.thumbnail.middleware.ThumbnailFormatMiddleware',
 )
 
 ROOT_URLCONF = 'coopdirectory.urls'
@@ -84,7 +85,36 @@ INSTALLED_APPS = (
     'django.contrib.sites',
     'django.contrib.admin',
     'coopdirectory.coops',
+    'sorl.thumbnail',
 )
 
+# Where archived revisions of versioned models are kept: 'inline' (in the
+# model's own table), 'log' (in the append-only coops.Revision table) or
+# 'delta' (in the log, as field-level deltas with periodic full snapshots).
+REVISION_STORAGE = 'inline'
+REVISION_SNAPSHOT_INTERVAL = 25
+
+# How coop_list pages through all coops: 'cursor' (previous/next links,
+# fast at any depth) or 'numbered' (links to every page; counts all coops).
+COOP_LIST_PAGINATION = 'cursor'
+
+# Rendered coop detail pages and list rows are cached per revision in the
+# CACHE_BACKEND for this many seconds.
+COOP_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Record generated thumbnails against their sources, so that they are found
+# (and orphans cleaned up) without listing the upload directories.
+THUMBNAIL_MANIFEST = True
+
+# Coop pictures are only replaced by uploading them, which drops the cached
+# metadata of their thumbnails, so it can be trusted instead of checking the
+# files on every render.
+THUMBNAIL_METADATA_CACHE = True
+
+# Thumbnails are generated by the thumbnail view (see urls.py) when they are
+# first requested, rather than while pages are rendered, and served with long
+# cache lifetimes.
+THUMBNAIL_VIEW_URL = '/thumbnails/'
+
 PBLOGS_ROOT = '/blogs/'
 PBLOGS_MEDIA_ROOT = '/dev_media/blogs/'
@@ -0,0 +1,209 @@
+"""
+Thumbnails on Google App Engine, which has no writable filesystem.
+
+DatastoreStorage keeps sources and thumbnails in the datastore, as one
+StoredFile entity per file (so each must stay under the datastore's 1MB
+entity limit).  To use it, set::
+
+    THUMBNAIL_STORAGE = 'sorl.thumbnail.datastore.DatastoreStorage'
+    THUMBNAIL_STORAGE_URL = '/thumbnails/'
+
+and route THUMBNAIL_STORAGE_URL to ``serve``::
+
+    (r'^thumbnails/(?P<name>.*)$', 'sorl.thumbnail.datastore.serve'),
+
+ImageWithThumbnailsProperty is the datastore model counterpart of
+sorl.thumbnail.fields.ImageWithThumbnailsField.
+"""
+
+import mimetypes
+import posixpath
+import time
+from cStringIO import StringIO
+
+from google.appengine.ext import db
+
+from django.http import HttpResponse, Http404
+from django.utils.http import http_date
+
+from sorl.thumbnail.fields import ThumbnailsMixin, TAG_HTML, \
+     expand_formats, _verify_thumbnail_attrs
+from sorl.thumbnail.metadata import delete_metadata
+from sorl.thumbnail.spec import get_storage
+from sorl.thumbnail.storage import Storage
+
+
+class StoredFile(db.Model):
+    data = db.BlobProperty(required=True)
+    modified = db.FloatProperty(required=True)
+
+
+def _key_name(name):
+    # Key names may not start with a digit.
+    return 'f:%s' % name
+
+
+def _key(name):
+    return db.Key.from_path('StoredFile', _key_name(name))
+
+
+class DatastoreStorage(Storage):
+    def mtimes(self, names):
+        # One round trip for all of them.
+        entities = db.get([_key(name) for name in names])
+        mtimes = {}
+        for name, entity in zip(names, entities):
+            if entity is None:
+                mtimes[name] = None
+            else:
+                mtimes[name] = entity.modified
+        return mtimes
+
+    def _get(self, name):
+        entity = db.get(_key(name))
+        if entity is None:
+            raise IOError("No such file: '%s'" % name)
+        return entity
+
+    def size(self, name):
+        return len(self._get(name).data)
+
+    def open(self, name):
+        return StringIO(self._get(name).data)
+
+    def save(self, name, data):
+        StoredFile(key_name=_key_name(name), data=db.Blob(data),
+                   modified=time.time()).put()
+
+    def delete(self, name):
+        db.delete(_key(name))
+
+
+def serve(request, name):
+    """
+    Serves a file from the datastore.
+    """
+    entity = db.get(_key(name))
+    if entity is None:
+        raise Http404('No such file: %s' % name)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    response = HttpResponse(entity.data, mimetype=mimetype)
+    response['Last-Modified'] = http_date(entity.modified)
+    response['Content-Length'] = str(len(entity.data))
+    return response
+
+
+class DatastoreImage(ThumbnailsMixin):
+    """
+    The value of an ImageWithThumbnailsProperty: the name of an image in the
+    storage, with its thumbnails.
+    """
+    def __init__(self, instance, field, name):
+        self.instance = instance
+        self.field = field
+        self.name = name
+
+    def __nonzero__(self):
+        return bool(self.name)
+
+    def __unicode__(self):
+        return self.name or u''
+
+    def _relative_source(self):
+        return self.name
+
+    def delete_thumbnails(self):
+        """
+        Deletes the thumbnail and all extra thumbnails.  Returns the number
+        deleted.
+        """
+        all_args = [self.field.thumbnail]
+        all_args.extend((self.field.extra_thumbnails or {}).values())
+        dests = [self._build_thumbnail(args, generate=False).dest
+                 for args in expand_formats(all_args)]
+        storage = get_storage()
+        deleted = 0
+        for dest, mtime in storage.mtimes(dests).items():
+            if mtime is not None:
+                storage.delete(dest)
+                deleted += 1
+            delete_metadata(dest)
+        return deleted
+
+    def save(self, name, content, save=True):
+        """
+        Stores ``content`` (a string or a file-like object) as an image named
+        ``name`` in the field's ``upload_to`` directory, and makes it this
+        property's image.
+        """
+        storage = get_storage()
+        name = posixpath.join(time.strftime(self.field.upload_to), name)
+        root, ext = posixpath.splitext(name)
+        while storage.exists(name):
+            root += '_'
+            name = root + ext
+        if hasattr(content, 'read'):
+            content = content.read()
+        if self.name:
+            self.delete_thumbnails()
+        storage.save(name, content)
+        self.name = name
+        setattr(self.instance, self.field.name, name)
+        if save:
+            self.instance.put()
+        if self.field.generate_on_save:
+            self.generate_thumbnails()
+
+    def delete(self, save=True):
+        if self.name:
+            self.delete_thumbnails()
+            get_storage().delete(self.name)
+        self.name = None
+        setattr(self.instance, self.field.name, None)
+        if save:
+            self.instance.put()
+
+
+class ImageWithThumbnailsProperty(db.StringProperty):
+    """
+    picture = ImageWithThumbnailsProperty(
+        upload_to='uploads/%Y/%m/',
+        thumbnail={'size': (100, 100)},
+        extra_thumbnails={
+            'large': {'size': (400, 400)},
+        }
+    )
+
+    Stores the image's name; the image itself is in the THUMBNAIL_STORAGE
+    (a DatastoreStorage), saved with ``instance.picture.save(name, content)``.
+    """
+    def __init__(self, thumbnail, extra_thumbnails=None,
+                 thumbnail_tag=TAG_HTML, upload_to='', generate_on_save=True,
+                 **kwargs):
+        super(ImageWithThumbnailsProperty, self).__init__(**kwargs)
+        _verify_thumbnail_attrs(thumbnail)
+        if extra_thumbnails:
+            for extra, attrs in extra_thumbnails.items():
+                name = "%r of 'extra_thumbnails'"
+                _verify_thumbnail_attrs(attrs, name)
+        self.thumbnail = thumbnail
+        self.extra_thumbnails = extra_thumbnails
+        self.thumbnail_tag = thumbnail_tag
+        self.upload_to = upload_to
+        self.generate_on_save = generate_on_save
+
+    def __get__(self, model_instance, model_class):
+        if model_instance is None:
+            return self
+        name = super(ImageWithThumbnailsProperty, self).__get__(
+            model_instance, model_class)
+        return DatastoreImage(model_instance, self, name)
+
+    def __set__(self, model_instance, value):
+        if isinstance(value, DatastoreImage):
+            value = value.name
+        super(ImageWithThumbnailsProperty, self).__set__(model_instance,
+                                                         value)
+
+    def get_value_for_datastore(self, model_instance):
+        return getattr(model_instance, self._attr_name())
@@ -3,8 +3,27 @@ BASEDIR = ''
 SUBDIR = ''
 PREFIX = ''
 QUALITY = 85
+FORMAT = 'jpeg'
 CONVERT = '/usr/bin/convert'
 WVPS = '/usr/bin/wvPS'
+CONVERT_WORKERS = 2
+CONVERT_TIMEOUT = 30
+CONVERT_CACHE_SIZE = 20
+METADATA_CACHE = False
+METADATA_CACHE_SIZE = 1000
+METADATA_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+BACKGROUND = False
+BACKGROUND_WORKERS = 2
+PLACEHOLDER_URL = None
+MANIFEST = False
+CONTENT_ADDRESSED = False
+CONTENT_DIR = 'thumbnails'
+STORAGE = 'sorl.thumbnail.storage.LocalStorage'
+STORAGE_URL = None
+VIEW_URL = None
+VIEW_MAX_AGE = 60 * 60 * 24 * 365
+AUTOCROP_BACKGROUND = (255, 255, 255)
+AUTOCROP_TOLERANCE = 127
 PROCESSORS = (
     'sorl.thumbnail.processors.colorspace',
     'sorl.thumbnail.processors.autocrop',
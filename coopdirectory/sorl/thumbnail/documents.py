@@ -0,0 +1,161 @@
+"""
+Rasterizing the first page of documents (PDFs with ImageMagick's convert,
+Word documents with wvPS and then convert) to make thumbnails of.
+
+Conversions go through a Rasterizer, which runs at most ``workers`` of
+them at once (a page of PDF flyers queues for a few converter processes
+rather than starting one per flyer together), kills any which run for
+longer than ``timeout`` seconds and reads the rasterized page from
+convert's output pipe rather than from a temporary file.  Rasterized first
+pages are kept, as PNG data, in an LRU cache keyed by the source's path,
+modification time and type, at the largest size asked for so far.  Smaller
+sizes are scaled down from it, so that each size of thumbnail of a document
+doesn't start a conversion of its own.
+"""
+
+import os
+import signal
+import threading
+from os.path import getmtime
+from subprocess import Popen, PIPE
+from tempfile import mkstemp
+from cStringIO import StringIO
+
+from PIL import Image
+
+from sorl.thumbnail import defaults
+from sorl.thumbnail.utils import LRUCache
+
+
+class ConversionError(Exception):
+    pass
+
+
+class Rasterizer(object):
+    def __init__(self, workers=defaults.CONVERT_WORKERS,
+                 timeout=defaults.CONVERT_TIMEOUT,
+                 cache_size=defaults.CONVERT_CACHE_SIZE):
+        self.timeout = timeout
+        self.slots = threading.Semaphore(workers)
+        self.pages = LRUCache(cache_size)
+        self.lock = threading.Lock()
+
+    def run(self, args, input=None):
+        """
+        Runs a command once a worker slot is free, feeding it ``input`` and
+        returning its output.  Raises ConversionError if it can't be run,
+        fails or times out.
+        """
+        name = os.path.basename(args[0])
+        self.slots.acquire()
+        try:
+            try:
+                p = Popen(args, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            except OSError, detail:
+                raise ConversionError('%s error: %s' % (name, detail))
+            timed_out = []
+            def kill():
+                timed_out.append(True)
+                try:
+                    os.kill(p.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            timer = threading.Timer(self.timeout, kill)
+            timer.start()
+            try:
+                output, errors = p.communicate(input)
+            finally:
+                timer.cancel()
+        finally:
+            self.slots.release()
+        if timed_out:
+            raise ConversionError('%s error: timed out after %s seconds' %
+                                  (name, self.timeout))
+        if p.returncode:
+            raise ConversionError('%s error: %s' % (name, errors.strip() or
+                                  'exit status %s' % p.returncode))
+        return output
+
+    def _get_page(self, key):
+        self.lock.acquire()
+        try:
+            return self.pages.get(key)
+        finally:
+            self.lock.release()
+
+    def _set_page(self, key, data):
+        self.lock.acquire()
+        try:
+            self.pages.set(key, data)
+        finally:
+            self.lock.release()
+
+    def rasterize(self, source, filetype, size,
+                  convert_path=defaults.CONVERT, wvps_path=defaults.WVPS):
+        """
+        Returns the first page of the document ``source`` (a 'pdf' or 'doc'
+        ``filetype``) as an image of about ``size``.
+        """
+        size = tuple(size)
+        key = (source, getmtime(source), filetype)
+        page = self._get_page(key)
+        if page is not None and page[0][0] >= size[0] and \
+           page[0][1] >= size[1]:
+            page_size, data = page
+        else:
+            page_size = size
+            if page is not None:
+                # Big enough for the sizes already asked for too.
+                page_size = (max(size[0], page[0][0]),
+                             max(size[1], page[0][1]))
+            if filetype == 'doc':
+                # wvPS can only write to a file.
+                ps = mkstemp('.ps')[1]
+                try:
+                    self.run((wvps_path, source, ps))
+                    data = self._convert(ps, page_size, convert_path)
+                finally:
+                    os.remove(ps)
+            else:
+                data = self._convert(source, page_size, convert_path)
+            self._set_page(key, (page_size, data))
+        try:
+            image = Image.open(StringIO(data))
+            if page_size != size:
+                image.thumbnail(size, Image.ANTIALIAS)
+        except IOError, detail:
+            raise ConversionError('ImageMagick error: %s' % detail)
+        return image
+
+    def _convert(self, filename, size, convert_path):
+        return self.run((convert_path, '-size', '%sx%s' % tuple(size),
+            '-antialias', '-colorspace', 'rgb', '-format', 'PNG24',
+            '%s[0]' % filename, 'png:-'))
+
+
+_rasterizer = None
+_rasterizer_lock = threading.Lock()
+
+def get_rasterizer():
+    """
+    Returns the process's Rasterizer, configured by the THUMBNAIL_CONVERT_*
+    settings where Django is available.
+    """
+    global _rasterizer
+    _rasterizer_lock.acquire()
+    try:
+        if _rasterizer is None:
+            try:
+                from sorl.thumbnail.main import get_thumbnail_setting
+                kwargs = {
+                    'workers': get_thumbnail_setting('CONVERT_WORKERS'),
+                    'timeout': get_thumbnail_setting('CONVERT_TIMEOUT'),
+                    'cache_size': get_thumbnail_setting('CONVERT_CACHE_SIZE'),
+                }
+            except (ImportError, EnvironmentError):
+                # No Django, or no settings.
+                kwargs = {}
+            _rasterizer = Rasterizer(**kwargs)
+        return _rasterizer
+    finally:
+        _rasterizer_lock.release()
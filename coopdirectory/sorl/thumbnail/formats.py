@@ -0,0 +1,148 @@
+"""
+Thumbnail output formats.
+
+A thumbnail is written in one of OUTPUT_FORMATS, by name.  Where a single
+name is given (THUMBNAIL_FORMAT, or the ``format`` of a tag or field), that
+format is always used.  A sequence of names is a preference list: the first
+format which the Accept header of the request being handled explicitly
+lists (and which PIL can write) is used, the last one otherwise.  For that,
+sorl.thumbnail.middleware.ThumbnailFormatMiddleware keeps the Accept header
+here while a request is handled, and adds ``Vary: Accept`` to responses
+whose thumbnails were chosen by it.
+
+``pjpeg`` is progressive JPEG.  It is named like baseline JPEG, so switching
+between the two needs the thumbnails deleted to take effect.
+"""
+
+import mimetypes
+import threading
+
+from PIL import Image
+
+# name: (PIL format, file extension, mime type, keyword arguments to save)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', {'optimize': 1}),
+    'pjpeg': ('JPEG', 'jpg', 'image/jpeg', {'optimize': 1,
+                                            'progressive': 1}),
+    'png': ('PNG', 'png', 'image/png', {'optimize': 1}),
+    'webp': ('WEBP', 'webp', 'image/webp', {}),
+    'avif': ('AVIF', 'avif', 'image/avif', {}),
+}
+
+# PIL formats which can keep an alpha channel.
+ALPHA_FORMATS = ('PNG', 'WEBP', 'AVIF')
+
+
+def _add_mimetypes():
+    # So that Django's static view serves thumbnails with the right
+    # Content-Type.
+    for pil_format, ext, mime_type, options in OUTPUT_FORMATS.values():
+        mimetypes.add_type(mime_type, '.%s' % ext)
+_add_mimetypes()
+
+_state = threading.local()
+
+
+def supported(name):
+    """
+    Returns True if PIL can write the format ``name``.
+    """
+    Image.init()
+    return OUTPUT_FORMATS[name][0] in Image.SAVE
+
+
+def extension(name):
+    return OUTPUT_FORMATS[name][1]
+
+
+def set_accept(accept):
+    """
+    Sets the Accept header formats are chosen by in this thread (None when
+    not handling a request).
+    """
+    _state.accept = accept
+    _state.negotiations = 0
+
+
+def negotiated():
+    """
+    Records that output depends on the Accept header, e.g. when a cached copy
+    of output which did is used.
+    """
+    _state.negotiations = negotiations() + 1
+
+
+def negotiations():
+    """
+    Returns how many times since set_accept output depended on the Accept
+    header.  Comparing counts tells whether rendering something did.
+    """
+    return getattr(_state, 'negotiations', 0)
+
+
+def varies():
+    """
+    Returns True if anything since set_accept depended on the Accept header.
+    """
+    return negotiations() > 0
+
+
+def accepted_types(accept=None):
+    """
+    Returns the mime types the Accept header lists explicitly (wildcards
+    don't say whether a format can be shown).
+    """
+    if accept is None:
+        accept = getattr(_state, 'accept', None)
+    types = []
+    for item in (accept or '').split(','):
+        params = item.strip().split(';')
+        mime_type = params[0].strip().lower()
+        if not mime_type or '*' in mime_type:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            key, sep, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        if q > 0:
+            types.append(mime_type)
+    return types
+
+
+def accepted_formats():
+    """
+    Returns the names of the supported formats the current request accepts,
+    sorted, for caching pages which contain negotiated thumbnails.
+    """
+    types = accepted_types()
+    names = [name for name, (pil_format, extension, mime_type, options)
+             in OUTPUT_FORMATS.items()
+             if mime_type in types and supported(name)]
+    names.sort()
+    return names
+
+
+def choose_format(formats, accept=None):
+    """
+    Returns the output format for ``formats``, a name or a sequence of names
+    in order of preference (see above).  ``accept`` defaults to the Accept
+    header of the request being handled.
+    """
+    if isinstance(formats, basestring):
+        formats = [formats]
+    for name in formats:
+        if name not in OUTPUT_FORMATS:
+            raise TypeError('Thumbnail received an invalid format: %s' % name)
+    if len(formats) == 1:
+        return formats[0]
+    if accept is None:
+        negotiated()
+    types = accepted_types(accept)
+    for name in formats[:-1]:
+        if OUTPUT_FORMATS[name][2] in types and supported(name):
+            return name
+    return formats[-1]
@@ -1,10 +1,15 @@
 import os
 
+from PIL import Image
+
 from django.conf import settings
-from django.utils.encoding import iri_to_uri
+from django.utils.encoding import iri_to_uri, smart_str
 
 from sorl.thumbnail.base import Thumbnail
-from sorl.thumbnail.processors import dynamic_import
+from sorl.thumbnail import metadata
+from sorl.thumbnail import manifest
+from sorl.thumbnail.content import source_digest
+from sorl.thumbnail.spec import get_spec, get_storage, setting, sign
 from sorl.thumbnail import defaults
 
 
@@ -26,60 +31,184 @@ def get_thumbnail_setting(setting, override=None):
 class DjangoThumbnail(Thumbnail):
     def __init__(self, relative_source, requested_size, opts=None,
                  quality=None, basedir=None, subdir=None, prefix=None,
-                 relative_dest=None, processors=None):
-        # Set the absolute filename for the source file
+                 relative_dest=None, processors=None, background=None,
+                 generate=True, format=None, accept=None, storage=None,
+                 view=None):
+        # Set the storage (THUMBNAIL_STORAGE's, unless one is given) and the
+        # source's name in it
+        self.storage = storage or get_storage()
         source = self._absolute_path(relative_source)
 
-        quality = get_thumbnail_setting('QUALITY', quality)
-        convert_path = get_thumbnail_setting('CONVERT')
-        wvps_path = get_thumbnail_setting('WVPS')
-        if processors is None:
-            processors = dynamic_import(get_thumbnail_setting('PROCESSORS'))
+        # Everything that doesn't depend on the source is looked up in a
+        # compiled spec. A list of formats is negotiated with the Accept
+        # header (of the request being handled, unless one is given).
+        self.spec = get_spec(requested_size, opts=opts, quality=quality,
+                             format=format, processors=processors,
+                             basedir=basedir, subdir=subdir, prefix=prefix,
+                             accept=accept)
 
         # Call super().__init__ now to set the opts attribute. generate() won't
         # get called because we are not setting the dest attribute yet.
-        super(DjangoThumbnail, self).__init__(source, requested_size,
-            opts=opts, quality=quality, convert_path=convert_path,
-            wvps_path=wvps_path, processors=processors)
+        super(DjangoThumbnail, self).__init__(source,
+            self.spec.requested_size, opts=self.spec.opts,
+            quality=self.spec.quality, convert_path=self.spec.convert_path,
+            wvps_path=self.spec.wvps_path, processors=self.spec.processors,
+            format=self.spec.format, storage=self.storage)
+
+        # Thumbnails the view's URLs can describe are left to the view
+        # (sorl.thumbnail.views) to generate, if THUMBNAIL_VIEW_URL is set
+        # and ``view`` isn't False.
+        self.relative_source = relative_source
+        self.view_url = None
+        if view is not False and relative_dest is None and not \
+           [arg for arg in (processors, basedir, subdir, prefix)
+            if arg is not None]:
+            self.view_url = setting('VIEW_URL')
 
         # Get the relative filename for the thumbnail image, then set the
-        # destination filename
+        # destination filename. Content addressed thumbnails are named after
+        # a digest of the source (see sorl.thumbnail.content), so they never
+        # change once made.
+        self.immutable = False
         if relative_dest is None:
-            self.relative_dest = \
-               self._get_relative_thumbnail(relative_source, basedir=basedir,
-                                            subdir=subdir, prefix=prefix)
+            digest = None
+            if setting('CONTENT_ADDRESSED'):
+                digest = self._source_digest()
+            if digest is not None:
+                self.relative_dest = self.spec.content_dest(digest)
+                self.immutable = True
+            else:
+                self.relative_dest = self.spec.relative_dest(relative_source)
         else:
             self.relative_dest = relative_dest
         self.dest = self._absolute_path(self.relative_dest)
 
-        # Call generate now that the dest attribute has been set
-        self.generate()
+        # Call generate now that the dest attribute has been set, unless the
+        # thumbnail is known to exist already or is left to a background
+        # worker or the view.
+        self.pending = False
+        if generate:
+            self._generate_or_queue(background)
 
         # Set the relative & absolute url to the thumbnail
         self.relative_url = \
             iri_to_uri('/'.join(self.relative_dest.split(os.sep)))
-        self.absolute_url = '%s%s' % (settings.MEDIA_URL, self.relative_url)
+        self.absolute_url = '%s%s' % (setting('STORAGE_URL') or
+                                      settings.MEDIA_URL, self.relative_url)
+        placeholder_url = setting('PLACEHOLDER_URL')
+        if self.pending and placeholder_url:
+            from sorl.thumbnail.background import placeholder_shown
+            placeholder_shown()
+            self.absolute_url = placeholder_url
+        elif self.view_url and (hasattr(self, 'source_mtime') or
+                                self.source_exists):
+            # A thumbnail known from its metadata needs no lookups.
+            self.absolute_url = self._get_view_url()
+
+    def _generate_or_queue(self, background):
+        cached = None
+        if setting('METADATA_CACHE'):
+            cached = metadata.get_metadata(self.dest)
+        if cached is not None:
+            self._size = cached['size']
+            self._filesize = cached['filesize']
+            self.source_mtime = cached['source_mtime']
+            if self.immutable:
+                # The thumbnail may have been made for another source with
+                # the same content, but this one uses it too.
+                manifest.record(self)
+        elif self.view_url and self.source_exists:
+            # The view generates it when its URL is first requested.
+            self._size = self._placeholder_size()
+        elif setting('BACKGROUND', background) and \
+           self.source_exists and self.needs_generating():
+            from sorl.thumbnail.background import get_queue
+            get_queue().put(self)
+            self.pending = True
+            self._size = self._placeholder_size()
+        else:
+            self.generate()
+            self.record()
+
+    def record(self):
+        """
+        Caches the metadata of the generated thumbnail and records it in the
+        manifest, as far as the settings ask for either.
+        """
+        if setting('METADATA_CACHE'):
+            self.cache_metadata()
+        if setting('MANIFEST') or setting('CONTENT_ADDRESSED'):
+            manifest.record(self)
+
+    def _source_digest(self):
+        """
+        Returns the digest of the source's content, or None if it doesn't
+        exist.  Its existence and modification time are looked up together.
+        """
+        if not isinstance(self.source, basestring):
+            return None
+        mtime = self.storage.mtimes([self.source])[self.source]
+        self._source_exists = mtime is not None
+        if not self._source_exists:
+            return None
+        return source_digest(self.source, self.storage, mtime)
+
+    def needs_generating(self, mtimes=None):
+        if self.immutable:
+            # A newer copy of the same content needs no new thumbnail.
+            if mtimes is None:
+                return not self.storage.exists(self.dest)
+            return mtimes[self.dest] is None
+        return super(DjangoThumbnail, self).needs_generating(mtimes)
 
-    def _get_relative_thumbnail(self, relative_source,
-                                basedir=None, subdir=None, prefix=None):
+    def cache_metadata(self):
+        if self.source_exists and isinstance(self.source, basestring):
+            self.source_mtime = self.storage.mtime(self.source)
+        else:
+            self.source_mtime = None
+        metadata.set_metadata(self.dest, self.size, self.filesize,
+                              self.source_mtime)
+
+    def _placeholder_size(self):
         """
-        Returns the thumbnail filename including relative path.
+        Returns the size the thumbnail will have, as far as it can be told
+        from the source's header without decoding it.
         """
-        basedir = get_thumbnail_setting('BASEDIR', basedir)
-        subdir = get_thumbnail_setting('SUBDIR', subdir)
-        prefix = get_thumbnail_setting('PREFIX', prefix)
-        path, filename = os.path.split(relative_source)
-        basename, ext = os.path.splitext(filename)
-        name = '%s%s' % (basename, ext.replace(".", "_"))
-        size = '%sx%s' % self.requested_size
-        opts = self.opts and ('%s_' % '_'.join(self.opts)) or ''
-        thumbnail_filename = '%s%s_%s_%sq%s.jpg' % (prefix, name, size,
-                                                    opts, self.quality)
-        return os.path.join(basedir, path, subdir, thumbnail_filename)
+        if 'crop' in self.opts or self.source_filetype in ('pdf', 'doc'):
+            return tuple(self.requested_size)
+        try:
+            x, y = [float(v) for v in
+                    Image.open(self.storage.open(self.source)).size]
+        except IOError:
+            return tuple(self.requested_size)
+        xr, yr = [float(v) for v in self.requested_size]
+        r = min(xr/x, yr/y)
+        if r > 1.0 and 'upscale' not in self.opts:
+            r = 1.0
+        return (int(x*r), int(y*r))
+
+    def _get_view_url(self):
+        """
+        Returns the signed URL the view serves the thumbnail at.  The
+        source's modification time is added to it, so that the URL changes
+        with the source and can be cached for a long time.
+        """
+        path = '/'.join(smart_str(self.relative_source).split(os.sep))
+        url_name = self.spec.url_name
+        source_mtime = getattr(self, 'source_mtime', None)
+        if source_mtime is None:
+            source_mtime = self.storage.mtime(self.source)
+        return '%s%s/%s/%s?v=%d' % (self.view_url, sign(url_name, path),
+                                    url_name, iri_to_uri(path), source_mtime)
 
     def _absolute_path(self, filename):
-        absolute_filename = os.path.join(settings.MEDIA_ROOT, filename)
-        return absolute_filename.encode(settings.FILE_CHARSET)
+        """
+        Returns a filename relative to MEDIA_ROOT as the storage names it: an
+        absolute path for the local filesystem, and unchanged otherwise.
+        """
+        if self.storage.local:
+            filename = os.path.join(settings.MEDIA_ROOT, filename)
+        return filename.encode(settings.FILE_CHARSET)
 
     def __unicode__(self):
         return self.absolute_url
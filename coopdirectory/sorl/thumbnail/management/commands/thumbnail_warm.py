@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from sorl.thumbnail.warmer import warm
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+            default=None,
+            help='How many worker processes to use (default: one per CPU).'),
+        make_option('--state-file', dest='state_file', default=None,
+            help='Where to record finished sources, so that an interrupted '
+                 'run can be resumed (default: MEDIA_ROOT/'
+                 '.thumbnail_warm_state).'),
+        make_option('--restart', action='store_true', dest='restart',
+            default=False,
+            help='Start over rather than resuming an interrupted run.'),
+    )
+    help = 'Generates every missing or out of date thumbnail of every ' \
+           'ImageWithThumbnailsField.'
+
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def progress(done, total, name, count, error):
+            if error is not None:
+                print "%s: %s" % (name, error)
+            elif verbosity > 1:
+                print "%s: %d thumbnails generated" % (name, count)
+            if verbosity > 0 and (done % 10 == 0 or done == total):
+                print "%d/%d sources done" % (done, total)
+
+        generated = warm(processes=options.get('processes'),
+                         state_file=options.get('state_file'),
+                         restart=options.get('restart'), progress=progress)
+        if verbosity > 0:
+            print "%d thumbnails generated" % generated
@@ -0,0 +1,75 @@
+"""
+Thumbnail metadata cache.
+
+Building a DjangoThumbnail normally stats the source and the thumbnail to
+see whether the thumbnail is up to date, then opens the thumbnail with PIL
+to read its dimensions.  Once a thumbnail exists, its metadata (dimensions,
+filesize and the mtime of the source it was made from) is kept here under
+its absolute path instead, so that rendering it again needs no filesystem
+access at all.
+
+Metadata is kept in a per-process LRU cache in front of Django's cache, so
+that it is shared between processes.  Entries are dropped when their
+thumbnails are deleted through sorl.thumbnail.utils, which happens whenever
+an ImageWithThumbnailsField saves a new file.  A source replaced by other
+means isn't noticed until its entries expire, which is why
+THUMBNAIL_METADATA_CACHE is off by default.
+"""
+
+import os
+
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+
+from sorl.thumbnail.utils import LRUCache
+
+
+_local = None
+
+def _local_cache():
+    # Created on first use, as the setting can't be read while
+    # sorl.thumbnail.main (which imports this module) is being imported.
+    global _local
+    if _local is None:
+        from sorl.thumbnail.main import get_thumbnail_setting
+        _local = LRUCache(get_thumbnail_setting('METADATA_CACHE_SIZE'))
+    return _local
+
+
+def _cache_key(dest):
+    return 'sorl-thumbnail-metadata.%s' % md5_constructor(dest).hexdigest()
+
+
+def get_metadata(dest):
+    """
+    Returns the metadata of the thumbnail at ``dest`` (an absolute path) as
+    a dictionary with ``size``, ``filesize`` and ``source_mtime`` keys, or
+    None if it isn't cached.
+    """
+    dest = os.path.normpath(dest)
+    metadata = _local_cache().get(dest)
+    if metadata is None:
+        metadata = cache.get(_cache_key(dest))
+        if metadata is not None:
+            _local_cache().set(dest, metadata)
+    return metadata
+
+
+def set_metadata(dest, size, filesize, source_mtime):
+    from sorl.thumbnail.main import get_thumbnail_setting
+    dest = os.path.normpath(dest)
+    metadata = {
+        'size': tuple(size),
+        'filesize': filesize,
+        'source_mtime': source_mtime,
+    }
+    _local_cache().set(dest, metadata)
+    cache.set(_cache_key(dest), metadata,
+              get_thumbnail_setting('METADATA_CACHE_TIMEOUT'))
+    return metadata
+
+
+def delete_metadata(dest):
+    dest = os.path.normpath(dest)
+    _local_cache().delete(dest)
+    cache.delete(_cache_key(dest))
@@ -0,0 +1,196 @@
+"""
+Compiled thumbnail specs.
+
+Most of what building a DjangoThumbnail works out doesn't depend on the
+source: the settings it falls back to, the processor chain, the checked and
+ordered options and the end of the thumbnail's name.  The arguments are
+resolved against the settings once per distinct set of arguments, and a
+ThumbnailSpec is made once per resolved (size, options, quality, format,
+processors, basedir, subdir, prefix), so that building a thumbnail on a hot
+render path is two dictionary lookups plus naming the thumbnail after its
+source.  Only a list of formats is negotiated on every call.
+
+The settings are read once per process too, and the storage named by
+THUMBNAIL_STORAGE is made once.  Call clear() after changing
+THUMBNAIL_* settings at runtime (the tests' ChangeSettings does).
+
+A spec also has a ``url_name`` (like ``240x120_crop_q85.webp``), which the
+thumbnail view's URLs carry (see sorl.thumbnail.views); ``parse_url_name``
+and ``sign`` go with it.
+"""
+
+import os
+import re
+import hmac
+
+from django.conf import settings
+from django.utils.hashcompat import sha_constructor
+
+from sorl.thumbnail.formats import choose_format, extension
+from sorl.thumbnail.processors import dynamic_import, normalize_options
+
+url_name_re = re.compile(r'^(\d+)x(\d+)_((?:[a-z]+_)*)q(\d+)\.([a-z]+)$')
+
+_settings = {}
+_resolved = {}
+_specs = {}
+_storage = []
+_processors = []
+
+
+def setting(name, override=None):
+    """
+    get_thumbnail_setting, read once per process.
+    """
+    if override is not None:
+        return override
+    try:
+        return _settings[name]
+    except KeyError:
+        from sorl.thumbnail.main import get_thumbnail_setting
+        value = _settings[name] = get_thumbnail_setting(name)
+        return value
+
+
+def clear():
+    _settings.clear()
+    _resolved.clear()
+    _specs.clear()
+    del _storage[:]
+    del _processors[:]
+
+
+def get_storage():
+    """
+    Returns the process's instance of the THUMBNAIL_STORAGE class (see
+    sorl.thumbnail.storage).
+    """
+    if not _storage:
+        _storage.append(dynamic_import([setting('STORAGE')])[0]())
+    return _storage[0]
+
+
+def default_processors():
+    """
+    Returns the processor chain named by THUMBNAIL_PROCESSORS.
+    """
+    if not _processors:
+        _processors.extend(dynamic_import(setting('PROCESSORS')))
+    return _processors
+
+
+class ThumbnailSpec(object):
+    def __init__(self, requested_size, opts, quality, format, processors,
+                 basedir, subdir, prefix):
+        self.requested_size = requested_size
+        self.opts = normalize_options(processors, opts)
+        self.quality = quality
+        self.format = format
+        self.processors = processors
+        self.basedir = basedir
+        self.subdir = subdir
+        self.prefix = prefix
+        self.convert_path = setting('CONVERT')
+        self.wvps_path = setting('WVPS')
+        self.content_dir = setting('CONTENT_DIR')
+        opts = self.opts and ('%s_' % '_'.join(self.opts)) or ''
+        self.suffix = '_%sx%s_%sq%s.%s' % (requested_size[0],
+                                           requested_size[1], opts, quality,
+                                           extension(format))
+        self.url_name = '%sx%s_%sq%s.%s' % (requested_size[0],
+                                            requested_size[1], opts, quality,
+                                            format)
+
+    def relative_dest(self, relative_source):
+        """
+        Returns the thumbnail filename including relative path.
+        """
+        path, filename = os.path.split(relative_source)
+        basename, ext = os.path.splitext(filename)
+        name = '%s%s%s' % (basename, ext.replace(".", "_"), self.suffix)
+        return os.path.join(self.basedir, path, self.subdir,
+                            '%s%s' % (self.prefix, name))
+
+    def content_dest(self, digest):
+        """
+        Returns the relative filename of the content addressed thumbnail of
+        a source with this hex ``digest``.
+        """
+        return os.path.join(self.content_dir, digest[:2],
+                            '%s%s' % (digest, self.suffix))
+
+
+def get_spec(requested_size, opts=None, quality=None, format=None,
+             processors=None, basedir=None, subdir=None, prefix=None,
+             accept=None):
+    """
+    Returns the ThumbnailSpec for these DjangoThumbnail arguments.  A list
+    of formats is negotiated with ``accept`` (see
+    sorl.thumbnail.formats.choose_format) each time, as it may differ
+    between requests.
+    """
+    args = (tuple(requested_size), tuple(opts or ()), quality,
+            _hashable(format), processors and tuple(processors), basedir,
+            subdir, prefix)
+    resolved = _resolved.get(args)
+    if resolved is None:
+        resolved = _resolved[args] = _resolve(requested_size, opts, quality,
+                                              format, processors, basedir,
+                                              subdir, prefix)
+    format = resolved[3]
+    if isinstance(format, tuple):
+        format = choose_format(format, accept)
+    key = resolved[:3] + (format,) + resolved[4:]
+    spec = _specs.get(key)
+    if spec is None:
+        spec = _specs[key] = ThumbnailSpec(*key)
+    return spec
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _resolve(requested_size, opts, quality, format, processors, basedir,
+             subdir, prefix):
+    """
+    Returns get_spec's arguments with the settings filled in and the options
+    in order, leaving a list of formats (as a tuple) to be negotiated.
+    """
+    if processors is None:
+        processors = default_processors()
+    formats = setting('FORMAT', format)
+    if isinstance(formats, basestring) or len(formats) == 1:
+        # Only checks the name.
+        formats = choose_format(formats)
+    else:
+        formats = tuple(formats)
+    return (tuple(requested_size), tuple(normalize_options(processors, opts)),
+            setting('QUALITY', quality), formats, tuple(processors),
+            setting('BASEDIR', basedir), setting('SUBDIR', subdir),
+            setting('PREFIX', prefix))
+
+
+def parse_url_name(url_name):
+    """
+    Returns the (requested_size, opts, quality, format) of a spec's
+    ``url_name``, or None if it isn't one.
+    """
+    match = url_name_re.match(url_name)
+    if match is None:
+        return None
+    x, y, opts, quality, format = match.groups()
+    return ((int(x), int(y)), [opt for opt in opts.split('_') if opt],
+            int(quality), format)
+
+
+def sign(url_name, path):
+    """
+    Returns the signature of a thumbnail view URL for the spec ``url_name``
+    and the source ``path`` (a '/' separated bytestring relative to
+    MEDIA_ROOT), so that the view only makes the thumbnails pages ask for.
+    """
+    return hmac.new(settings.SECRET_KEY, '%s/%s' % (url_name, path),
+                    sha_constructor).hexdigest()[:20]
@@ -0,0 +1,158 @@
+"""
+Where Thumbnail reads its source and writes the thumbnail.
+
+A storage maps names (absolute paths, for LocalStorage) to file contents
+and modification times.  Thumbnail only uses the methods of Storage, so
+thumbnails can be made from and into the local filesystem (the default),
+memory (MemoryStorage, for tests and benchmarks) or the App Engine
+datastore (sorl.thumbnail.datastore.DatastoreStorage).  DjangoThumbnail
+uses the storage named by THUMBNAIL_STORAGE.
+
+``mtimes`` checks several names at once; Thumbnail and generate_batch use
+it so that a storage with slow lookups, like the datastore, is asked once
+per thumbnail (or batch) rather than once per file.
+"""
+
+import os
+import time
+import threading
+from shutil import copyfile
+from cStringIO import StringIO
+
+
+class Storage(object):
+    # True if names are local paths which other programs (like ImageMagick
+    # and wvPS, to rasterize documents) can read.
+    local = False
+
+    def mtimes(self, names):
+        """
+        Returns a dictionary of the modification times of ``names`` (as
+        seconds since the epoch), None for those which don't exist.
+        """
+        raise NotImplementedError
+
+    def mtime(self, name):
+        return self.mtimes([name])[name]
+
+    def exists(self, name):
+        return self.mtime(name) is not None
+
+    def size(self, name):
+        raise NotImplementedError
+
+    def open(self, name):
+        """
+        Returns a file-like object to read ``name`` from.  Raises IOError if
+        it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def read(self, name):
+        f = self.open(name)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def save(self, name, data):
+        raise NotImplementedError
+
+    def copy(self, source, dest):
+        self.save(dest, self.read(source))
+
+    def delete(self, name):
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    local = True
+
+    def mtimes(self, names):
+        mtimes = {}
+        for name in names:
+            if os.path.isfile(name):
+                mtimes[name] = os.path.getmtime(name)
+            else:
+                mtimes[name] = None
+        return mtimes
+
+    def exists(self, name):
+        return os.path.isfile(name)
+
+    def size(self, name):
+        return os.path.getsize(name)
+
+    def open(self, name):
+        return open(name, 'rb')
+
+    def _make_directory(self, name):
+        directory = os.path.dirname(name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def save(self, name, data):
+        self._make_directory(name)
+        f = open(name, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+    def copy(self, source, dest):
+        self._make_directory(dest)
+        copyfile(source, dest)
+
+    def delete(self, name):
+        os.remove(name)
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps files in a dictionary, for tests and benchmarks which shouldn't
+    touch the disk.
+    """
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def mtimes(self, names):
+        mtimes = {}
+        for name in names:
+            if name in self.files:
+                mtimes[name] = self.files[name][1]
+            else:
+                mtimes[name] = None
+        return mtimes
+
+    def size(self, name):
+        return len(self._get(name)[0])
+
+    def _get(self, name):
+        try:
+            return self.files[name]
+        except KeyError:
+            raise IOError("No such file: '%s'" % name)
+
+    def open(self, name):
+        return StringIO(self._get(name)[0])
+
+    def save(self, name, data, mtime=None):
+        if mtime is None:
+            mtime = time.time()
+        self.lock.acquire()
+        try:
+            self.files[name] = (data, mtime)
+        finally:
+            self.lock.release()
+
+    def delete(self, name):
+        self.lock.acquire()
+        try:
+            self._get(name)
+            del self.files[name]
+        finally:
+            self.lock.release()
+
+
+local_storage = LocalStorage()
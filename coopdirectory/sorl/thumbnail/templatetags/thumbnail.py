@@ -4,12 +4,14 @@ from django.template import Library, Node, Variable, VariableDoesNotExist, Templ
 from django.conf import settings
 from django.utils.encoding import force_unicode
 from sorl.thumbnail.main import DjangoThumbnail, get_thumbnail_setting
+from sorl.thumbnail.formats import OUTPUT_FORMATS
 from sorl.thumbnail.processors import dynamic_import, get_valid_options
 
 register = Library()
 
 size_pat = re.compile(r'(\d+)x(\d+)$')
 quality_pat = re.compile(r'quality=([1-9]\d?|100)$')
+format_pat = re.compile(r'format=(\w+(?:/\w+)*)$')
 
 filesize_formats = ['k', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y']
 filesize_long_formats = {
@@ -104,6 +106,12 @@ def thumbnail(parser, token):
 
         {% thumbnail image 80x80 quality=95,crop %}
 
+    The output format can be given too, or a list of formats to choose from
+    by the browser's Accept header, separated by slashes (the last is used
+    if none of the others is accepted)::
+
+        {% thumbnail image 80x80 crop,format=webp/jpeg %}
+
     To put the DjangoThumbnail class on the context instead of just rendering
     the absolute url, finish the tag with "as [context_var_name]"::
 
@@ -143,10 +151,19 @@ def thumbnail(parser, token):
             opts.append(arg)
         else:
             m = quality_pat.match(arg)
+            if m:
+                kwargs['quality'] = int(m.group(1))
+                continue
+            m = format_pat.match(arg)
             if not m:
                 raise TemplateSyntaxError(
                     "'%s' tag received a bad argument: '%s'" % (tag, arg))
-            kwargs['quality'] = int(m.group(1))
+            formats = m.group(1).split('/')
+            for format in formats:
+                if format not in OUTPUT_FORMATS:
+                    raise TemplateSyntaxError(
+                        "'%s' tag received a bad format: '%s'" % (tag, format))
+            kwargs['format'] = len(formats) == 1 and formats[0] or formats
     return ThumbnailNode(source_var, size_var, opts=opts,
                          context_name=context_name, **kwargs)
 
@@ -3,6 +3,8 @@ import os
 from PIL import Image
 from django.conf import settings
 from sorl.thumbnail.base import Thumbnail
+from sorl.thumbnail.metadata import delete_metadata
+from sorl.thumbnail import spec
 
 try:
     set
@@ -31,6 +33,8 @@ class ChangeSettings:
         self.default_settings = DEFAULT_THUMBNAIL_SETTINGS.copy()
 
     def change(self, override=None):
+        # Settings are read once into compiled thumbnail specs.
+        spec.clear()
         if override is not None:
             self.default_settings.update(override)
         for setting, default in self.default_settings.items():
@@ -43,6 +47,7 @@ class ChangeSettings:
                 setattr(settings, settings_s, default)
 
     def revert(self):
+        spec.clear()
         for setting in self.default_settings:
             settings_s = 'THUMBNAIL_%s' % setting
             self_s = 'original_%s' % setting
@@ -91,5 +96,6 @@ class BaseTest(unittest.TestCase):
         # Remove all the files that have been created
         for image in self.images_to_delete:
             os.remove(image)
+            delete_metadata(image)
         # Change settings back to original
         self.change_settings.revert()
@@ -1,13 +1,31 @@
 import unittest
 import os
+import copy
 import time
+import threading
+from cStringIO import StringIO
 
-from PIL import Image
+from PIL import Image, ImageChops, ImageFilter
 from django.conf import settings
+from django.http import HttpRequest, Http404
 
-from sorl.thumbnail.base import Thumbnail
+from sorl.thumbnail.base import Thumbnail, batch, generate_batch
+from sorl.thumbnail.documents import Rasterizer, ConversionError
 from sorl.thumbnail.main import DjangoThumbnail, get_thumbnail_setting
-from sorl.thumbnail.processors import dynamic_import, get_valid_options
+from sorl.thumbnail.spec import get_storage
+from sorl.thumbnail.metadata import LRUCache, delete_metadata
+from sorl.thumbnail.background import ThumbnailQueue, get_queue, \
+     placeholders_shown
+from sorl.thumbnail import manifest
+from sorl.thumbnail.content import file_digest
+from sorl.thumbnail.storage import LocalStorage, MemoryStorage
+from sorl.thumbnail.utils import thumbnails_for_file, delete_thumbnails
+from sorl.thumbnail.views import serve
+from sorl.thumbnail.benchmarks import processor_chain_records, \
+     processor_chains, peak_rss_kb
+from sorl.thumbnail import processors
+from sorl.thumbnail.processors import dynamic_import, get_valid_options, \
+     autocrop_bbox
 from sorl.thumbnail.tests.base import BaseTest, RELATIVE_PIC_NAME, PIC_NAME, THUMB_NAME, PIC_SIZE
 
 
@@ -54,6 +72,175 @@ class ThumbnailTest(BaseTest):
         self.assertNotEqual(os.path.getmtime(thumb_name), thumb_mtime)
 
 
+    def testRasterizer(self):
+        rasterizer = Rasterizer(workers=1, timeout=0.5)
+        self.assertEqual(rasterizer.run(('cat',), 'page'), 'page')
+        self.assertRaises(ConversionError, rasterizer.run, ('false',))
+        self.assertRaises(ConversionError, rasterizer.run, ('sleep', '5'))
+        self.assertRaises(ConversionError, rasterizer.run,
+                          ('/nonexistent/convert',))
+
+        # The first page is converted once per source modification time,
+        # at the largest size asked for so far.
+        converted = []
+        def convert(filename, size, convert_path):
+            converted.append(filename)
+            output = StringIO()
+            Image.new('RGB', size).save(output, 'PNG')
+            return output.getvalue()
+        rasterizer._convert = convert
+        for i in range(2):
+            page = rasterizer.rasterize(PIC_NAME, 'pdf', (30, 20))
+        self.assertEqual(page.size, (30, 20))
+        self.assertEqual(converted, [PIC_NAME])
+        page = rasterizer.rasterize(PIC_NAME, 'pdf', (60, 40))
+        self.assertEqual(page.size, (60, 40))
+        for size in ((30, 20), (15, 10)):
+            page = rasterizer.rasterize(PIC_NAME, 'pdf', size)
+            self.assertEqual(page.size, size)
+        self.assertEqual(converted, [PIC_NAME, PIC_NAME])
+        later = time.time() + 10
+        os.utime(PIC_NAME, (later, later))
+        rasterizer.rasterize(PIC_NAME, 'pdf', (30, 20))
+        self.assertEqual(converted, [PIC_NAME] * 3)
+
+    def testReducedDecode(self):
+        # scale_and_crop decodes the JPEG source at a reduced scale...
+        thumb = Thumbnail(source=PIC_NAME, dest=THUMB_NAME % 9,
+                          requested_size=(100, 100))
+        self.verify_thumbnail((100, 75), thumb)
+        self.assertTrue(thumb.source_data.size < PIC_SIZE)
+        # ...but the source's own size is still reported.
+        self.assertEqual((thumb.source_width(), thumb.source_height()),
+                         PIC_SIZE)
+
+        # It measurably saves memory: a full decode of this source is
+        # 2000x1500 at 4 bytes a pixel.
+        source = os.path.join(settings.MEDIA_ROOT,
+                              'sorl-thumbnail-test_large.jpg')
+        Image.new('RGB', (2000, 1500)).save(source, 'JPEG')
+        self.images_to_delete.add(source)
+        full = peak_rss_kb(source, [processors.scale_and_crop], (100, 100),
+                           [], preload=True)
+        reduced = peak_rss_kb(source, [processors.scale_and_crop],
+                              (100, 100), [])
+        self.assertTrue(full - reduced > 8000, (full, reduced))
+
+    def testFastAutocrop(self):
+        im = Image.new('RGB', PIC_SIZE, (255, 255, 255))
+        im.paste((0, 0, 0), (100, 50, 700, 550))
+        for source in (Image.open(PIC_NAME), im):
+            self.assertEqual(autocrop_bbox(source),
+                             self._autocrop_bbox(source))
+        self.assertEqual(autocrop_bbox(im), (100, 50, 700, 550))
+        # Another background colour, and a tolerance to go with it.
+        im = Image.new('RGB', PIC_SIZE, (0, 0, 255))
+        im.paste((0, 0, 200), (100, 50, 700, 550))
+        self.assertEqual(autocrop_bbox(im, (0, 0, 255), 2),
+                         (100, 50, 700, 550))
+        self.assertEqual(autocrop_bbox(im, (0, 0, 255), 10), None)
+
+    def _autocrop_bbox(self, im):
+        # The box autocrop crops to.
+        bw = im.convert("1").filter(ImageFilter.MedianFilter)
+        return ImageChops.difference(bw, Image.new("1", im.size, 255)
+                                     ).getbbox()
+
+    def testProcessorChainBenchmark(self):
+        # Every processor is benchmarked, in the default chain or in one
+        # of its own.
+        chains = processor_chains()
+        self.assertEqual(chains[0], PROCESSORS)
+        benchmarked = []
+        for chain in chains:
+            benchmarked.extend(chain)
+        for name in dir(processors):
+            processor = getattr(processors, name)
+            if hasattr(processor, 'valid_options'):
+                self.assertTrue(processor in benchmarked)
+
+        records = processor_chain_records(sizes=((40, 30),), modes=('RGB',),
+                                          formats=('PNG',), memory=False)
+        self.assertEqual(len(records),
+                         sum([2 ** len(get_valid_options(chain))
+                              for chain in chains]))
+        self.assertEqual(records[0]['options'], [])
+        for record in records[:2 ** len(VALID_OPTIONS)]:
+            self.assertEqual([stage['processor'] for stage in
+                              record['stages']],
+                             [p.__name__ for p in PROCESSORS])
+            self.assertTrue(record['output_bytes'] > 0)
+
+        # Memory is measured, so a processor making a full-size copy shows.
+        source = os.path.join(settings.MEDIA_ROOT,
+                              'sorl-thumbnail-test_large.png')
+        Image.new('RGB', (1600, 1200)).save(source)
+        self.images_to_delete.add(source)
+        kept = peak_rss_kb(source, [processors.filters], (100, 100), [],
+                           loaded=True)
+        copied = peak_rss_kb(source, [processors.filters], (100, 100),
+                             ['detail'], loaded=True)
+        # The copy is 1600x1200 at 4 bytes a pixel.
+        self.assertTrue(copied - kept > 6000, (kept, copied))
+
+    def testBatch(self):
+        specs = [
+            {'requested_size': (240, 240), 'dest': THUMB_NAME % 5},
+            {'requested_size': (400, 400), 'dest': THUMB_NAME % 6},
+            {'requested_size': (100, 100), 'opts': ['crop'],
+             'dest': THUMB_NAME % 7},
+            {'requested_size': (100, 100), 'opts': ['bw'],
+             'dest': THUMB_NAME % 8},
+        ]
+        thumbs = batch(PIC_NAME, specs)
+        self.verify_thumbnail((240, 180), thumbs[0])
+        self.verify_thumbnail((400, 300), thumbs[1])
+        self.verify_thumbnail((100, 100), thumbs[2])
+        self.verify_thumbnail((100, 75), thumbs[3])
+        self.assertEqual(Image.open(thumbs[3].dest).mode, 'L')
+        # The smaller plain thumbnail was scaled from the larger one.
+        self.assertTrue(thumbs[0].source_data is thumbs[1].data)
+
+        # Up to date thumbnails are left alone.
+        thumbs = [Thumbnail(source=PIC_NAME, requested_size=(240, 240))]
+        thumbs[0].dest = THUMB_NAME % 5
+        self.assertEqual(generate_batch(thumbs), [])
+
+    def testMemoryStorage(self):
+        storage = MemoryStorage()
+        data = open(PIC_NAME, 'rb').read()
+        storage.save('pic.jpg', data, mtime=1)
+        self.assertEqual(storage.mtimes(['pic.jpg', 'missing.jpg']),
+                         {'pic.jpg': 1, 'missing.jpg': None})
+        thumb = Thumbnail(source='pic.jpg', dest='thumb.jpg',
+                          requested_size=(240, 240), storage=storage)
+        self.assertEqual(thumb.size, (240, 180))
+        self.assertEqual(Image.open(storage.open('thumb.jpg')).size,
+                         (240, 180))
+        self.assertEqual(thumb.filesize, storage.size('thumb.jpg'))
+        self.assertEqual(thumb.source_filesize, len(data))
+        self.assertFalse(os.path.exists('thumb.jpg'))
+
+        # Regenerated only once the source is newer.
+        mtime = storage.mtime('thumb.jpg')
+        Thumbnail(source='pic.jpg', dest='thumb.jpg',
+                  requested_size=(240, 240), storage=storage)
+        self.assertEqual(storage.mtime('thumb.jpg'), mtime)
+        storage.save('pic.jpg', data, mtime=mtime + 1)
+        Thumbnail(source='pic.jpg', dest='thumb.jpg',
+                  requested_size=(240, 240), storage=storage)
+        self.assertNotEqual(storage.mtime('thumb.jpg'), mtime)
+
+        # DjangoThumbnail names files relative to the storage, not
+        # MEDIA_ROOT.
+        thumb = DjangoThumbnail(relative_source='pic.jpg',
+                                requested_size=(100, 100), storage=storage)
+        self.assertEqual(thumb.dest, 'pic_jpg_100x100_q85.jpg')
+        self.assertEqual(thumb.size, (100, 75))
+        self.assertTrue(storage.exists(thumb.dest))
+        delete_metadata(thumb.dest)
+
+
 class DjangoThumbnailTest(BaseTest):
     def setUp(self):
         super(DjangoThumbnailTest, self).setUp()
@@ -117,6 +304,294 @@ class DjangoThumbnailTest(BaseTest):
         expected += '_240x120_q85.jpg'
         self.verify_thumbnail((160, 120), thumb, expected_filename=expected)
 
+    def testSpec(self):
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120), opts=['bw', 'crop'])
+        self.verify_thumbnail((240, 120), thumb)
+        again = DjangoThumbnail(relative_source=self.pic_subdir,
+                                requested_size=[240, 120], opts=['crop', 'bw'])
+        self.images_to_delete.add(again.dest)
+        self.assertTrue(again.spec is thumb.spec)
+        self.assertEqual(again.opts, ['bw', 'crop'])
+        self.assertTrue(again.dest.endswith('_240x120_bw_crop_q85.jpg'))
+        # Settings are read again once they have been changed.
+        self.change_settings.change({'QUALITY': 95})
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120), opts=['bw', 'crop'])
+        self.images_to_delete.add(thumb.dest)
+        self.assertEqual(thumb.quality, 95)
+        self.assertFalse(again.spec is thumb.spec)
+
+    def testMetadataCache(self):
+        self.change_settings.change({'METADATA_CACHE': True})
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.verify_thumbnail((160, 120), thumb)
+        filesize = thumb.filesize
+
+        # Once cached, the thumbnail isn't looked at again, even if it has
+        # gone missing.
+        os.remove(thumb.dest)
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.assertFalse(os.path.isfile(thumb.dest))
+        self.assertEqual((thumb.width(), thumb.height()), (160, 120))
+        self.assertEqual(thumb.filesize, filesize)
+        self.assertEqual(thumb.source_mtime, os.path.getmtime(PIC_NAME))
+
+        # Dropping its metadata makes it generate again.
+        delete_metadata(thumb.dest)
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.verify_thumbnail((160, 120), thumb)
+
+    def testSourceReplaced(self):
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.verify_thumbnail((160, 120), thumb)
+        # By default, a source replaced in place is noticed by its
+        # modification time.
+        Image.new('RGB', (600, 600)).save(PIC_NAME, 'JPEG')
+        later = os.path.getmtime(thumb.dest) + 10
+        os.utime(PIC_NAME, (later, later))
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.verify_thumbnail((120, 120), thumb)
+
+    def testBackground(self):
+        self.change_settings.change({'BACKGROUND': True,
+                                     'PLACEHOLDER_URL': '/placeholder.gif'})
+        shown = placeholders_shown()
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.images_to_delete.add(thumb.dest)
+        self.assertTrue(thumb.pending)
+        self.assertEqual(thumb.absolute_url, '/placeholder.gif')
+        self.assertEqual(placeholders_shown(), shown + 1)
+        self.assertEqual((thumb.width(), thumb.height()), (160, 120))
+
+        get_queue().join()
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        self.assertFalse(thumb.pending)
+        self.assertEqual(placeholders_shown(), shown + 1)
+        self.verify_thumbnail((160, 120), thumb)
+
+    def testBackgroundDeduplication(self):
+        # Without workers, nothing leaves the queue.
+        queue = ThumbnailQueue(0)
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120), background=False)
+        self.images_to_delete.add(thumb.dest)
+        self.assertTrue(queue.put(thumb))
+        self.assertFalse(queue.put(thumb))
+        self.assertTrue(queue.is_pending(thumb))
+
+    def testBackgroundFailure(self):
+        queue = ThumbnailQueue(1)
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120), background=False)
+        self.images_to_delete.add(thumb.dest)
+        os.remove(thumb.dest)
+        # A job which fails with something other than a ThumbnailException
+        # doesn't stop the worker from making later ones.
+        bad = copy.copy(thumb)
+        bad.quality = 0
+        self.assertTrue(queue.put(bad))
+        queue.join()
+        self.assertFalse(queue.is_pending(bad))
+        self.assertTrue(queue.put(thumb))
+        queue.join()
+        self.assertTrue(os.path.isfile(thumb.dest))
+
+        # A worker which has died is replaced.
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        queue = ThumbnailQueue(1)
+        queue.threads.append(dead)
+        os.remove(thumb.dest)
+        self.assertTrue(queue.put(thumb))
+        queue.join()
+        self.assertTrue(os.path.isfile(thumb.dest))
+
+    def testLRUCache(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        # 'b' was the least recently used.
+        self.assertFalse('b' in lru)
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        lru.delete('a')
+        self.assertEqual(len(lru), 1)
+
+    def testFormats(self):
+        relative_png = 'sorl-thumbnail-test_alpha.png'
+        png = os.path.join(settings.MEDIA_ROOT, relative_png)
+        Image.new('RGBA', PIC_SIZE, (255, 0, 0, 0)).save(png)
+        self.images_to_delete.add(png)
+        # Transparency is kept where the format can store it.
+        thumb = DjangoThumbnail(relative_source=relative_png,
+                                requested_size=(240, 120), format='png')
+        self.verify_thumbnail((160, 120), thumb)
+        self.assertTrue(thumb.dest.endswith('_240x120_q85.png'))
+        self.assertEqual(Image.open(thumb.dest).mode, 'RGBA')
+        thumb = DjangoThumbnail(relative_source=relative_png,
+                                requested_size=(240, 120), format='pjpeg')
+        self.verify_thumbnail((160, 120), thumb)
+        self.assertEqual(Image.open(thumb.dest).mode, 'RGB')
+
+        # A list of formats is chosen from by the Accept header, falling
+        # back to the last.
+        formats = ('png', 'jpeg')
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120), format=formats,
+                                accept='text/html,image/png;q=0.9,*/*;q=0.8')
+        self.verify_thumbnail((160, 120), thumb)
+        self.assertEqual(Image.open(thumb.dest).format, 'PNG')
+        for accept in ('*/*', 'image/png;q=0', None):
+            thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                    requested_size=(240, 120),
+                                    format=formats, accept=accept)
+            self.assertTrue(thumb.dest.endswith('.jpg'))
+        self.verify_thumbnail((160, 120), thumb)
+        self.assertRaises(TypeError, DjangoThumbnail, RELATIVE_PIC_NAME,
+                          (240, 120), format='gif')
+
+    def testContentAddressed(self):
+        self.change_settings.change({'CONTENT_ADDRESSED': True,
+                                     'CONTENT_DIR': 'test-thumbnail-content',
+                                     'METADATA_CACHE': True})
+        # The two sources have the same content, so they share a thumbnail.
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        shared = DjangoThumbnail(relative_source=self.pic_subdir,
+                                 requested_size=(240, 120))
+        self.assertEqual(thumb.dest, shared.dest)
+        self.assertTrue(thumb.immutable)
+        digest = file_digest(PIC_NAME)
+        content_dir = os.path.join(settings.MEDIA_ROOT,
+                                   'test-thumbnail-content')
+        self.assertEqual(thumb.dest, os.path.join(content_dir, digest[:2],
+                                                  digest + '_240x120_q85.jpg'))
+        self.assertEqual(Image.open(thumb.dest).size, (160, 120))
+
+        # Once known, the digest and the thumbnail only need the source to
+        # be stat'ed.
+        class UnreadStorage(LocalStorage):
+            def open(self, name):
+                raise AssertionError('%s read' % name)
+        again = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120),
+                                storage=UnreadStorage())
+        self.assertEqual(again.dest, thumb.dest)
+
+        # A source replaced in place gets a new digest, and a new thumbnail.
+        Image.new('RGB', (600, 600)).save(self.pic_subdir, 'JPEG')
+        later = os.path.getmtime(self.pic_subdir) + 10
+        os.utime(self.pic_subdir, (later, later))
+        replaced = DjangoThumbnail(relative_source=self.pic_subdir,
+                                   requested_size=(240, 120))
+        self.assertNotEqual(replaced.dest, thumb.dest)
+        self.assertEqual(Image.open(replaced.dest).size, (120, 120))
+
+        # A file is deleted with the last source's thumbnails using it.
+        self.assertEqual(delete_thumbnails(RELATIVE_PIC_NAME), 1)
+        self.assertTrue(os.path.isfile(thumb.dest))
+        self.assertEqual(delete_thumbnails(self.pic_subdir), 2)
+        self.assertFalse(os.path.isfile(thumb.dest))
+        self.assertFalse(os.path.isfile(replaced.dest))
+        for dirname in set([os.path.dirname(thumb.dest),
+                            os.path.dirname(replaced.dest)]):
+            os.rmdir(dirname)
+
+        os.rmdir(content_dir)
+
+    def testManifest(self):
+        self.change_settings.change({'MANIFEST': True})
+        thumbs = [DjangoThumbnail(relative_source=self.pic_subdir,
+                                  requested_size=(240, 120)),
+                  DjangoThumbnail(relative_source=self.pic_subdir,
+                                  requested_size=(100, 100), subdir='subdir')]
+        dests = [thumb.dest for thumb in thumbs]
+        # Found wherever they were made, without listing directories.
+        found = [thumb['filename'] for thumb in
+                 thumbnails_for_file(self.pic_subdir)]
+        found.sort()
+        self.assertEqual(found, sorted(dests))
+
+        # Once the source is gone, its thumbnails are orphans.
+        os.remove(self.pic_subdir)
+        self.images_to_delete.discard(self.pic_subdir)
+        self.assertEqual(manifest.orphans().keys(),
+                         [manifest.relative_name(self.pic_subdir)])
+        self.assertEqual(delete_thumbnails(self.pic_subdir), 2)
+        for dest in dests:
+            self.assertFalse(os.path.isfile(dest))
+            delete_metadata(dest)
+        self.assertEqual(thumbnails_for_file(self.pic_subdir), [])
+        self.assertEqual(manifest.orphans(), {})
+
+    def testManifestStorage(self):
+        # Orphans are found, and thumbnails deleted, through the storage.
+        self.change_settings.change({
+            'MANIFEST': True,
+            'STORAGE': 'sorl.thumbnail.storage.MemoryStorage'})
+        storage = get_storage()
+        storage.save('pic.jpg', open(PIC_NAME, 'rb').read())
+        thumb = DjangoThumbnail(relative_source='pic.jpg',
+                                requested_size=(100, 100))
+        self.assertTrue(storage.exists(thumb.dest))
+        self.assertEqual(manifest.orphans(), {})
+        storage.delete('pic.jpg')
+        self.assertEqual(manifest.orphans().keys(), [u'pic.jpg'])
+        self.assertEqual(delete_thumbnails('pic.jpg'), 1)
+        self.assertFalse(storage.exists(thumb.dest))
+        self.assertEqual(manifest.orphans(), {})
+
+    def testView(self):
+        self.change_settings.change({'VIEW_URL': '/thumbnails/'})
+        thumb = DjangoThumbnail(relative_source=RELATIVE_PIC_NAME,
+                                requested_size=(240, 120))
+        # Not generated while rendering, but sized from the source's header.
+        self.assertFalse(os.path.exists(thumb.dest))
+        self.assertEqual(thumb.size, (160, 120))
+        url, query = thumb.absolute_url.split('?')
+        self.assertEqual(query, 'v=%d' % os.path.getmtime(PIC_NAME))
+        args = url[len('/thumbnails/'):].split('/', 2)
+        self.assertEqual(args[1:], ['240x120_q85.jpeg', RELATIVE_PIC_NAME])
+
+        # Generated when first requested.
+        response = serve(HttpRequest(), *args)
+        self.images_to_delete.add(thumb.dest)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertTrue('max-age' in response['Cache-Control'])
+        data = ''.join(response)
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        self.assertEqual(Image.open(StringIO(data)).size, (160, 120))
+
+        # Conditional and ranged requests.
+        request = HttpRequest()
+        request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+        self.assertEqual(serve(request, *args).status_code, 304)
+        request = HttpRequest()
+        request.META['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+        self.assertEqual(serve(request, *args).status_code, 304)
+        request = HttpRequest()
+        request.META['HTTP_RANGE'] = 'bytes=0-9'
+        response = serve(request, *args)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(''.join(response), data[:10])
+        request.META['HTTP_RANGE'] = 'bytes=%d-' % len(data)
+        self.assertEqual(serve(request, *args).status_code, 416)
+
+        # Only signed specs are served.
+        self.assertRaises(Http404, serve, HttpRequest(), args[0],
+                          '400x400_q85.jpeg', args[2])
+
     def tearDown(self):
         super(DjangoThumbnailTest, self).tearDown()
         subdir = os.path.join(self.sub_dir, 'subdir')
@@ -1,10 +1,16 @@
-import os.path
+import os
+from cStringIO import StringIO
 
+from PIL import Image
 from django.db import models
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 
 from sorl.thumbnail.fields import ImageWithThumbnailsField
-from sorl.thumbnail.tests.base import BaseTest, RELATIVE_PIC_NAME
+from sorl.thumbnail.warmer import warm_source
+
+from sorl.thumbnail.tests.base import BaseTest, RELATIVE_PIC_NAME, PIC_NAME
 
 thumbnail = {
     'size': (50,50)
@@ -21,6 +27,18 @@ class TestThumbnailFieldModel(models.Model):
     photo = ImageWithThumbnailsField(upload_to='test', thumbnail=thumbnail,
                                      extra_thumbnails=extra_thumbnails)
 
+# A storage which writes new files over existing ones of the same name
+class OverwriteStorage(FileSystemStorage):
+    def get_available_name(self, name):
+        if self.exists(name):
+            self.delete(name)
+        return name
+
+class TestOverwriteFieldModel(models.Model):
+    photo = ImageWithThumbnailsField(upload_to='test', thumbnail=thumbnail,
+                                     generate_on_save=False,
+                                     storage=OverwriteStorage())
+
 class FieldTest(BaseTest):
     def test_thumbnail(self):
         model = TestThumbnailFieldModel(photo=RELATIVE_PIC_NAME)
@@ -46,3 +64,69 @@ class FieldTest(BaseTest):
             '/'.join((settings.MEDIA_URL.rstrip('/'),
                       'sorl-thumbnail-test_source_jpg_30x30_crop_q85.jpg'))
         self.assertEqual(tag, expected_tag)
+
+    def test_generate_thumbnails(self):
+        model = TestThumbnailFieldModel(photo=RELATIVE_PIC_NAME)
+        model.photo.generate_thumbnails()
+        for name, size in (('50x50_q85', (50, 37)),
+                           ('30x30_crop_q85', (30, 30))):
+            expected_filename = os.path.join(settings.MEDIA_ROOT,
+                'sorl-thumbnail-test_source_jpg_%s.jpg' % name)
+            self.verify_thumbnail(size, expected_filename=expected_filename)
+        self.assertEqual(model.photo.delete_thumbnails(), 2)
+        self.images_to_delete = set([PIC_NAME])
+
+    def test_save_and_delete(self):
+        model = TestThumbnailFieldModel()
+        model.photo.save('sorl-thumbnail-test_saved.jpg',
+                         ContentFile(open(PIC_NAME, 'rb').read()), save=False)
+        thumb_filename = os.path.join(os.path.dirname(model.photo.path),
+            'sorl-thumbnail-test_saved_jpg_30x30_crop_q85.jpg')
+        self.assertTrue(os.path.isfile(thumb_filename))
+        model.photo.delete(save=False)
+        self.assertFalse(os.path.isfile(thumb_filename))
+        os.rmdir(os.path.dirname(thumb_filename))
+
+    def test_replace_source(self):
+        self.change_settings.change({'METADATA_CACHE': True})
+        model = TestOverwriteFieldModel()
+        name = 'sorl-thumbnail-test_replaced.jpg'
+        model.photo.save(name, ContentFile(open(PIC_NAME, 'rb').read()),
+                         save=False)
+        thumb = model.photo.thumbnail
+        self.assertEqual((thumb.width(), thumb.height()), (50, 37))
+        # Saving a source over the old one replaces its thumbnails, even
+        # though their metadata was cached.
+        replacement = StringIO()
+        Image.new('RGB', (600, 600)).save(replacement, 'JPEG')
+        model.photo.save(name, ContentFile(replacement.getvalue()),
+                         save=False)
+        thumb = model.photo.thumbnail
+        self.assertEqual((thumb.width(), thumb.height()), (50, 50))
+        self.assertEqual(Image.open(thumb.dest).size, (50, 50))
+        model.photo.delete(save=False)
+        self.assertFalse(os.path.isfile(thumb.dest))
+        os.rmdir(os.path.dirname(thumb.dest))
+
+    def test_warm_source(self):
+        job = (RELATIVE_PIC_NAME, [thumbnail, extra_thumbnails['admin']])
+        name, count, error = warm_source(job)
+        self.assertEqual((name, count, error), (RELATIVE_PIC_NAME, 2, None))
+        for name, size in (('50x50_q85', (50, 37)),
+                           ('30x30_crop_q85', (30, 30))):
+            expected_filename = os.path.join(settings.MEDIA_ROOT,
+                'sorl-thumbnail-test_source_jpg_%s.jpg' % name)
+            self.verify_thumbnail(size, expected_filename=expected_filename)
+        # Up to date thumbnails are skipped.
+        self.assertEqual(warm_source(job), (RELATIVE_PIC_NAME, 0, None))
+
+    def test_warm_source_failures(self):
+        # A missing source and invalid arguments are reported, not raised.
+        name, count, error = warm_source(('missing-source.jpg', [thumbnail]))
+        self.assertEqual((name, count), ('missing-source.jpg', 0))
+        self.assertTrue(error)
+        job = (RELATIVE_PIC_NAME,
+               [{'size': (50, 50), 'options': ['nonsense']}])
+        name, count, error = warm_source(job)
+        self.assertEqual((name, count), (RELATIVE_PIC_NAME, 0))
+        self.assertTrue('nonsense' in error)
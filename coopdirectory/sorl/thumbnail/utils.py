@@ -1,8 +1,9 @@
 import re
 import os
+import threading
 
 
-re_thumbnail_file = re.compile(r'(?P<source_filename>.+)_(?P<x>\d+)x(?P<y>\d+)(?:_(?P<options>\w+))?_q(?P<quality>\d+).jpg$')
+re_thumbnail_file = re.compile(r'(?P<source_filename>.+)_(?P<x>\d+)x(?P<y>\d+)(?:_(?P<options>\w+))?_q(?P<quality>\d+)\.(?:jpg|png|webp|avif)$')
 
 
 def all_thumbnails(path, recursive=True, prefix=None, subdir=None):
@@ -74,11 +75,18 @@ def thumbnails_for_file(relative_source_path, root=None, basedir=None,
       `x` and `y` -- the size of the thumbnail
       `options`   -- list of options for this thumbnail
       `quality`   -- quality setting for this thumbnail
+
+    With THUMBNAIL_MANIFEST set (and no root given), the thumbnails are
+    looked up in the manifest, which knows where each one was made, so
+    basedir, subdir and prefix are not needed.
     """
     # Fall back to using thumbnail settings. These are local imports so that
     # there is no requirement of Django to use the utils module.
     if root is None:
         from django.conf import settings
+        from sorl.thumbnail import manifest
+        if manifest.enabled():
+            return manifest.thumbnails_for_source(relative_source_path)
         root = settings.MEDIA_ROOT
     if prefix is None:
         from sorl.thumbnail.main import get_thumbnail_setting
@@ -109,8 +117,20 @@ def delete_thumbnails(relative_source_path, root=None, basedir=None,
 
 
 def _delete_using_thumbs_list(thumbs):
-    for thumb_dict in thumbs:
-        os.remove(thumb_dict['filename'])
+    from sorl.thumbnail import manifest
+    from sorl.thumbnail.metadata import delete_metadata
+    from sorl.thumbnail.spec import get_storage
+    if manifest.enabled():
+        # Content addressed thumbnails still used by other sources are kept.
+        filenames = manifest.release(thumbs)
+    else:
+        filenames = [thumb_dict['filename'] for thumb_dict in thumbs]
+    storage = get_storage()
+    # Thumbnails from the manifest may have been removed by other means.
+    for filename, mtime in storage.mtimes(filenames).items():
+        if mtime is not None:
+            storage.delete(filename)
+        delete_metadata(filename)
     return len(thumbs)
 
 
@@ -120,8 +140,96 @@ def delete_all_thumbnails(path, recursive=True):
 
     By default, matching files from all sub-directories are also removed. To
     only remove from the path directory, set recursive=False.
+
+    With THUMBNAIL_MANIFEST set, the thumbnails recorded in the manifest as
+    being within the path are removed instead.
     """
+    from sorl.thumbnail import manifest
+    if manifest.enabled():
+        found = manifest.thumbnails_in(path, recursive=recursive)
+    else:
+        found = all_thumbnails(path, recursive=recursive)
     total = 0
-    for thumbs in all_thumbnails(path, recursive=recursive).values():
+    for thumbs in found.values():
         total += _delete_using_thumbs_list(thumbs)
     return total
+
+
+class LRUCache(object):
+    """
+    A dictionary holding at most ``size`` items, dropping the least
+    recently used item to make room.  It may be shared between threads.
+    """
+    def __init__(self, size):
+        self.size = size
+        # key: [previous, next, key, value], in a circular list with
+        # self.root, most recently used first.
+        self.links = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def _unlink(self, link):
+        # Called with the lock held, as is _link_first.
+        previous, next = link[0], link[1]
+        previous[1] = next
+        next[0] = previous
+
+    def _link_first(self, link):
+        first = self.root[1]
+        link[0], link[1] = self.root, first
+        first[0] = self.root[1] = link
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._link_first(link)
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[3] = value
+            else:
+                if len(self.links) >= self.size:
+                    last = self.root[0]
+                    self._unlink(last)
+                    del self.links[last[2]]
+                link = self.links[key] = [None, None, key, value]
+            self._link_first(link)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            link = self.links.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.links.clear()
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
@@ -10,6 +10,7 @@ urlpatterns = patterns('',
     (r'^admin/doc/', include('django.contrib.admindocs.urls')),
     (r'^admin/(.*)', admin.site.root),
     (r'^coops/', include('coopdirectory.coops.urls')),
+    (r'^thumbnails/', include('sorl.thumbnail.urls')),
     #TODO: Change this to a better front page.
     (r'^$', 'coopdirectory.coops.views.coop_list'),
 )